@@ -1,5 +1,10 @@
-from . import evaluator, omq, class_list, iou_tools
+__version__ = '0.1.3'
 
-from .evaluator import Evaluator
+from . import assignment, cache, evaluator, omq, options, class_list, iou_tools, preview, report
 
-__all__ = ['evaluator', 'iou_tools', 'class_list', 'omq']
+from .evaluator import EvaluationCancelled, Evaluator
+
+__all__ = [
+    'assignment', 'cache', 'evaluator', 'iou_tools', 'class_list', 'omq',
+    'options', 'preview', 'report'
+]
@@ -0,0 +1,268 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import heapq
+import time
+
+import numpy as np
+from scipy import sparse
+
+# NOTE all assignment problems here are maximum quality matchings between two sets of objects (rows and columns of a
+# quality matrix), where any object may also be left unassigned (i.e. matched with zero quality). Only pairs with
+# non-zero quality are ever considered, so the work done depends on the sparsity of the quality matrix.
+
+
+class IncrementalAssignment(object):
+    """
+    Maximum quality assignment over a sparse quality matrix, built up one row at a time.
+    Each added row is inserted with a single shortest augmenting path search (successive shortest paths with
+    potentials), so after every call to add() the current assignment is optimal for all rows added so far.
+    Internally each row has a private zero quality "unassigned" option, and the potentials are kept so they form an
+    optimal dual solution (column prices are the negated column potentials).
+    """
+
+    def __init__(self, quality):
+        """
+        Initialisation function for an empty assignment
+        :param quality: r x c scipy sparse matrix (or dense numpy array) of pairwise qualities
+        """
+        super(IncrementalAssignment, self).__init__()
+        self.quality = sparse.csr_matrix(quality, dtype=np.float64)
+        self.quality.eliminate_zeros()
+        self.row_match = np.full(self.quality.shape[0], -1, dtype=np.int64)
+        self.col_match = np.full(self.quality.shape[1], -1, dtype=np.int64)
+        self._row_match_quality = np.zeros(self.quality.shape[0])
+        self._row_potentials = np.zeros(self.quality.shape[0])
+        self._col_potentials = np.zeros(self.quality.shape[1])
+
+    def add(self, row):
+        """
+        Adds a row to the assignment, re-optimising along a single augmenting path.
+        :param row: index of the row to be added (each row should only be added once)
+        :return: None
+        """
+        indptr, indices, weights = (self.quality.indptr, self.quality.indices,
+                                    self.quality.data)
+        a, b = indptr[row], indptr[row + 1]
+        if a == b:
+            return  # Nothing this row could ever be assigned to
+
+        # Choose the new row's potential so all of its edges (including the
+        # zero quality "unassigned" option) have non-negative reduced cost
+        rp, cp = self._row_potentials, self._col_potentials
+        rp[row] = max(0.0, np.max(weights[a:b] + cp[indices[a:b]]))
+        d, kind, x, done_rows, done_cols, pred_col, pred_quality = (
+            self._search(row))
+
+        # Update potentials so reduced costs stay non-negative (only nodes
+        # finalised closer than the end of the path change)
+        for r, dr in done_rows.items():
+            rp[r] -= d - dr
+        for j, dj in done_cols.items():
+            cp[j] -= d - dj
+
+        # Flip the matching along the path
+        if kind == 1:
+            r, new_col = pred_col[x], x
+        else:
+            r, new_col = x, -1
+        while True:
+            old_col = self.row_match[r]
+            self.row_match[r] = new_col
+            if new_col >= 0:
+                self.col_match[new_col] = r
+                self._row_match_quality[r] = pred_quality[new_col]
+            else:
+                self._row_match_quality[r] = 0.0
+            if r == row:
+                break
+            new_col = old_col
+            r = pred_col[old_col]
+
+    def reinsertion(self, row):
+        """
+        Find how the assignment would change if the column currently assigned to a row was removed, without changing
+        the assignment. Removing an assigned pair leaves the rest of the assignment optimal, so the new optimal
+        assignment is found by re-inserting the row along a single augmenting path, which only explores the rows &
+        columns connected to it.
+        :param row: index of an assigned row
+        :return: (gain, end_row, end_col). gain is the total quality the re-inserted row's augmenting path adds back
+        (so the total quality changes by gain minus the removed pair's quality). The path either ends by assigning a
+        previously unassigned column end_col (with end_row -1), or by leaving row end_row unassigned (with end_col -1,
+        & end_row possibly the re-inserted row itself).
+        """
+        indptr, indices, weights = (self.quality.indptr, self.quality.indices,
+                                    self.quality.data)
+        removed_col = self.row_match[row]
+        a, b = indptr[row], indptr[row + 1]
+        keep = indices[a:b] != removed_col
+
+        # Search as if the row was being added without the removed column
+        # (restoring the state afterwards)
+        rp = self._row_potentials
+        old_potential = rp[row]
+        rp[row] = max(
+            0.0,
+            np.max(weights[a:b][keep] +
+                   self._col_potentials[indices[a:b][keep]],
+                   initial=0.0))
+        self.row_match[row] = -1
+        self.col_match[removed_col] = -1
+        try:
+            _, kind, x, _, _, pred_col, pred_quality = self._search(
+                row, removed_col)
+        finally:
+            rp[row] = old_potential
+            self.row_match[row] = removed_col
+            self.col_match[removed_col] = row
+
+        # Total the quality changes along the path (the re-inserted row's
+        # removed pair is not counted)
+        gain = 0.0
+        r, new_col = (pred_col[x], x) if kind == 1 else (x, -1)
+        while True:
+            if new_col >= 0:
+                gain += pred_quality[new_col]
+            if r == row:
+                break
+            gain -= self._row_match_quality[r]
+            new_col = self.row_match[r]
+            r = pred_col[new_col]
+        return (gain, -1, x) if kind == 1 else (gain, x, -1)
+
+    def _search(self, row, excluded_col=-1):
+        """
+        Dijkstra's search over alternating paths from an unassigned row, stopping at the first free column or
+        "unassigned" option reached
+        :param row: index of the row the search starts from
+        :param excluded_col: index of a column that is ignored by the search (-1 for none)
+        :return: (d, kind, x, done_rows, done_cols, pred_col, pred_quality). d is the reduced length of the path, kind
+        & x the node it ends at (kind: 1 col x, 2 the unassigned option of row x), done_rows & done_cols the reduced
+        distances of finalised nodes, & pred_col & pred_quality the row (& its quality) each column was reached from.
+        """
+        indptr, indices, weights = (self.quality.indptr, self.quality.indices,
+                                    self.quality.data)
+        rp, cp = self._row_potentials, self._col_potentials
+
+        # (kind: 0 row, 1 col, 2 unassign)
+        done_rows, done_cols = {}, {}
+        best_cols = {}
+        pred_col, pred_quality = {}, {}
+        heap = [(0.0, 0, row)]
+        while heap:
+            d, kind, x = heapq.heappop(heap)
+            if kind == 0:
+                if x in done_rows:
+                    continue
+                done_rows[x] = d
+                heapq.heappush(heap, (d + rp[x], 2, x))
+                for k in range(indptr[x], indptr[x + 1]):
+                    j = indices[k]
+                    if (j == self.row_match[x] or j == excluded_col or
+                            j in done_cols):
+                        continue
+                    nd = d - weights[k] + rp[x] - cp[j]
+                    if nd < best_cols.get(j, np.inf):
+                        best_cols[j] = nd
+                        pred_col[j] = x
+                        pred_quality[j] = weights[k]
+                        heapq.heappush(heap, (nd, 1, j))
+            elif kind == 1:
+                if x in done_cols:
+                    continue
+                done_cols[x] = d
+                if self.col_match[x] < 0:
+                    break
+                r = self.col_match[x]
+                if r not in done_rows:
+                    heapq.heappush(
+                        heap,
+                        (d + self._row_match_quality[r] + cp[x] - rp[r], 0, r))
+            else:
+                break
+        return d, kind, x, done_rows, done_cols, pred_col, pred_quality
+
+    def matching(self):
+        """
+        Get the current assignment
+        :return: (row_idxs, col_idxs) indices of all assigned pairs
+        """
+        row_idxs = np.flatnonzero(self.row_match >= 0)
+        return row_idxs, self.row_match[row_idxs]
+
+    def column_prices(self):
+        """
+        Get non-negative column prices from the current potentials. Together with each row taking its best priced
+        option, these form an optimal dual solution for all rows added so far.
+        :return: c, numpy array of column prices
+        """
+        return np.maximum(-self._col_potentials, 0)
+
+
+def sparse_assignment(quality, time_budget=None):
+    """
+    Solves the assignment problem on the sparse set of pairs with non-zero quality. The solution is optimal unless the
+    time budget runs out, in which case the remaining rows are assigned greedily and a certified upper bound on the
+    quality lost compared to the optimum is calculated from the dual prices (by weak duality).
+    :param quality: g x p scipy sparse matrix (or dense numpy array) of pairwise qualities
+    :param time_budget: time in seconds after which the remaining rows are assigned greedily (None for no limit)
+    :return: (row_idxs, col_idxs, gap). row_idxs & col_idxs are the indices of the assigned pairs (only pairs with
+    non-zero quality are returned), and gap is the upper bound on the total quality lost compared to the optimal
+    assignment (zero when the time budget was not exceeded).
+    """
+    start = time.time()
+    solver = IncrementalAssignment(quality)
+    q = solver.quality
+    complete = True
+    for i in range(q.shape[0]):
+        if time_budget is not None and time.time() - start > time_budget:
+            complete = False
+            break
+        solver.add(i)
+
+    if complete:
+        row_idxs, col_idxs = solver.matching()
+        return row_idxs, col_idxs, 0.0
+
+    # Complete the assignment greedily so no unassigned row & column pair
+    # with non-zero quality remains
+    coo = q.tocoo()
+    row_match, col_match = solver.row_match, solver.col_match
+    for k in np.argsort(-coo.data, kind='stable'):
+        i, j = coo.row[k], coo.col[k]
+        if row_match[i] < 0 and col_match[j] < 0:
+            row_match[i] = j
+            col_match[j] = i
+    row_idxs, col_idxs = solver.matching()
+    total = np.sum(np.asarray(q[row_idxs, col_idxs]).ravel())
+    return (row_idxs, col_idxs,
+            max(
+                0.0,
+                min(_dual_bound(q, solver.column_prices()),
+                    _dual_bound(q, np.zeros(q.shape[1]))) - total))
+
+
+def pad_assignment(row_idxs, col_idxs, n):
+    """
+    Turns a partial assignment into a full assignment of an n x n (padded) table, by pairing all unassigned rows with
+    unassigned columns (including padding rows and columns).
+    :param row_idxs: row indices of the assigned pairs
+    :param col_idxs: column indices of the assigned pairs
+    :param n: size of the padded table
+    :return: (row_idxs, col_idxs) of the full assignment (in the same format as linear_sum_assignment())
+    """
+    free_rows = np.setdiff1d(np.arange(n), row_idxs)
+    free_cols = np.setdiff1d(np.arange(n), col_idxs)
+    rows = np.concatenate((row_idxs, free_rows))
+    cols = np.concatenate((col_idxs, free_cols))
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+def _dual_bound(q, prices):
+    # Any non-negative column prices give a feasible dual solution when each
+    # row takes its best remaining value (or zero), so by weak duality this is
+    # an upper bound on the total quality of any assignment
+    reduced = q.copy()
+    reduced.data = reduced.data - prices[reduced.indices]
+    row_values = np.maximum(reduced.max(axis=1).toarray().ravel(), 0)
+    return np.sum(prices) + np.sum(row_values)
@@ -0,0 +1,345 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+from collections.abc import Sequence
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # No inter-process locking available (i.e. Windows)
+
+_ENTRY_EXTENSION = '.json'
+_LOCK_FILENAME = '.lock'
+_SIZE_FILENAME = '.size'
+_EVICT_FRACTION = 0.9  # Evicting frees space down to this fraction of the bound
+
+
+def _json_default(value):
+    # Allows hashing / saving of the numpy types that creep into sanitised
+    # results data & scores (& sequences like omq.ObjectArrays, which hash the
+    # same as the list of objects they hold)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    elif isinstance(value, np.generic):
+        return value.item()
+    elif isinstance(value, Sequence):
+        return list(value)
+    raise TypeError("Object of type '%s' is not JSON serialisable" %
+                    type(value).__name__)
+
+
+def content_hash(*contents):
+    """
+    Creates a stable hash of arbitrary JSON-like content (dicts are hashed independent of key order).
+    :param contents: any number of JSON serialisable objects (numpy arrays & scalars are also supported)
+    :return: hex string of the SHA-256 hash of the content
+    """
+    h = hashlib.sha256()
+    for c in contents:
+        h.update(
+            json.dumps(c, sort_keys=True,
+                       default=_json_default).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class ScoreCache(object):
+    """
+    Persistent on-disk cache of scores dicts, indexed by content-addressed keys (see content_hash()).
+    Each entry is a single JSON file in the cache directory. Entries are written atomically, & the cache is
+    kept below a maximum size by evicting the least recently used entries, so multiple evaluation processes
+    on the same machine can safely share a cache directory. A running total of the size of all entries is kept
+    alongside them, so the directory is only scanned when entries need evicting (which frees enough space that scans
+    stay rare).
+    """
+
+    def __init__(self, cache_dir, max_bytes=100 * 1024 * 1024):
+        """
+        Initialisation function for the score cache
+        :param cache_dir: directory where cache entries are stored (created if it doesn't exist)
+        :param max_bytes: maximum total size of all cache entries in bytes
+        """
+        super(ScoreCache, self).__init__()
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def get(self, key):
+        """
+        Get the scores stored for a key, marking the entry as recently used.
+        :param key: cache key as created by content_hash()
+        :return: the stored scores dict, or None if there is no (valid) entry for the key
+        """
+        fn = self._entry_filename(key)
+        try:
+            with open(fn, 'r') as f:
+                scores = json.load(f)
+            os.utime(fn, None)
+        except (IOError, OSError, ValueError):
+            # Missing, evicted mid-read, or partially written by a crashed
+            # process... all are simply a cache miss
+            return None
+        return scores
+
+    def put(self, key, scores):
+        """
+        Store the scores for a key, evicting least recently used entries if the cache exceeds its size bound.
+        :param key: cache key as created by content_hash()
+        :param scores: JSON serialisable scores dict
+        :return: None
+        """
+        # Write to a temporary file first so readers never see a partial entry,
+        # then replace the entry & update the running total together
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(scores, f, default=_json_default)
+            size = os.path.getsize(tmp)
+            with _DirectoryLock(os.path.join(self.cache_dir, _LOCK_FILENAME)):
+                fn = self._entry_filename(key)
+                try:
+                    replaced = os.stat(fn).st_size
+                except OSError:
+                    replaced = 0
+                os.replace(tmp, fn)
+                total = self._read_total()
+                if total is None or total + size - replaced > self.max_bytes:
+                    total = self._evict()
+                else:
+                    total += size - replaced
+                self._write_total(total)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _entry_filename(self, key):
+        return os.path.join(self.cache_dir, key + _ENTRY_EXTENSION)
+
+    def _read_total(self):
+        # Running total of the size of all entries (None if it hasn't been
+        # written yet, e.g. for a cache directory from an older version)
+        try:
+            with open(os.path.join(self.cache_dir, _SIZE_FILENAME), 'r') as f:
+                return int(f.read())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write_total(self, total):
+        with open(os.path.join(self.cache_dir, _SIZE_FILENAME), 'w') as f:
+            f.write(str(total))
+
+    def _evict(self):
+        # Scans every entry, evicting least recently used entries until the
+        # cache is back below _EVICT_FRACTION of its bound if it exceeds the
+        # bound (must hold the directory lock). Returns the total size of the
+        # remaining entries.
+        entries = []
+        for fn in os.listdir(self.cache_dir):
+            if not fn.endswith(_ENTRY_EXTENSION):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, fn))
+            except OSError:
+                continue  # Removed by another process
+            entries.append((st.st_mtime, st.st_size, fn))
+
+        total = sum(e[1] for e in entries)
+        if total <= self.max_bytes:
+            return total
+        for _, size, fn in sorted(entries):
+            if total <= _EVICT_FRACTION * self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, fn))
+            except OSError:
+                pass
+            total -= size
+        return total
+
+
+class ScoreJournal(object):
+    """
+    Append-only journal of the scores completed during a long evaluation, indexed by content-addressed keys (see
+    content_hash()). Every entry is written & synced to disk as soon as it is appended, so an evaluation that is
+    interrupted can be restarted with the same journal & skip everything that was already completed.
+    """
+
+    def __init__(self, journal_filename):
+        """
+        Initialisation function for the journal, loading any entries from a previous run
+        :param journal_filename: name of the journal file (created if it doesn't exist)
+        """
+        super(ScoreJournal, self).__init__()
+        self.journal_filename = journal_filename
+        self._entries = {}
+        if not os.path.exists(journal_filename):
+            return
+        with open(journal_filename, 'rb') as f:
+            lines = f.read().split(b'\n')
+        for l in lines:
+            try:
+                e = json.loads(l.decode('utf-8'))
+            except ValueError:
+                continue  # Empty, or partially written when interrupted
+            self._entries[e['key']] = e['scores']
+        if lines[-1]:
+            # Make sure new entries don't continue a partially written one
+            with open(journal_filename, 'ab') as f:
+                f.write(b'\n')
+
+    def get(self, key):
+        """
+        Get the scores journalled for a key
+        :param key: journal key as created by content_hash()
+        :return: the journalled scores dict, or None if there is no entry for the key
+        """
+        return self._entries.get(key)
+
+    def append(self, key, name, scores):
+        """
+        Append the scores for a key to the journal, returning once they are safely on disk
+        :param key: journal key as created by content_hash()
+        :param name: name of what was scored (e.g. the results filename), only used to make the journal readable
+        :param scores: JSON serialisable scores dict
+        :return: None
+        """
+        line = json.dumps({
+            'key': key,
+            'name': name,
+            'scores': scores
+        },
+                          default=_json_default)
+        with open(self.journal_filename, 'a') as f:
+            f.write(line + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self._entries[key] = scores
+
+
+class MapStates(object):
+    """
+    Stored intermediate state of evaluated maps (every pair with a non-zero quality, & each map's assignment), so a
+    resubmission that only changes a few object proposals can be re-evaluated without recalculating everything (see
+    OMQ's states). States are read from a previous evaluation's file, & written to a new file as each map is evaluated.
+    Both are *.npz files that can be read with numpy.load(), where the arrays of each map are keyed '<map key>/<array>'.
+    """
+
+    def __init__(self, state_filename=None, previous_state_filename=None):
+        """
+        Initialisation function for map states, creating (or overwriting) the state file
+        :param state_filename: name of the *.npz file the state of every evaluated map is written to (None to not
+        write states)
+        :param previous_state_filename: name of a *.npz file written by a previous evaluation, with the states maps are
+        re-evaluated from (None to evaluate every map from scratch)
+        """
+        super(MapStates, self).__init__()
+        if (state_filename is not None and
+                previous_state_filename is not None and
+                os.path.abspath(state_filename) == os.path.abspath(
+                    previous_state_filename)):
+            raise ValueError(
+                "Map states can't be written to the file they are read from "
+                "('%s')" % state_filename)
+        self.state_filename = state_filename
+        self.previous_state_filename = previous_state_filename
+        self._previous = None
+        self._previous_keys = {}
+        if previous_state_filename is not None:
+            self._previous = np.load(previous_state_filename,
+                                     allow_pickle=False)
+            for name in self._previous.files:
+                key, array = name.split('/', 1)
+                self._previous_keys.setdefault(key, []).append(array)
+        self._zip = None
+        self._written = set()
+        if state_filename is not None:
+            self._zip = zipfile.ZipFile(state_filename,
+                                        'w',
+                                        compression=zipfile.ZIP_DEFLATED,
+                                        allowZip64=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def writing(self):
+        """
+        Whether the state of evaluated maps is being written
+        """
+        return self.state_filename is not None
+
+    def get(self, key):
+        """
+        Get the previous state stored for a map
+        :param key: map key as created by content_hash()
+        :return: dictionary of the map's state arrays, or None if there is no previous state for the map
+        """
+        if key not in self._previous_keys:
+            return None
+        return {
+            a: self._previous['%s/%s' % (key, a)]
+            for a in self._previous_keys[key]
+        }
+
+    def put(self, key, state):
+        """
+        Write the state of a map. Maps with the same key are interchangeable, so only the first state written for a
+        key is kept.
+        :param key: map key as created by content_hash()
+        :param state: dictionary of the map's state arrays
+        :return: None
+        """
+        if self._zip is None or key in self._written:
+            return
+        for name, array in state.items():
+            # Arrays are stored like numpy.savez_compressed(), one *.npy each
+            with self._zip.open('%s/%s.npy' % (key, name), 'w',
+                                force_zip64=True) as f:
+                np.lib.format.write_array(f,
+                                          np.asarray(array),
+                                          allow_pickle=False)
+        self._written.add(key)
+
+    def close(self):
+        """
+        Finishes writing the state file, & closes the previous state file
+        :return: None
+        """
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+        if self._previous is not None:
+            self._previous.close()
+            self._previous = None
+            self._previous_keys = {}
+
+
+class _DirectoryLock(object):
+    # Exclusive advisory lock shared between processes (a no-op where fcntl
+    # isn't available)
+
+    def __init__(self, lock_filename):
+        self._lock_filename = lock_filename
+        self._f = None
+
+    def __enter__(self):
+        self._f = open(self._lock_filename, 'a')
+        if fcntl is not None:
+            fcntl.flock(self._f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        if fcntl is not None:
+            fcntl.flock(self._f, fcntl.LOCK_UN)
+        self._f.close()
@@ -44,12 +44,8 @@ def get_nearest_class_id(class_name):
     :param class_name: the name of the class being looked up (can be synonym from SYNONYMS)
     :return: an integer corresponding to nearest ID in CLASS_LIST, or None
     """
-    class_name = class_name.lower()
-    if class_name in CLASS_IDS:
-        return CLASS_IDS[class_name]
-    elif class_name in SYNONYMS:
-        return CLASS_IDS[SYNONYMS[class_name]]
-    return None
+    class_name = get_nearest_class_name(class_name)
+    return None if class_name is None else CLASS_IDS[class_name]
 
 
 def get_nearest_class_name(class_name):
@@ -60,9 +56,93 @@ def get_nearest_class_name(class_name):
     :param potential_class_name: the queried class name
     :return: the nearest class name from CLASS_LIST, or None
     """
+    return _nearest_class_name(class_name, CLASS_IDS, SYNONYMS)
+
+
+def set_class_list(class_list, synonyms=None):
+    """
+    Replace the class list results are evaluated against (e.g. with a large custom taxonomy). CLASS_LIST, CLASS_IDS, &
+    SYNONYMS are all updated in place, so should be set before any results or ground truth are loaded (& before any
+    ClassTaxonomy or Evaluator using the default class list is created, as they take a copy of it).
+    NOTE this changes the class list of every evaluation in the process. To evaluate against a custom taxonomy without
+    affecting any others, give it to the Evaluator instead (see its class_list & class_synonyms).
+    :param class_list: list of unique class names, where the final class must be 'background'
+    :param synonyms: dictionary of synonyms for the class names (None to keep the current SYNONYMS, where any synonyms
+    for classes no longer in the class list are ignored)
+    :return: None
+    """
+    CLASS_LIST[:] = _check_class_list(class_list)
+    CLASS_IDS.clear()
+    CLASS_IDS.update(
+        {class_name: idx for idx, class_name in enumerate(CLASS_LIST)})
+    if synonyms is not None:
+        SYNONYMS.clear()
+        SYNONYMS.update({k.lower(): v.lower() for k, v in synonyms.items()})
+
+
+class ClassTaxonomy(object):
+    """
+    A class list results are evaluated against, along with synonyms for its class names. Unlike set_class_list(),
+    a taxonomy is only used where it is given (e.g. to an Evaluator), so evaluations against different taxonomies can
+    run side by side in the same process.
+    """
+
+    def __init__(self, class_list=None, synonyms=None):
+        """
+        Initialisation function for a taxonomy
+        :param class_list: list of unique class names, where the final class must be 'background' (None for a copy of
+        the current CLASS_LIST, which later calls to set_class_list() don't change)
+        :param synonyms: dictionary of synonyms for the class names (None for a copy of the current SYNONYMS). Synonyms
+        for names that aren't in the class list are ignored.
+        """
+        super(ClassTaxonomy, self).__init__()
+        self.class_list = (list(CLASS_LIST) if class_list is None else
+                           _check_class_list(class_list))
+        self.class_ids = {
+            class_name: idx for idx, class_name in enumerate(self.class_list)
+        }
+        self.synonyms = (dict(SYNONYMS) if synonyms is None else
+                         {k.lower(): v.lower() for k, v in synonyms.items()})
+
+    def get_nearest_class_id(self, class_name):
+        """
+        Given a class string, find the id of that class (equivalent to get_nearest_class_id() for this taxonomy)
+        :param class_name: the name of the class being looked up (can be a synonym)
+        :return: an integer corresponding to nearest ID in the class list, or None
+        """
+        class_name = self.get_nearest_class_name(class_name)
+        return None if class_name is None else self.class_ids[class_name]
+
+    def get_nearest_class_name(self, class_name):
+        """
+        Given a string that might be a class name, return the name of the class it refers to (equivalent to
+        get_nearest_class_name() for this taxonomy)
+        :param class_name: the queried class name
+        :return: the nearest class name from the class list, or None
+        """
+        return _nearest_class_name(class_name, self.class_ids, self.synonyms)
+
+
+def _check_class_list(class_list):
+    # Lower cases a class list, raising a ValueError if it isn't valid
+    class_list = [c.lower() for c in class_list]
+    if len(class_list) == 0 or class_list[-1] != 'background':
+        raise ValueError("The final class in a class list must be "
+                         "'background'")
+    if len(set(class_list)) != len(class_list):
+        raise ValueError("Class list has duplicate class names")
+    return class_list
+
+
+def _nearest_class_name(class_name, class_ids, synonyms):
+    # Synonyms can lead to other synonyms (e.g. 'diningtable'), so are
+    # followed until they reach a class (or don't, e.g. synonyms for classes
+    # that aren't in a custom class list)
     class_name = class_name.lower()
-    if class_name in CLASS_IDS:
-        return class_name
-    elif class_name in SYNONYMS:
-        return SYNONYMS[class_name]
+    for _ in range(len(synonyms) + 1):
+        if class_name in class_ids:
+            return class_name
+        elif class_name not in synonyms:
+            return None
+        class_name = synonyms[class_name]
     return None
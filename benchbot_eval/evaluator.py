@@ -1,17 +1,31 @@
 from __future__ import print_function
 
+import asyncio
+import contextlib
 import inspect
+import io
 import json
 import os
 import pprint
+import queue
 import re
 import numpy as np
+import shutil
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 import warnings
 import zipfile
+from scipy import sparse
 
-from .omq import OMQ
+from . import __version__
+from .cache import MapStates, ScoreCache, ScoreJournal, content_hash
+from .omq import OMQ, OPTION_DEFAULTS, ObjectArrays, select_objects
+from .options import resolve_options
+from .preview import confidence_intervals, evaluate_sample
+from .report import CandidateReport, MatchReport
 from . import class_list as cl
 
 # Needed to simply stop it printing the source code text with the warning...
@@ -19,6 +33,11 @@ warnings.formatwarning = (lambda msg, cat, fn, ln, line: "%s:%d: %s: %s\n" %
                           (fn, ln, cat.__name__, msg))
 
 
+class EvaluationCancelled(Exception):
+    # Raised when an evaluation's progress callback asks for it to stop
+    pass
+
+
 class Evaluator:
     _TYPE_SEMANTIC_SLAM = 'semantic_slam'
     _TYPE_SCD = 'scd'
@@ -51,8 +70,55 @@ class Evaluator:
         'state_probs': lambda value: len(value) == 3
     }
 
+    _REQUIRED_RESULTS_ARRAYS = {
+        'centroids': 3,
+        'extents': 3,
+        'label_probs': None
+    }
+
+    _REQUIRED_SCD_RESULTS_ARRAYS = {'state_probs': 3}
+
+    _OPTIONAL_RESULTS_ARRAYS = {'label_indices': None}
+
+    _OPTIONAL_SCD_RESULTS_ARRAYS = {'scenes': 2}
+
+    _NPZ_EXTENSION = '.npz'
+
     _ZIP_IGNORE = ["submission.json"]
 
+    # Characters of a JSON results file read when looking for its header
+    # before falling back to reading the whole file (see
+    # _read_results_header())
+    _HEADER_CHUNK_SIZE = 65536
+
+    _JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+    # Option groups, with the default of every option in each group. OMQ's
+    # groups are passed on to every OMQ instance, except that maps chosen for
+    # verification are seeded by default (like previews) so that evaluations
+    # are reproducible.
+    _OPTION_DEFAULTS = dict(
+        OPTION_DEFAULTS,
+        verify=dict(OPTION_DEFAULTS['verify'], seed=0),
+        preview={
+            'fraction': None,
+            'region_size': 2.0,
+            'seed': 0
+        },
+        cache={
+            'dir': None,
+            'max_bytes': 100 * 1024 * 1024
+        },
+        outputs={
+            'report': None,
+            'report_attribution': False,
+            'candidates': None,
+            'num_candidates': 5,
+            'journal': None,
+            'states': None,
+            'previous_states': None
+        })
+
     __LAMBDA_REGEX = [
         (r'Evaluator._TYPE_([^,^\]]*)', lambda x: "'%s'" % x.group(1).lower()),
         (r'  +', r' '), (r'^.*?(\(|lambda)', r'\1'), (r', *$', r''),
@@ -65,7 +131,21 @@ class Evaluator:
                  scores_filename,
                  print_all=True,
                  required_task=None,
-                 required_envs=None):
+                 required_envs=None,
+                 scd_pairs='consecutive',
+                 batched=False,
+                 components=None,
+                 assignment=None,
+                 tiling=None,
+                 verify=None,
+                 plan=None,
+                 preview=None,
+                 cache=None,
+                 outputs=None,
+                 taxonomy=None,
+                 pipeline_depth=None,
+                 quiet=False,
+                 progress=None):
         # Confirm we have a valid submission file, & ground truth directory
         if not os.path.exists(ground_truth_dir):
             raise ValueError("ERROR: Ground truths directory "
@@ -82,6 +162,29 @@ class Evaluator:
         self.print_all = print_all
         self.required_task = required_task
         self.required_envs = required_envs
+        self.scd_pairs = scd_pairs
+        self.batched = batched
+        self.components = components
+        options = {
+            k: resolve_options(k, v, Evaluator._OPTION_DEFAULTS[k])
+            for k, v in [('assignment', assignment), ('tiling', tiling),
+                         ('verify', verify), ('plan', plan),
+                         ('preview', preview), ('cache', cache),
+                         ('outputs', outputs)]
+        }
+        self.assignment = options['assignment']
+        self.tiling = options['tiling']
+        self.verify = options['verify']
+        self.plan = options['plan']
+        self.preview = options['preview']
+        self.outputs = options['outputs']
+        self.cache = (None if options['cache']['dir'] is None else ScoreCache(
+            options['cache']['dir'], options['cache']['max_bytes']))
+        self.taxonomy = cl.ClassTaxonomy() if taxonomy is None else taxonomy
+        self.pipeline_depth = pipeline_depth
+        self.quiet = quiet
+        self.progress = progress
+        self._start_time = time.time()
 
     @staticmethod
     def __lambda_to_text(l):
@@ -115,64 +218,397 @@ class Evaluator:
                        scores_avg_label,
                        scores_avg_spatial,
                        scores_avg_fp_quality,
-                       scores_avg_state_quality=None):
+                       scores_avg_state_quality=None,
+                       scores_per_class=None,
+                       scores_per_region=None,
+                       scores_per_scene_pair=None,
+                       assignment_details=None,
+                       preview_details=None,
+                       verification_details=None,
+                       plan_details=None):
         return {
             'task_details': task_details,
             'environment_details': environment_details,
+            **({} if assignment_details is None else {
+                   'assignment': assignment_details
+               }),
+            **({} if plan_details is None else {
+                   'plan': plan_details
+               }),
+            **({} if preview_details is None else {
+                   'preview': preview_details
+               }),
+            **({} if verification_details is None else {
+                   'verification': verification_details
+               }),
             'scores': {
                 'OMQ':
                     scores_omq,
                 'avg_pairwise':
                     scores_avg_pairwise,
-                'avg_label':
-                    scores_avg_label,
-                'avg_spatial':
-                    scores_avg_spatial,
+                **({} if scores_avg_label is None else {
+                       'avg_label': scores_avg_label
+                   }),
+                **({} if scores_avg_spatial is None else {
+                       'avg_spatial': scores_avg_spatial
+                   }),
                 'avg_fp_quality':
                     scores_avg_fp_quality,
                 **({} if scores_avg_state_quality is None else {
                        'avg_state_quality': scores_avg_state_quality
+                   }),
+                **({} if scores_per_class is None else {
+                       'per_class': scores_per_class
+                   }),
+                **({} if scores_per_region is None else {
+                       'per_region': scores_per_region
+                   }),
+                **({} if scores_per_scene_pair is None else {
+                       'per_scene_pair': scores_per_scene_pair
                    })
             }
         }
 
+    def _log(self, *args):
+        # Prints progress, unless the evaluator was asked to be quiet
+        if not self.quiet:
+            print(*args)
+
+    def _emit(self, event_type, **details):
+        # Sends a progress event to the progress callback (if there is one),
+        # cancelling the evaluation if the callback returns True. Events are
+        # dicts with the event's 'type', the 'elapsed' seconds since the
+        # evaluation started, & details for the type of event:
+        # - 'started': 'results_files' (number of results files given)
+        # - 'results_loaded': 'filename', 'objects'
+        # - 'ground_truth_loaded': 'filename', 'objects'
+        # - 'map_scored': 'filename', 'objects', & 'source' (one of
+        #   'scored', 'cached', or 'journalled')
+        # - 'finished': 'results' (number of results scored)
+        # The callback may be called from a loading thread.
+        if self.progress is None:
+            return
+        event = dict(type=event_type,
+                     elapsed=time.time() - self._start_time,
+                     **details)
+        if self.progress(event):
+            raise EvaluationCancelled(
+                "Evaluation cancelled by the progress callback (at a '%s' "
+                "event)" % event_type)
+
+    def _cache_key(self, results_data, ground_truth_data):
+        # Key is built from everything that can change the scores: the
+        # sanitised results, the ground truth they are evaluated against, the
+        # version of this package, & the scoring options
+        return content_hash(
+            results_data, [
+                ground_truth_data[s] for s in Evaluator._get_env_strings(
+                    results_data['environment_details'])
+            ], __version__, self._scoring_options())
+
+    def _omq_options(self):
+        # Keyword arguments used for every OMQ evaluator instance
+        return {
+            'batched': self.batched,
+            'components': self.components,
+            'assignment': self.assignment,
+            'tiling': self.tiling,
+            'verify': self.verify,
+            'plan': self.plan
+        }
+
+    def _scoring_options(self):
+        # Options that change how scores are calculated (used to ensure cached
+        # scores are only reused for an identical evaluation). Tiling & limits
+        # on maps only bound resources, so never change scores, verification
+        # only adds its details to the scores when enabled, & plans (with the
+        # cost model choosing backends) only when planned automatically
+        options = dict(self._omq_options(), scd_pairs=self.scd_pairs)
+        del options['tiling']
+        if self.plan['auto']:
+            options['plan'] = {
+                k: self.plan[k] for k in ['auto', 'seconds']
+            }
+        else:
+            del options['plan']
+        if self.verify['fraction'] is None:
+            del options['verify']
+        if self.components is None:
+            del options['components']
+        if self.preview['fraction'] is not None:
+            options['preview'] = self._preview_options()
+        return options
+
+    def _preview_options(self):
+        # Options for scoring only a sample of each map (None for exact scores)
+        if self.preview['fraction'] is None:
+            return None
+        return dict(self.preview)
+
+    @staticmethod
+    def _create_preview_details(preview, partials, num_regions, evaluator,
+                                rng):
+        # Records how much of each map was sampled for a preview, & the
+        # confidence intervals of the estimated scores (only for the scores
+        # the evaluator calculated)
+        intervals = confidence_intervals(partials, rng=rng)
+        scores = Evaluator._get_component_scores(evaluator)
+        return {
+            'fraction': preview['fraction'],
+            'regions': num_regions,
+            'sampled_regions': len(partials),
+            'confidence': 0.95,
+            'intervals': {k: v for k, v in intervals.items() if k in scores}
+        }
+
+    @staticmethod
+    def _create_assignment_details(evaluator):
+        # Records how the assignment was done, but only if it wasn't the
+        # default optimal Hungarian assignment
+        if evaluator.assignment['backend'] == 'hungarian':
+            return None
+        return {
+            'backend': evaluator.assignment['backend'],
+            'quality_gap': evaluator.get_assignment_gap()
+        }
+
+    @staticmethod
+    def _create_plan_details(evaluators):
+        # Records the plan chosen for every map by the cost model, but only if
+        # plans were chosen automatically
+        if not evaluators[0].plan['auto']:
+            return None
+        return [p for e in evaluators for p in e.get_plans()]
+
+    @staticmethod
+    def _create_verification_details(evaluators):
+        # Records the largest differences found verifying the fast scoring
+        # paths against the reference implementation, but only if enabled
+        if evaluators[0].verify['fraction'] is None:
+            return None
+        return Evaluator._amalgamate_verification_details(
+            [e.get_verification() for e in evaluators])
+
+    @staticmethod
+    def _amalgamate_verification_details(verification_list):
+        return {
+            'maps': int(np.sum([v['maps'] for v in verification_list])),
+            **{
+                g: {
+                    k: float(np.max([v[g][k] for v in verification_list]))
+                    for k in verification_list[0][g]
+                } for g in ['tables', 'scores']
+            }
+        }
+
+    @staticmethod
+    def _get_component_scores(evaluator):
+        # Every overall score the evaluator calculated, keyed by name (scores
+        # of components that weren't requested are left out)
+        getters = [
+            ('OMQ', evaluator.get_current_score),
+            ('avg_pairwise', evaluator.get_avg_overall_quality_score),
+            ('avg_label', evaluator.get_avg_label_score),
+            ('avg_spatial', evaluator.get_avg_spatial_score),
+            ('avg_fp_quality', evaluator.get_avg_fp_score)
+        ] + ([('avg_state_quality', evaluator.get_avg_state_score)]
+             if evaluator.scd_mode else [])
+        return {k: g() for k, g in getters if evaluator.has_component(k)}
+
+    @staticmethod
+    def _create_per_class_scores(evaluator, class_list):
+        # Turns the per-class arrays from an OMQ instance into a dict of
+        # scores dicts keyed by the class's name in class_list (only classes
+        # that were seen as a TP, FP, or FN are included)
+        pcs = evaluator.get_per_class_scores()
+        keys = ['OMQ', 'avg_pairwise', 'avg_label', 'avg_spatial',
+                'avg_fp_quality'] + (['avg_state_quality']
+                                     if evaluator.scd_mode else [])
+        return {
+            class_list[i]: {k: float(pcs[k][i]) for k in keys}
+            for i in np.flatnonzero(pcs['TP'] + pcs['FP'] + pcs['FN'])
+            if i < len(class_list)
+        }
+
+    @staticmethod
+    def _create_per_region_scores(evaluator):
+        # Turns the per-region arrays from an OMQ instance into a dict of
+        # scores dicts keyed by region name (None if there are no regions)
+        if not evaluator.has_component('per_region'):
+            return None
+        prs = evaluator.get_per_region_scores()
+        keys = ['OMQ', 'avg_pairwise', 'avg_label', 'avg_spatial',
+                'avg_fp_quality'] + (['avg_state_quality']
+                                     if evaluator.scd_mode else [])
+        return {
+            n: {k: float(prs[k][i]) for k in keys}
+            for i, n in enumerate(prs['region'].tolist())
+        } or None
+
+    @staticmethod
+    def _amalgamate_per_class_scores(per_class_list):
+        # Averages each class's scores over only the results where that class
+        # was actually seen
+        classes = []
+        for pc in per_class_list:
+            classes.extend(c for c in pc if c not in classes)
+        return {
+            c: {
+                k: np.mean([pc[c][k] for pc in per_class_list if c in pc])
+                for k in next(pc[c] for pc in per_class_list if c in pc)
+            } for c in classes
+        }
+
     @staticmethod
-    def _evaluate_scd(results_data, ground_truth_data):
+    def _evaluate_scd(results_data,
+                      ground_truth_data,
+                      omq_options=None,
+                      scd_pairs='consecutive',
+                      preview=None):
         # Takes in results data from a BenchBot submission and evaluates the
-        # difference map to results
+        # difference map to results. Results for more than two scenes are
+        # evaluated for each pair of scenes in the chain (either consecutive
+        # scenes, or all pairs), with each object declaring the pair of scene
+        # numbers it is a change between in its 'scenes' field.
+        numbers = [int(n) for n in results_data['environment_details']['numbers']]
+        if len(numbers) < 2:
+            raise ValueError(
+                "Scene change detection results require at least 2 scenes, "
+                "but only %d was provided." % len(numbers))
+        pairs = Evaluator._get_scene_pairs(numbers, scd_pairs)
+        pair_objects = Evaluator._split_scene_pair_objects(
+            results_data['objects'], pairs)
 
         # Use the ground truth object-based semantic maps for each scene to
-        # derive the ground truth scene change semantic map (use empty lists to
-        # handle missing fields just in case)
+        # derive the ground truth scene change semantic map for each pair
+        # (each scene's objects are keyed once, & reused by every pair)
         # NOTE: ground truth uses a flag to determine change state rather than
         # the distribution provided in the submission results
         es = Evaluator._get_env_strings(results_data['environment_details'])
-        gt_objects_1 = (ground_truth_data[es[0]]['objects']
-                        if 'objects' in ground_truth_data[es[0]] else [])
-        gt_objects_2 = (ground_truth_data[es[1]]['objects']
-                        if 'objects' in ground_truth_data[es[1]] else [])
-        gt_changes = [{
-            **o, 'state': 'removed'
-        } for o in gt_objects_1 if o not in gt_objects_2]
-        gt_changes += [{
-            **o, 'state': 'added'
-        } for o in gt_objects_2 if o not in gt_objects_1]
+        gt_objects = {
+            n: (ground_truth_data[s]['objects']
+                if 'objects' in ground_truth_data[s] else [])
+            for n, s in zip(numbers, es)
+        }
+        gt_keys = {n: [_freeze(o) for o in os] for n, os in gt_objects.items()}
+        gt_regions = {
+            n: ground_truth_data[s].get('regions')
+            for n, s in zip(numbers, es)
+        }
+
+        # Grab an evaluator instance for each pair of scenes, & use them to
+        # return some results (previews only evaluate a sample of regions
+        # from each pair, estimating intervals from the regions of all pairs)
+        evaluators = []
+        partials, num_regions = [], 0
+        rng = None if preview is None else np.random.default_rng(
+            preview['seed'])
+        for a, b in pairs:
+            # Changes are broken down by the regions of the later scene
+            evaluator = OMQ(scd_mode=True,
+                            **dict(omq_options or {}, regions=gt_regions[b]))
+            maps = [(Evaluator._get_gt_changes(gt_objects[a], gt_keys[a],
+                                               gt_objects[b], gt_keys[b]),
+                     pair_objects[(a, b)])]
+            if preview is None:
+                evaluator.score(maps)
+            else:
+                p, n = evaluate_sample(evaluator, maps, preview['fraction'],
+                                       preview['region_size'], rng)
+                partials += p
+                num_regions += n
+            evaluators.append(evaluator)
 
-        # Grab an evaluator instance, & use it to return some results
-        evaluator = OMQ(scd_mode=True)
+        # Scores for the chain as a whole pool the totals of every pair
+        if len(evaluators) == 1:
+            evaluator = evaluators[0]
+        else:
+            evaluator = OMQ(scd_mode=True, **(omq_options or {}))
+            for e in evaluators:
+                evaluator.add_partial(e.get_partial())
+        scores = Evaluator._get_component_scores(evaluator)
         return Evaluator._create_scores(
             task_details=results_data['task_details'],
             environment_details=results_data['environment_details'],
-            scores_omq=evaluator.score([(gt_changes, results_data['objects'])
-                                       ]),
-            scores_avg_pairwise=evaluator.get_avg_overall_quality_score(),
-            scores_avg_label=evaluator.get_avg_label_score(),
-            scores_avg_spatial=evaluator.get_avg_spatial_score(),
-            scores_avg_fp_quality=evaluator.get_avg_fp_score(),
-            scores_avg_state_quality=evaluator.get_avg_state_score())
+            scores_omq=scores['OMQ'],
+            scores_avg_pairwise=scores['avg_pairwise'],
+            scores_avg_label=scores.get('avg_label'),
+            scores_avg_spatial=scores.get('avg_spatial'),
+            scores_avg_fp_quality=scores['avg_fp_quality'],
+            scores_avg_state_quality=scores.get('avg_state_quality'),
+            scores_per_class=(Evaluator._create_per_class_scores(
+                evaluator, results_data['class_list'])
+                              if evaluator.has_component('per_class') else
+                              None),
+            scores_per_region=Evaluator._create_per_region_scores(evaluator),
+            scores_per_scene_pair=(None if len(evaluators) == 1 else {
+                "%s:%d:%d" % (results_data['environment_details']['name'], a,
+                              b): Evaluator._get_component_scores(e)
+                for (a, b), e in zip(pairs, evaluators)
+            }),
+            assignment_details=Evaluator._create_assignment_details(evaluator),
+            preview_details=(None if preview is None else
+                             Evaluator._create_preview_details(
+                                 preview, partials, num_regions, evaluator, rng)),
+            verification_details=Evaluator._create_verification_details(
+                evaluators),
+            plan_details=Evaluator._create_plan_details(evaluators))
+
+    @staticmethod
+    def _get_scene_pairs(numbers, scd_pairs):
+        # Returns the (earlier, later) pairs of scene numbers evaluated for a
+        # chain of scenes
+        if scd_pairs == 'consecutive':
+            return list(zip(numbers[:-1], numbers[1:]))
+        elif scd_pairs == 'all':
+            return [(a, b) for i, a in enumerate(numbers)
+                    for b in numbers[i + 1:]]
+        raise ValueError("Scene pairs '%s' is not one of: consecutive, all" %
+                         scd_pairs)
 
     @staticmethod
-    def _evaluate_semantic_slam(results_data, ground_truth_data):
+    def _split_scene_pair_objects(objects, pairs):
+        # Splits the proposed objects by the pair of scenes they describe a
+        # change between (objects for only two scenes don't need to say)
+        if isinstance(objects, ObjectArrays):
+            scenes = ([None] * len(objects) if objects.scenes is None else
+                      [tuple(s) for s in objects.scenes.tolist()])
+        else:
+            scenes = [
+                tuple(int(n) for n in o['scenes']) if 'scenes' in o else None
+                for o in objects
+            ]
+        if len(pairs) == 1 and all(p is None for p in scenes):
+            return {pairs[0]: objects}
+        pair_idxs = {p: [] for p in pairs}
+        for i, p in enumerate(scenes):
+            if p not in pair_idxs:
+                raise ValueError(
+                    "Object %d has 'scenes' %s, but must be one of the "
+                    "evaluated scene pairs: %s" %
+                    (i, None if p is None else list(p), ", ".join(
+                        str(list(p)) for p in pairs)))
+            pair_idxs[p].append(i)
+        return {p: select_objects(objects, i) for p, i in pair_idxs.items()}
+
+    @staticmethod
+    def _get_gt_changes(gt_objects_1, gt_keys_1, gt_objects_2, gt_keys_2):
+        # Derives the ground truth changes between two scenes, using the
+        # frozen keys of each object to find objects not in the other scene
+        keys_1, keys_2 = set(gt_keys_1), set(gt_keys_2)
+        gt_changes = [{
+            **o, 'state': 'removed'
+        } for o, k in zip(gt_objects_1, gt_keys_1) if k not in keys_2]
+        gt_changes += [{
+            **o, 'state': 'added'
+        } for o, k in zip(gt_objects_2, gt_keys_2) if k not in keys_1]
+        return gt_changes
+
+    @staticmethod
+    def _evaluate_semantic_slam(results_data,
+                                ground_truth_data,
+                                omq_options=None,
+                                preview=None):
         # Takes in results data from a BenchBot submission, evaluates the
         # result using the ground truth data, & then spits out a dict of scores
         # data
@@ -182,17 +618,40 @@ class Evaluator:
             results_data['environment_details'])]
         gt_objects = (gt_data['objects'] if 'objects' in gt_data else [])
 
-        # Grab an evaluator instance, & use it to return some results
-        evaluator = OMQ()
+        # Grab an evaluator instance, & use it to return some results (or
+        # estimates of them from a sample of regions if previewing)
+        evaluator = OMQ(**dict(omq_options or {},
+                               regions=gt_data.get('regions')))
+        maps = [(gt_objects, results_data['objects'])]
+        if preview is None:
+            evaluator.score(maps)
+        else:
+            rng = np.random.default_rng(preview['seed'])
+            partials, num_regions = evaluate_sample(evaluator, maps,
+                                                    preview['fraction'],
+                                                    preview['region_size'],
+                                                    rng)
+        scores = Evaluator._get_component_scores(evaluator)
         return Evaluator._create_scores(
             task_details=results_data['task_details'],
             environment_details=results_data['environment_details'],
-            scores_omq=evaluator.score([(gt_objects, results_data['objects'])
-                                       ]),
-            scores_avg_pairwise=evaluator.get_avg_overall_quality_score(),
-            scores_avg_label=evaluator.get_avg_label_score(),
-            scores_avg_spatial=evaluator.get_avg_spatial_score(),
-            scores_avg_fp_quality=evaluator.get_avg_fp_score())
+            scores_omq=scores['OMQ'],
+            scores_avg_pairwise=scores['avg_pairwise'],
+            scores_avg_label=scores.get('avg_label'),
+            scores_avg_spatial=scores.get('avg_spatial'),
+            scores_avg_fp_quality=scores['avg_fp_quality'],
+            scores_per_class=(Evaluator._create_per_class_scores(
+                evaluator, results_data['class_list'])
+                              if evaluator.has_component('per_class') else
+                              None),
+            scores_per_region=Evaluator._create_per_region_scores(evaluator),
+            assignment_details=Evaluator._create_assignment_details(evaluator),
+            preview_details=(None if preview is None else
+                             Evaluator._create_preview_details(
+                                 preview, partials, num_regions, evaluator, rng)),
+            verification_details=Evaluator._create_verification_details(
+                [evaluator]),
+            plan_details=Evaluator._create_plan_details([evaluator]))
 
     @staticmethod
     def _get_task_string(task_details):
@@ -218,7 +677,7 @@ class Evaluator:
     def _ground_truth_file(ground_truth_dir, name, number):
         filename = subprocess.check_output(
             "find %s -name '%s_%s.json'" % (ground_truth_dir, name, number),
-            shell=True).decode(sys.stdout.encoding).split('\n')[0]
+            shell=True).decode(sys.getfilesystemencoding()).split('\n')[0]
         if not os.path.exists(filename):
             raise ValueError(
                 "Results request a ground truth for variation "
@@ -228,61 +687,262 @@ class Evaluator:
         return filename
 
     @staticmethod
-    def _load_ground_truth_data(ground_truth_dir, envs_details_list):
+    def _load_ground_truth_data(ground_truth_dir,
+                                envs_details_list,
+                                log=print,
+                                emit=None,
+                                taxonomy=None,
+                                ground_truth_data=None):
         # Takes a list of envs, & loads the associated ground truth files
-        gtd = {}  # Dict of ground truth data, with env_string as keys
+        # (logging progress with log, & sending an event to emit for each),
+        # with classes from the taxonomy (None for the default class list).
+        # Ground truth is added to ground_truth_data if given, which already
+        # loaded environments are taken from.
+        gtd = {} if ground_truth_data is None else ground_truth_data
         for e in envs_details_list:
             env_strs = Evaluator._get_env_strings(e)
             for i, s in zip(e['numbers'], env_strs):
                 if s not in gtd:
                     fn = Evaluator._ground_truth_file(ground_truth_dir,
                                                       e['name'], i)
-                    print("Loading ground truth data from '%s' ..." % fn)
+                    log("Loading ground truth data from '%s' ..." % fn)
                     with open(fn, 'r') as f:
                         # NOTE should remove format step in time
                         gtd[s] = Evaluator._sanitise_ground_truth(
-                            (json.load(f)))
-                    print("\tDone.")
+                            (json.load(f)), taxonomy)
+                    log("\tDone.")
+                    if emit is not None:
+                        emit('ground_truth_loaded',
+                             filename=fn,
+                             objects=len(gtd[s]['objects']))
         return gtd
 
     @staticmethod
-    def _load_results_data(results_filenames):
+    def _load_results_data(results_filenames,
+                           log=print,
+                           emit=None,
+                           taxonomy=None):
         # Takes a list of filenames & pulls all data from JSON & *.zip files
+        results = dict(
+            Evaluator._iter_results_data(results_filenames,
+                                         log=log,
+                                         emit=emit,
+                                         taxonomy=taxonomy))
+        log("\tDone.")
+        return results
+
+    @staticmethod
+    def _iter_results_data(results_filenames,
+                           headers_only=False,
+                           log=print,
+                           emit=None,
+                           taxonomy=None):
+        # Generates (name, sanitised data) for each result in a list of JSON,
+        # *.npz, & *.zip files, one result at a time. With headers_only, only
+        # a light validated header (everything except the objects) is
+        # produced for each result. Progress is logged with log, & an event
+        # sent to emit for each result (neither are used with headers_only).
+        # Results are sanitised to the taxonomy's class list (None for the
+        # default class list).
         # (sorry... nesting abomination...)
-        results = {}  # Dict of provided data, with filenames as keys
+        if headers_only:
+            log = (lambda *args: None)
+            emit = None
+        for name, d in Evaluator._iter_results_files(results_filenames,
+                                                     headers_only, log,
+                                                     taxonomy):
+            if emit is not None:
+                emit('results_loaded',
+                     filename=name,
+                     objects=len(d['objects']))
+            yield name, d
+
+    @staticmethod
+    def _iter_results_files(results_filenames, headers_only, log,
+                            taxonomy=None):
+        # Generator behind _iter_results_data(), without any events
         for r in results_filenames:
-            print("Loading data from '%s' ..." % r)
-            if zipfile.is_zipfile(r):
+            log("Loading data from '%s' ..." % r)
+            if r.endswith(Evaluator._NPZ_EXTENSION):
+                # NOTE *.npz files are also zip files, so must be checked first
+                with np.load(r) as arrays:
+                    yield r, Evaluator._load_results_arrays(
+                        arrays, headers_only, taxonomy)
+            elif zipfile.is_zipfile(r):
                 with zipfile.ZipFile(r, 'r') as z:
                     for f in z.filelist:
                         if f.filename in Evaluator._ZIP_IGNORE:
-                            print("\tIgnoring file '%s'" % f.filename)
+                            log("\tIgnoring file '%s'" % f.filename)
+                        elif f.filename.endswith(Evaluator._NPZ_EXTENSION):
+                            # NOTE *.npz files need random access, which is
+                            # slow on the stream of a file in a zip (seeking
+                            # back re-reads it from the start), so the stream
+                            # is copied to a temporary file in chunks rather
+                            # than read into memory whole
+                            with z.open(f, 'r') as zf, \
+                                    tempfile.TemporaryFile() as tf:
+                                shutil.copyfileobj(zf, tf)
+                                tf.seek(0)
+                                arrays = None
+                                try:
+                                    arrays = np.load(tf)
+                                except:
+                                    log("\tSkipping file '%s'" % f.filename)
+                                    continue  # Failure is fine / expected here!
+                                log("\tExtracting data from file '%s'" %
+                                    f.filename)
+                                with arrays:
+                                    yield (z.filename + ':' + f.filename,
+                                           Evaluator._load_results_arrays(
+                                               arrays, headers_only, taxonomy))
                         else:
                             with z.open(f, 'r') as zf:
                                 d = None
                                 try:
-                                    d = json.load(zf)
+                                    d = (Evaluator._read_results_header(
+                                        io.TextIOWrapper(zf, encoding='utf-8'))
+                                         if headers_only else json.load(zf))
                                 except:
-                                    print("\tSkipping file '%s'" % f.filename)
+                                    log("\tSkipping file '%s'" % f.filename)
                                     continue  # Failure is fine / expected here!
-                                print("\tExtracting data from file '%s'" %
-                                      f.filename)
-                                results[z.filename + ':' + f.filename] = (
-                                    Evaluator.sanitise_results_data(d))
+                                log("\tExtracting data from file '%s'" %
+                                    f.filename)
+                                yield (z.filename + ':' + f.filename,
+                                       Evaluator._results_header(d)
+                                       if headers_only else
+                                       Evaluator.sanitise_results_data(
+                                           d, taxonomy))
             else:
                 with open(r, 'r') as f:
-                    results[r] = Evaluator.sanitise_results_data(json.load(f))
-        print("\tDone.")
-        return results
+                    d = (Evaluator._read_results_header(f)
+                         if headers_only else json.load(f))
+                yield r, (Evaluator._results_header(d) if headers_only else
+                          Evaluator.sanitise_results_data(d, taxonomy))
+
+    @staticmethod
+    def _read_results_header(f):
+        # Reads the header of JSON results (see _results_header()) from an
+        # open file, without decoding the objects. Results list their objects
+        # after the header (see the results format), so only the start of the
+        # file is normally read; otherwise the whole file is read & decoded.
+        # The header holds an empty list of objects, as the objects are only
+        # validated when the full results are loaded.
+        text = f.read(Evaluator._HEADER_CHUNK_SIZE)
+        header = Evaluator._decode_results_header(text)
+        if header is None:
+            text += f.read()
+            header = Evaluator._decode_results_header(text)
+        if header is None:
+            json.loads(text)  # Raises the error for invalid JSON
+            header = {}
+        return dict(header, objects=[])
+
+    @staticmethod
+    def _decode_results_header(text):
+        # Decodes the top-level values of a JSON object one at a time, until
+        # every header field is found (or the object ends). Returns None if
+        # the text ends (or is invalid) first.
+        keys = ['task_details', 'environment_details']
+        decoder = json.JSONDecoder()
+        ws = Evaluator._JSON_WHITESPACE
+        header = {}
+        try:
+            i = ws.match(text).end()
+            if text[i] != '{':
+                return None
+            i = ws.match(text, i + 1).end()
+            while text[i] != '}' and not all(k in header for k in keys):
+                k, i = decoder.raw_decode(text, i)
+                i = ws.match(text, i).end()
+                if text[i] != ':':
+                    return None
+                v, i = decoder.raw_decode(text, ws.match(text, i + 1).end())
+                i = ws.match(text, i).end()
+                if text[i] not in ',}':
+                    return None
+                elif k in keys:
+                    header[k] = v
+                if text[i] == ',':
+                    i = ws.match(text, i + 1).end()
+        except (IndexError, ValueError):
+            return None
+        return header
 
     @staticmethod
-    def _sanitise_ground_truth(ground_truth_data):
+    def _results_header(results_data):
+        # Validates the results data, returning only the (light) parts that
+        # are needed to validate a set of results (i.e. no objects)
+        Evaluator._validate_results_data(results_data)
+        return {
+            k: results_data[k]
+            for k in ['task_details', 'environment_details']
+        }
+
+    @staticmethod
+    def _load_results_arrays(arrays, headers_only=False, taxonomy=None):
+        # Pulls the JSON header & raw arrays out of an array-based submission
+        # (e.g. an opened *.npz file, where arrays are only read as needed)
+        if 'header' not in arrays:
+            raise ValueError("Required array 'header' not found in results "
+                             "arrays")
+        header = json.loads(np.asarray(arrays['header']).item())
+        if headers_only:
+            return Evaluator._results_header(dict(header, objects=[]))
+        return Evaluator.sanitise_results_arrays(
+            header, {
+                k: arrays[k] for k in (
+                    list(Evaluator._REQUIRED_RESULTS_ARRAYS.keys()) +
+                    list(Evaluator._REQUIRED_SCD_RESULTS_ARRAYS.keys()) +
+                    list(Evaluator._OPTIONAL_RESULTS_ARRAYS.keys()) +
+                    list(Evaluator._OPTIONAL_SCD_RESULTS_ARRAYS.keys()))
+                if k in arrays
+            }, taxonomy)
+
+    @staticmethod
+    def save_results_arrays(results_filename,
+                            task_details,
+                            environment_details,
+                            centroids,
+                            extents,
+                            label_probs,
+                            state_probs=None,
+                            class_list=None,
+                            scenes=None,
+                            label_indices=None):
+        # Saves results from numpy arrays (one row per object) in the
+        # array-based *.npz submission format, avoiding the cost of writing &
+        # parsing every value as JSON text. With label_indices, label_probs
+        # holds only the (top-k) probabilities of the classes at those indices
+        # in the class list, padded with indices of -1.
+        header = {
+            'task_details': task_details,
+            'environment_details': environment_details
+        }
+        if class_list is not None:
+            header['class_list'] = class_list
+        arrays = {
+            'centroids': centroids,
+            'extents': extents,
+            'label_probs': label_probs
+        }
+        if state_probs is not None:
+            arrays['state_probs'] = state_probs
+        if scenes is not None:
+            arrays['scenes'] = scenes
+        if label_indices is not None:
+            arrays['label_indices'] = label_indices
+        with open(results_filename, 'wb') as f:
+            np.savez(f, header=np.array(json.dumps(header)), **arrays)
+
+    @staticmethod
+    def _sanitise_ground_truth(ground_truth_data, taxonomy=None):
         # This code is only needed as we have a discrepancy between the format
         # of ground_truth_data produced in ground truth generation, & what the
         # evaluation process expects. Long term, the discrepancy should be
         # rectified & this code removed.
+        taxonomy = cl.ClassTaxonomy() if taxonomy is None else taxonomy
         for o in ground_truth_data['objects']:
-            o['class_id'] = cl.get_nearest_class_id(
+            o['class_id'] = taxonomy.get_nearest_class_id(
                 o.pop('class'))  # swap name for ID
         return ground_truth_data
 
@@ -314,21 +974,24 @@ class Evaluator:
     @staticmethod
     def _validate_results_set(results_set,
                               required_task=None,
-                              required_envs=None):
+                              required_envs=None,
+                              require_all_envs=True):
         # Validates whether a set of results meets requirements as a set (i.e.
         # all tasks the same, & possible task / environment contstraints)
         task_str = required_task
+        task_file = None
         env_strs = []
         for f, d in results_set.items():
             s = Evaluator._get_task_string(d['task_details'])
             if task_str is None:
                 task_str = s
+                task_file = f
             elif s != task_str and required_task is None:
                 raise ValueError(
                     "JSON result files can only be evaluated together if "
                     "they are for the same task. File '%s' was for task '%s', "
                     "whereas file '%s' was for task '%s'." %
-                    (results_set[0][0], task_str, f, s))
+                    (task_file, task_str, f, s))
             elif s != task_str:
                 raise ValueError(
                     "Evaluator was configured to only accept results for task "
@@ -348,7 +1011,7 @@ class Evaluator:
             env_strs.append(s)
 
         # Lastly, ensure we have all required environments if relevant
-        if required_envs is not None:
+        if required_envs is not None and require_all_envs:
             for e in required_envs:
                 if e not in env_strs:
                     raise ValueError(
@@ -357,8 +1020,11 @@ class Evaluator:
                         (", ".join(required_envs), e))
 
     @staticmethod
-    def sanitise_results_data(results_data):
+    def sanitise_results_data(results_data, taxonomy=None):
+        # Sanitises results to the class list of a taxonomy (None for the
+        # default class list, see class_list.ClassTaxonomy)
         is_scd = results_data['task_details']['type'] == Evaluator._TYPE_SCD
+        taxonomy = cl.ClassTaxonomy() if taxonomy is None else taxonomy
 
         # Validate the provided results data
         Evaluator._validate_results_data(results_data)
@@ -370,33 +1036,242 @@ class Evaluator:
             warnings.warn(
                 "No 'class_list' field provided; assuming results have used "
                 "our default class list")
-            results_data['class_list'] = cl.CLASS_LIST
+            results_data['class_list'] = taxonomy.class_list
 
         # Sanitise all probability distributions for labels & states if
         # applicable (sanitising involves dumping unused bins to the background
         # / uncertain class, normalising the total probability to 1, &
-        # optionally rearranging to match a required order)
-        for o in results_data['objects']:
-            if len(o['label_probs']) != len(results_data['class_list']):
+        # optionally rearranging to match a required order). Sparse label
+        # distributions stay sparse.
+        for i, o in enumerate(results_data['objects']):
+            if Evaluator._is_sparse_prob_dist(o['label_probs']):
+                try:
+                    o['label_probs'] = Evaluator.sanitise_sparse_prob_dist(
+                        o['label_probs'], results_data['class_list'],
+                        taxonomy)
+                except ValueError as e:
+                    raise ValueError(
+                        "The label probability distribution for object %d is "
+                        "invalid: %s" % (i, e))
+            elif len(o['label_probs']) != len(results_data['class_list']):
                 raise ValueError(
                     "The label probability distribution for object %d has a "
                     "different length (%d) \nto the used class list (%d). " %
                     (i, len(o['label_probs']), len(
                         results_data['class_list'])))
-            o['label_probs'] = Evaluator.sanitise_prob_dist(
-                o['label_probs'], results_data['class_list'])
+            else:
+                o['label_probs'] = Evaluator.sanitise_prob_dist(
+                    o['label_probs'], results_data['class_list'], taxonomy)
             if is_scd:
                 o['state_probs'] = Evaluator.sanitise_prob_dist(
                     o['state_probs'])
 
-        # We have applied our default class list to the label probs, so update
-        # the class list in results_data
-        results_data['class_list'] = cl.CLASS_LIST
+        # We have applied our class list to the label probs, so update the
+        # class list in results_data (with a copy, so later changes to the
+        # class list don't change it)
+        results_data['class_list'] = list(taxonomy.class_list)
+
+        return results_data
+
+    @staticmethod
+    def sanitise_results_arrays(header, arrays, taxonomy=None):
+        # Array-based equivalent of sanitise_results_data(), where the header
+        # holds everything except the objects, & arrays holds one row per
+        # object for each of the _REQUIRED_RESULTS_ARRAYS
+        taxonomy = cl.ClassTaxonomy() if taxonomy is None else taxonomy
+        results_data = dict(header, objects=[])
+        is_scd = results_data.get('task_details',
+                                  {}).get('type') == Evaluator._TYPE_SCD
+
+        # Validate the provided header & array shapes
+        Evaluator._validate_results_data(results_data)
+        required = dict(Evaluator._REQUIRED_RESULTS_ARRAYS,
+                        **(Evaluator._REQUIRED_SCD_RESULTS_ARRAYS
+                           if is_scd else {}))
+        for k in required:
+            if k not in arrays:
+                raise ValueError("Required array '%s' not found in results "
+                                 "arrays" % k)
+        required.update({
+            k: v
+            for k, v in dict(
+                Evaluator._OPTIONAL_RESULTS_ARRAYS, **(
+                    Evaluator._OPTIONAL_SCD_RESULTS_ARRAYS if is_scd else {
+                    })).items()
+            if k in arrays
+        })
+        arrays = {k: np.asarray(arrays[k], dtype=np.float64) for k in required}
+        n = len(arrays['centroids'])
+        for k, width in required.items():
+            if (arrays[k].ndim != 2 or arrays[k].shape[0] != n or
+                (width is not None and arrays[k].shape[1] != width)):
+                raise ValueError(
+                    "Array '%s' has shape %s, but (%d, %s) was expected" %
+                    (k, arrays[k].shape, n, 'c' if width is None else width))
+
+        # Use the default class_list if none is provided
+        if 'class_list' not in results_data or not results_data['class_list']:
+            warnings.warn(
+                "No 'class_list' field provided; assuming results have used "
+                "our default class list")
+            results_data['class_list'] = taxonomy.class_list
+        if 'label_indices' in arrays:
+            if arrays['label_indices'].shape != arrays['label_probs'].shape:
+                raise ValueError(
+                    "Array 'label_indices' has shape %s, but the same shape as "
+                    "'label_probs' %s was expected" %
+                    (arrays['label_indices'].shape,
+                     arrays['label_probs'].shape))
+        elif arrays['label_probs'].shape[1] != len(results_data['class_list']):
+            raise ValueError(
+                "The label probability distributions have a different length "
+                "(%d) \nto the used class list (%d). " %
+                (arrays['label_probs'].shape[1], len(
+                    results_data['class_list'])))
+
+        # Sanitise all of the probability distributions at once, then keep the
+        # objects as arrays all the way through scoring (see omq.ObjectArrays)
+        if 'label_indices' in arrays:
+            arrays['label_probs'] = Evaluator.sanitise_sparse_prob_dists(
+                arrays['label_indices'], arrays['label_probs'],
+                results_data['class_list'], taxonomy)
+        else:
+            arrays['label_probs'] = Evaluator.sanitise_prob_dists(
+                arrays['label_probs'], results_data['class_list'], taxonomy)
+        if is_scd:
+            arrays['state_probs'] = Evaluator.sanitise_prob_dists(
+                arrays['state_probs'])
+        results_data['class_list'] = list(taxonomy.class_list)
+        results_data['objects'] = ObjectArrays(
+            arrays['centroids'],
+            arrays['extents'],
+            arrays['label_probs'],
+            state_probs=arrays.get('state_probs'),
+            scenes=arrays.get('scenes'))
 
         return results_data
 
     @staticmethod
-    def sanitise_prob_dist(prob_dist, current_class_list=None):
+    def sanitise_prob_dists(prob_dists, current_class_list=None,
+                            taxonomy=None):
+        # Vectorised sanitise_prob_dist(), for an n x c array of distributions
+        BACKGROUND_CLASS_INDEX = -1
+
+        # Move probabilities to our class list with a mapping matrix (which
+        # amalgamates duplicates & sends unknown classes to the background)
+        if current_class_list is not None:
+            taxonomy = cl.ClassTaxonomy() if taxonomy is None else taxonomy
+            mapping = np.zeros(
+                (len(current_class_list), len(taxonomy.class_list)))
+            mapping[np.arange(len(current_class_list)),
+                    Evaluator._class_id_map(current_class_list, taxonomy)] = 1
+            prob_dists = np.dot(prob_dists, mapping)
+        else:
+            prob_dists = np.array(prob_dists, dtype=np.float64)
+
+        # Either normalize each distribution if it has a total > 1, or dump
+        # missing probability into the background / "I'm not sure" class
+        total_probs = np.sum(prob_dists, axis=1)
+        over = total_probs > 1
+        prob_dists[over] /= total_probs[over, np.newaxis]
+        prob_dists[~over, BACKGROUND_CLASS_INDEX] += 1 - total_probs[~over]
+
+        return prob_dists
+
+    @staticmethod
+    def sanitise_sparse_prob_dists(indices, probs, current_class_list,
+                                   taxonomy=None):
+        # Vectorised sanitise_sparse_prob_dist(), for n x k arrays of indices
+        # in current_class_list (-1 for none) & their probabilities. Returns an
+        # n x c scipy sparse (CSR) matrix of the distributions, with a column
+        # for every class id except the background class.
+        taxonomy = cl.ClassTaxonomy() if taxonomy is None else taxonomy
+        indices = np.asarray(indices, dtype=np.int64)
+        probs = np.where(indices >= 0, probs, 0.0)
+        if np.any(indices >= len(current_class_list)):
+            raise ValueError(
+                "Label indices must be less than the length of the used class "
+                "list (%d)" % len(current_class_list))
+        class_ids = np.append(
+            Evaluator._class_id_map(current_class_list, taxonomy), -1)[indices]
+
+        # Normalise distributions with a total > 1 (the missing probability of
+        # the others belongs to the background class, which is never kept)
+        total_probs = np.sum(probs, axis=1)
+        over = total_probs > 1
+        probs[over] /= total_probs[over, np.newaxis]
+        keep = ((class_ids >= 0) & (class_ids != len(taxonomy.class_list) - 1) &
+                (probs != 0))
+        # NOTE probabilities of indices mapped to the same class are summed
+        rows = np.nonzero(keep)[0]
+        return sparse.csr_matrix(
+            (probs[keep], (rows, class_ids[keep])),
+            shape=(len(indices), len(taxonomy.class_list) - 1))
+
+    @staticmethod
+    def sanitise_sparse_prob_dist(prob_dist,
+                                  current_class_list=None,
+                                  taxonomy=None):
+        # Sparse equivalent of sanitise_prob_dist(), for a label distribution
+        # given as a {class name: probability} dict, or a list of [index in
+        # current_class_list, probability] pairs. The sanitised distribution is
+        # a {class id: probability} dict of only the non-zero probabilities,
+        # without the background class (which is never needed for scoring), so
+        # large taxonomies never need to be expanded into dense lists.
+        taxonomy = cl.ClassTaxonomy() if taxonomy is None else taxonomy
+        if isinstance(prob_dist, dict):
+            items = [(taxonomy.get_nearest_class_id(c), p)
+                     for c, p in prob_dist.items()]
+        else:
+            if current_class_list is None:
+                raise ValueError("Label indices need a class list")
+            items = []
+            for i, p in prob_dist:
+                if not 0 <= int(i) < len(current_class_list):
+                    raise ValueError(
+                        "Label index %s is outside the used class list (%d)" %
+                        (i, len(current_class_list)))
+                items.append((taxonomy.get_nearest_class_id(
+                    current_class_list[int(i)]), p))
+
+        # Amalgamate duplicates (e.g. synonyms), then normalize the
+        # distribution if it has a total > 1 (otherwise missing probability
+        # belongs to the background class, which isn't kept)
+        new_prob_dist = {}
+        for c, p in items:
+            if (c is not None and c != len(taxonomy.class_list) - 1 and
+                    p != 0):
+                new_prob_dist[c] = new_prob_dist.get(c, 0.0) + p
+        total_prob = np.sum([p for _, p in items])
+        if total_prob > 1:
+            new_prob_dist = {
+                c: float(p / total_prob) for c, p in new_prob_dist.items()
+            }
+        return new_prob_dist
+
+    @staticmethod
+    def _is_sparse_prob_dist(prob_dist):
+        # Sparse distributions are {class name: probability} dicts, or lists of
+        # [index, probability] pairs (rather than a list of numbers)
+        return isinstance(prob_dist, dict) or (
+            len(prob_dist) > 0 and isinstance(prob_dist[0], (list, tuple)))
+
+    @staticmethod
+    def _class_id_map(current_class_list, taxonomy=None):
+        # Id of the nearest class in our class list (or the taxonomy's) for
+        # every class in another class list (unknown classes belong to the
+        # background class)
+        taxonomy = cl.ClassTaxonomy() if taxonomy is None else taxonomy
+        class_ids = [
+            taxonomy.get_nearest_class_id(c) for c in current_class_list
+        ]
+        return np.array([
+            len(taxonomy.class_list) - 1 if c is None else c for c in class_ids
+        ],
+                        dtype=np.int64)
+
+    @staticmethod
+    def sanitise_prob_dist(prob_dist, current_class_list=None, taxonomy=None):
         # This code makes the assumption that the last bin is the background /
         # "I'm not sure" class (it is an assumption because this function can
         # be called with no explicit use of a class list)
@@ -407,10 +1282,11 @@ class Evaluator:
         # list, & amalgamating all duplicate values (e.g. anything not
         # found in our list will be added to the background class)
         if current_class_list is not None:
-            new_prob_dist = [0.0] * len(cl.CLASS_LIST)
+            taxonomy = cl.ClassTaxonomy() if taxonomy is None else taxonomy
+            new_prob_dist = [0.0] * len(taxonomy.class_list)
             for i, c in enumerate(current_class_list):
-                new_prob_dist[BACKGROUND_CLASS_INDEX if cl.
-                              get_nearest_class_id(c) is None else cl.
+                new_prob_dist[BACKGROUND_CLASS_INDEX if taxonomy.
+                              get_nearest_class_id(c) is None else taxonomy.
                               get_nearest_class_id(c)] += prob_dist[i]
             prob_dist = new_prob_dist
 
@@ -425,72 +1301,477 @@ class Evaluator:
         return prob_dist
 
     def evaluate(self):
+        # Evaluate every results file, & amalgamate the scores into a final set
+        # of scores for the task
+        scores = Evaluator._amalgamate_scores(
+            list(self._evaluate_results_files().values()))
+        Evaluator._save_scores(scores, self.scores_filename, self._log)
+        return scores
+
+    async def evaluate_async(self, executor=None):
+        # Coroutine equivalent of evaluate(), for embedding evaluation in an
+        # asyncio service without blocking its event loop. File reads happen
+        # on the loop's default thread pool, & each results file is scored on
+        # the executor (None for the default thread pool; a process pool
+        # can't be used with reports or map states, as they are written by
+        # the scoring).
+        # Cancelling the coroutine stops evaluation at the next stage, with
+        # any stage already running in an executor left to finish in the
+        # background (its results are discarded). Scores are identical to
+        # evaluate().
+        loop = asyncio.get_running_loop()
+        scores = Evaluator._amalgamate_scores(
+            list((await self._evaluate_results_files_async(executor)).values()))
+        await loop.run_in_executor(None, Evaluator._save_scores, scores,
+                                   self.scores_filename, self._log)
+        return scores
+
+    def evaluate_shard(self, shard_filename):
+        # Evaluates only the results files given to this evaluator (i.e. one
+        # shard of a larger set of results), saving the per-file scores so
+        # shards from many machines can be combined with reduce_shards()
+        shard = {
+            'version': __version__,
+            'scoring_options': self._scoring_options(),
+            'scores': self._evaluate_results_files(shard=True)
+        }
+        with open(shard_filename, 'w') as f:
+            json.dump(shard, f)
+        return shard
+
+    @staticmethod
+    def merge_shards(shard_a, shard_b):
+        # Merges the scores from two shards (merging is associative, so shards
+        # can be reduced in any grouping)
+        for k in ['version', 'scoring_options']:
+            if shard_a[k] != shard_b[k]:
+                raise ValueError(
+                    "Shards can only be merged if they were evaluated with the "
+                    "same %s ('%s' vs '%s')." % (k, shard_a[k], shard_b[k]))
+        for f in shard_a['scores']:
+            if f in shard_b['scores']:
+                raise ValueError(
+                    "Results file '%s' was evaluated in more than one shard." %
+                    f)
+        return {
+            'version': shard_a['version'],
+            'scoring_options': shard_a['scoring_options'],
+            'scores': dict(shard_a['scores'], **shard_b['scores'])
+        }
+
+    @staticmethod
+    def reduce_shards(shard_filenames,
+                      scores_filename,
+                      required_task=None,
+                      required_envs=None,
+                      quiet=False):
+        # Combines the shards saved by evaluate_shard() into final scores,
+        # which are identical to evaluating all results files in one evaluator
+        # (results are listed in the order of the shards, then the order of
+        # the results files in each shard)
+        log = (lambda *args: None) if quiet else print
+        shard = None
+        for fn in shard_filenames:
+            log("Loading shard data from '%s' ..." % fn)
+            with open(fn, 'r') as f:
+                s = json.load(f)
+            shard = s if shard is None else Evaluator.merge_shards(shard, s)
+        log("\tDone.")
+
+        # Scores dicts hold the same task & environment details as the results
+        # they were created from, so we can validate them exactly the same
+        Evaluator._validate_results_set(shard['scores'], required_task,
+                                        required_envs)
+        scores = Evaluator._amalgamate_scores(list(shard['scores'].values()))
+        Evaluator._save_scores(scores, scores_filename, log)
+        return scores
+
+    def _evaluate_results_files(self, shard=False):
+        self._start_time = time.time()
+        self._emit('started', results_files=len(self.results_filenames))
+        self._log("LOADING REQUIRED DATA FOR %d PROVIDED FILES:\n" %
+                  len(self.results_filenames))
+        if self.pipeline_depth is None:
+            results = self._load_results_files(shard)
+        else:
+            results = self._pipeline_results_files(shard)
+
+        # Iteratively evaluate each of the results JSONs provided, saving the
+        # scores so we can amalgamate them after
+        report, candidates, journal, states = self._open_outputs()
+        try:
+            with contextlib.closing(results):
+                scores_data = self._evaluate_results_set(
+                    results, report, journal, candidates, states)
+        finally:
+            Evaluator._close_outputs(report, candidates, states)
+        self._emit('finished', results=len(scores_data))
+        return scores_data
+
+    async def _evaluate_results_files_async(self, executor):
+        # Coroutine equivalent of _evaluate_results_files(), where each stage
+        # runs off the event loop: loading & any other file access on the
+        # loop's default thread pool, & scoring on the executor. Results are
+        # always loaded up front (pipeline_depth is only used by evaluate()).
+        loop = asyncio.get_running_loop()
+        self._start_time = time.time()
+        self._emit('started', results_files=len(self.results_filenames))
+        self._log("LOADING REQUIRED DATA FOR %d PROVIDED FILES:\n" %
+                  len(self.results_filenames))
+        results = await loop.run_in_executor(None, self._load_results_files,
+                                             False)
+        report, candidates, journal, states = await loop.run_in_executor(
+            None, self._open_outputs)
+        reported = Evaluator._is_reported(report, candidates, states)
+        try:
+            scores_data = {}
+            for f, d, ground_truth_data in results:
+                self._log("EVALUATING PERFORMANCE OF RESULTS IN '%s':\n" % f)
+                key, scores, journalled = await loop.run_in_executor(
+                    None, self._find_scores, d, ground_truth_data, reported,
+                    journal)
+                scored = scores is None
+                if scored:
+                    scores = await loop.run_in_executor(
+                        executor, Evaluator._score_results_data,
+                        *self._scoring_args(f, d, ground_truth_data, report,
+                                            candidates, states))
+                await loop.run_in_executor(None, self._store_scores, f, key,
+                                           scores, journal, journalled, scored,
+                                           len(d['objects']))
+                scores_data[f] = scores
+        finally:
+            Evaluator._close_outputs(report, candidates, states)
+        self._emit('finished', results=len(scores_data))
+        return scores_data
+
+    def _open_outputs(self):
+        # Opens the (optional) report, candidate report, journal, & map states
+        # that are written (or read) as results are evaluated
+        o = self.outputs
+        return ((None if o['report'] is None else MatchReport(
+            o['report'], o['report_attribution'])),
+                (None if o['candidates'] is None else CandidateReport(
+                    o['candidates'], o['num_candidates'])),
+                (None if o['journal'] is None else ScoreJournal(o['journal'])),
+                (None if o['states'] is None and o['previous_states'] is None
+                 else MapStates(o['states'], o['previous_states'])))
+
+    @staticmethod
+    def _close_outputs(report, candidates, states=None):
+        # Closes the reports & map states opened by _open_outputs() (journals
+        # are flushed as they are written, so never need closing)
+        if report is not None:
+            report.close()
+        if candidates is not None:
+            candidates.close()
+        if states is not None:
+            states.close()
+
+    @staticmethod
+    def _is_reported(report, candidates, states):
+        # Whether every result needs a full evaluation, as it is written to a
+        # report or its map states are written
+        return (report is not None or candidates is not None or
+                (states is not None and states.writing))
+
+    def _load_results_files(self, shard):
         # Iteratively load data from each results file (turning *.zips into a
         # list of JSON results), & sanitise the data
-        print("LOADING REQUIRED DATA FOR %d PROVIDED FILES:\n" %
-              len(self.results_filenames))
-        results_set = Evaluator._load_results_data(self.results_filenames)
+        results_set = Evaluator._load_results_data(self.results_filenames,
+                                                   log=self._log,
+                                                   emit=self._emit,
+                                                   taxonomy=self.taxonomy)
 
         # Ensure the results set meets any requirements that may exist (all
         # must be same task type, may have to be a required task type, may have
-        # to match a required list of environments)
-        Evaluator._validate_results_set(results_set, self.required_task,
-                                        self.required_envs)
+        # to match a required list of environments). A shard only holds some
+        # of the required environments.
+        Evaluator._validate_results_set(results_set,
+                                        self.required_task,
+                                        self.required_envs,
+                                        require_all_envs=not shard)
 
         # Try & load all of the requested ground truth maps (failing loudly if
         # a required ground truth can't be found)
         ground_truth_data = Evaluator._load_ground_truth_data(
             self.ground_truth_dir,
-            [r['environment_details'] for r in results_set.values()])
-        print('\n' + '-' * 80 + '\n')
+            [r['environment_details'] for r in results_set.values()],
+            log=self._log,
+            emit=self._emit,
+            taxonomy=self.taxonomy)
+        self._log('\n' + '-' * 80 + '\n')
+        return ((f, d, ground_truth_data) for f, d in results_set.items())
 
-        # Iteratively evaluate each of the results JSONs provided, saving the
-        # scores so we can amalgamate them after
-        scores_data = []
-        for f, d in results_set.items():
-            print("EVALUATING PERFORMANCE OF RESULTS IN '%s':\n" % f)
-
-            # Perform evaluation, selecting the appropriate evaluation function
-            scores_data.append(
-                (self._evaluate_scd
-                 if d['task_details']['type'] == Evaluator._TYPE_SCD else
-                 self._evaluate_semantic_slam)(d, ground_truth_data))
-
-            # Print the results if allowed, otherwise just say we're done
-            if self.print_all:
-                print("\nScores for '%s':\n" % f)
-                pprint.pprint(scores_data[-1])
-            else:
-                print("Done")
-            print('\n' + '-' * 80 + '\n')
+    def _pipeline_results_files(self, shard):
+        # Validate the results set using only the light headers of each result
+        # (so nothing is scored if the set is invalid), then load & sanitise
+        # each result with its ground truth in a producer thread, a bounded
+        # number of results ahead of scoring
+        self._log("Validating results headers ...")
+        headers = list(
+            Evaluator._iter_results_data(self.results_filenames,
+                                         headers_only=True))
+        Evaluator._validate_results_set(dict(headers),
+                                        self.required_task,
+                                        self.required_envs,
+                                        require_all_envs=not shard)
+        self._log("\tDone.")
+        self._log('\n' + '-' * 80 + '\n')
+
+        q = queue.Queue(maxsize=self.pipeline_depth)
+        stop = threading.Event()
+        producer = threading.Thread(
+            target=self._produce_results,
+            args=(q, stop, [h['environment_details'] for _, h in headers]))
+        producer.daemon = True
+        producer.start()
+        try:
+            while True:
+                item = q.get()
+                if item is None:
+                    break
+                elif isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            producer.join()
 
-        # Amalgamate all of the produced scores
-        scores = Evaluator._create_scores(
+    def _produce_results(self, q, stop, envs_details_list):
+        # Producer for _pipeline_results_files(), putting (name, results data,
+        # ground truth data) on the queue, then None when done (or the error
+        # if one occurs). Stops early if the consumer sets stop. Ground truth
+        # for each environment is loaded once, & only kept until the last
+        # result that needs it (envs_details_list holds the environment
+        # details of every result, in order).
+        def put(item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        uses = {}
+        for e in envs_details_list:
+            for s in Evaluator._get_env_strings(e):
+                uses[s] = uses.get(s, 0) + 1
+        ground_truth_data = {}
+        try:
+            for f, d in Evaluator._iter_results_data(self.results_filenames,
+                                                     log=self._log,
+                                                     emit=self._emit,
+                                                     taxonomy=self.taxonomy):
+                Evaluator._load_ground_truth_data(
+                    self.ground_truth_dir, [d['environment_details']],
+                    log=self._log,
+                    emit=self._emit,
+                    taxonomy=self.taxonomy,
+                    ground_truth_data=ground_truth_data)
+                env_strs = Evaluator._get_env_strings(d['environment_details'])
+                item = (f, d, {s: ground_truth_data[s] for s in env_strs})
+                for s in env_strs:
+                    uses[s] = uses.get(s, 0) - 1
+                    if uses[s] <= 0:
+                        ground_truth_data.pop(s, None)
+                if not put(item):
+                    return
+            put(None)
+        except Exception as e:
+            put(e)
+
+    def _evaluate_results_set(self,
+                              results,
+                              report,
+                              journal=None,
+                              candidates=None,
+                              states=None):
+        scores_data = {}
+        for f, d, ground_truth_data in results:
+            self._log("EVALUATING PERFORMANCE OF RESULTS IN '%s':\n" % f)
+            key, scores, journalled = self._find_scores(
+                d, ground_truth_data,
+                Evaluator._is_reported(report, candidates, states), journal)
+            scored = scores is None
+            if scored:
+                scores = Evaluator._score_results_data(*self._scoring_args(
+                    f, d, ground_truth_data, report, candidates, states))
+            self._store_scores(f, key, scores, journal, journalled, scored,
+                               len(d['objects']))
+            scores_data[f] = scores
+        return scores_data
+
+    def _find_scores(self, results_data, ground_truth_data, reported,
+                     journal):
+        # Finds the scores for results if the exact same evaluation was
+        # completed by a previous run with this journal, or has been cached
+        # previously (returning the key, scores or None, & whether they were
+        # journalled). Journalled & cached scores are never used when a
+        # report (or candidate report, or map states) is requested, as the
+        # report needs the full evaluation.
+        key = (None if self.cache is None and journal is None else
+               self._cache_key(results_data, ground_truth_data))
+        journalled = (key is not None and not reported and
+                      journal is not None and journal.get(key) is not None)
+        scores = None
+        if journalled:
+            scores = journal.get(key)
+            self._log("Using journalled scores")
+        elif key is not None and not reported and self.cache is not None:
+            scores = self.cache.get(key)
+            if scores is not None:
+                self._log("Using cached scores")
+        return key, scores, journalled
+
+    def _scoring_args(self,
+                      filename,
+                      results_data,
+                      ground_truth_data,
+                      report,
+                      candidates,
+                      states=None):
+        # Arguments for _score_results_data(), with any reports labelled by
+        # the results file they are about to be written for
+        if report is not None:
+            report.source = filename
+        if candidates is not None:
+            candidates.source = filename
+        return (results_data, ground_truth_data,
+                dict(self._omq_options(),
+                     report=report,
+                     candidates=candidates,
+                     states=states), self.scd_pairs,
+                self._preview_options())
+
+    @staticmethod
+    def _score_results_data(results_data, ground_truth_data, omq_options,
+                            scd_pairs, preview):
+        # Perform evaluation, selecting the appropriate evaluation function
+        # (static, so it can also be run in another process)
+        if results_data['task_details']['type'] == Evaluator._TYPE_SCD:
+            return Evaluator._evaluate_scd(results_data, ground_truth_data,
+                                           omq_options, scd_pairs, preview)
+        return Evaluator._evaluate_semantic_slam(results_data,
+                                                 ground_truth_data,
+                                                 omq_options, preview)
+
+    def _store_scores(self, filename, key, scores, journal, journalled,
+                      scored, objects):
+        # Caches freshly scored results, & journals any results that weren't
+        # already journalled
+        if scored and self.cache is not None:
+            self.cache.put(key, scores)
+        if journal is not None and not journalled:
+            journal.append(key, filename, scores)
+
+        # Print the results if allowed, otherwise just say we're done
+        if self.print_all:
+            self._log("\nScores for '%s':\n" % filename)
+            self._log(pprint.pformat(scores))
+        else:
+            self._log("Done")
+        self._log('\n' + '-' * 80 + '\n')
+        self._emit('map_scored',
+                   filename=filename,
+                   objects=objects,
+                   source=('scored' if scored else
+                           'journalled' if journalled else 'cached'))
+
+    @staticmethod
+    def _amalgamate_scores(scores_data):
+        # Amalgamate all of the produced scores. Details of each result are
+        # listed in the order given, but scores are reduced in a fixed order
+        # so they don't depend on the order results were evaluated in.
+        listed = scores_data
+        scores_data = sorted(
+            scores_data,
+            key=lambda s: Evaluator._get_env_string(s['environment_details']))
+        return Evaluator._create_scores(
             task_details=scores_data[0]['task_details'],
-            environment_details=[
-                s['environment_details'] for s in scores_data
-            ],
+            environment_details=[s['environment_details'] for s in listed],
             scores_omq=np.mean([s['scores']['OMQ'] for s in scores_data]),
             scores_avg_pairwise=np.mean(
                 [s['scores']['avg_pairwise'] for s in scores_data]),
-            scores_avg_label=np.mean(
-                [s['scores']['avg_label'] for s in scores_data]),
-            scores_avg_spatial=np.mean(
-                [s['scores']['avg_spatial'] for s in scores_data]),
+            scores_avg_label=(np.mean([
+                s['scores']['avg_label'] for s in scores_data
+            ]) if 'avg_label' in scores_data[0]['scores'] else None),
+            scores_avg_spatial=(np.mean([
+                s['scores']['avg_spatial'] for s in scores_data
+            ]) if 'avg_spatial' in scores_data[0]['scores'] else None),
             scores_avg_fp_quality=np.mean(
                 [s['scores']['avg_fp_quality'] for s in scores_data]),
             scores_avg_state_quality=(np.mean([
                 s['scores']['avg_state_quality'] for s in scores_data
             ]) if 'avg_state_quality' in scores_data[0]['scores'] else None),
-        )
-
-        # Print the results, save them, & finish
-        print(("\nFinal scores for the '%s:%s:%s' task:\n" %
-               (scores['task_details']['type'],
-                scores['task_details']['control_mode'],
-                scores['task_details']['localisation_mode'])).upper())
-        pprint.pprint(scores)
-        with open(self.scores_filename, 'w') as f:
+            scores_per_class=(Evaluator._amalgamate_per_class_scores(
+                [s['scores']['per_class'] for s in scores_data])
+                              if 'per_class' in scores_data[0]['scores'] else
+                              None),
+            scores_per_region=(Evaluator._amalgamate_per_class_scores([
+                s['scores']['per_region']
+                for s in scores_data
+                if 'per_region' in s['scores']
+            ]) if any('per_region' in s['scores'] for s in scores_data) else
+                               None),
+            scores_per_scene_pair=({
+                k: v for s in listed
+                for k, v in s['scores'].get('per_scene_pair', {}).items()
+            } if any('per_scene_pair' in s['scores'] for s in scores_data) else
+                                   None),
+            assignment_details=({
+                'backend':
+                    scores_data[0]['assignment']['backend'],
+                'quality_gap':
+                    np.sum([s['assignment']['quality_gap'] for s in scores_data])
+            } if 'assignment' in scores_data[0] else None),
+            preview_details=(Evaluator._amalgamate_preview_details(
+                [s['preview'] for s in scores_data])
+                             if 'preview' in scores_data[0] else None),
+            verification_details=(Evaluator._amalgamate_verification_details(
+                [s['verification'] for s in scores_data])
+                                  if 'verification' in scores_data[0] else
+                                  None),
+            plan_details=([p for s in listed for p in s['plan']]
+                          if 'plan' in scores_data[0] else None))
+
+    @staticmethod
+    def _amalgamate_preview_details(preview_list):
+        # Averaging the bounds of each result's interval gives an interval at
+        # least as wide as needed for the average of independent estimates
+        return {
+            'fraction': preview_list[0]['fraction'],
+            'regions': int(np.sum([p['regions'] for p in preview_list])),
+            'sampled_regions':
+                int(np.sum([p['sampled_regions'] for p in preview_list])),
+            'confidence': preview_list[0]['confidence'],
+            'intervals': {
+                k: [
+                    float(np.mean([p['intervals'][k][i] for p in preview_list]))
+                    for i in [0, 1]
+                ] for k in preview_list[0]['intervals']
+            }
+        }
+
+    @staticmethod
+    def _save_scores(scores, scores_filename, log=print):
+        # Print the results (with log), save them, & finish
+        log(("\nFinal scores for the '%s:%s:%s' task:\n" %
+             (scores['task_details']['type'],
+              scores['task_details']['control_mode'],
+              scores['task_details']['localisation_mode'])).upper())
+        log(pprint.pformat(scores))
+        with open(scores_filename, 'w') as f:
             json.dump(scores, f)
-        print("\nDone.")
-        return scores
+        log("\nDone.")
+
+
+def _freeze(value):
+    # Turns JSON-like data into a hashable equivalent (that compares equal
+    # exactly when the original data does)
+    if isinstance(value, dict):
+        return frozenset((k, _freeze(v)) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
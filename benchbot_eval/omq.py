@@ -1,12 +1,123 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import math
+import os
+import time
 import numpy as np
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from scipy import sparse
 from scipy.optimize import linear_sum_assignment
-from scipy.stats import gmean
+from scipy.sparse import csgraph
 from . import iou_tools
+from .assignment import IncrementalAssignment, pad_assignment, sparse_assignment
+from .cache import content_hash
+from .options import resolve_options
 
 _IOU_TOOL = iou_tools.IoU()
 _STATE_IDS = {"added": 0, "removed": 1, "constant": 2}
+_ASSIGNMENT_BACKENDS = ['hungarian', 'sparse']
+_CHUNK_MIN_PAIRS = 10000
+_TILE_BYTES_PER_PAIR = 160  # Approximate working memory used per pair
+_PLAN_SAMPLE_PAIRS = 1000  # Pairs sampled to estimate the density of a map
+# Seconds taken by each unit of work in the cost model that plans maps (see
+# _plan_map()). These are rough single core figures for a current desktop CPU,
+# only used to compare backends & check limits, so they need only be right to
+# within a small factor. They can be measured on the machine evaluating with
+# calibrate_cost_model(), & given to OMQ as plan={'seconds': ...}.
+COST_MODEL_SECONDS = {
+    # Label, state, & overall qualities, & the cost tables, per pair
+    'pair': 1.5e-7,
+    # 3D IoU of a single pair with iou_tools (polygon intersection)
+    'iou': 2e-4,
+    # Vectorised 3D IoU of axis-aligned cuboids (batched), per pair
+    'iou_aligned': 3.5e-7,
+    # Hungarian assignment, per n^3 for the padded n x n cost table
+    'hungarian': 5e-11,
+    # Finding the pairs with non-zero quality for sparse assignment, per pair
+    'sparse_scan': 1e-8,
+    # Sparse assignment searches, per non-zero pair & per square root of the
+    # average number of non-zero pairs for each ground-truth object
+    'sparse_pair': 2e-5
+}
+# Option groups of OMQ, with the default of every option in each group (see
+# OMQ.__init__())
+OPTION_DEFAULTS = {
+    'assignment': {
+        'backend': 'hungarian',
+        'time_budget': None
+    },
+    'tiling': {
+        'max_bytes': None,
+        'workers': None
+    },
+    'verify': {
+        'fraction': None,
+        'tolerance': 1e-6,
+        'seed': None
+    },
+    'plan': {
+        'auto': False,
+        'max_map_bytes': None,
+        'max_map_seconds': None,
+        'seconds': None
+    }
+}
+# Options every map is evaluated with, with their defaults (see _map_options())
+_MAP_OPTION_DEFAULTS = {
+    'scd_mode': False,
+    'batched': False,
+    'components': None,
+    'regions': None,
+    'assignment': 'hungarian',
+    'time_budget': None,
+    'max_tile_bytes': None,
+    'tile_workers': None,
+    'report': False,
+    'attribution': False,
+    'candidates': None,
+    'state': False
+}
+# Totals of the evaluation measures that scores are calculated from (see
+# calc_scores())
+TOTAL_KEYS = [
+    'overall', 'spatial', 'label', 'fp_cost', 'TP', 'FP', 'FN', 'state_change'
+]
+_COST_TABLE_KEYS = ['overall', 'spatial', 'label', 'state']
+# Name of the quality table transformed from each cost table (see
+# _calc_quality_tables())
+_QUALITY_TABLE_NAMES = {
+    'overall': 'overall',
+    'spatial': 'spatial',
+    'label': 'label',
+    'state': 'state_change'
+}
+_COMPONENTS = [
+    'OMQ', 'avg_pairwise', 'avg_label', 'avg_spatial', 'avg_fp_quality',
+    'avg_state_quality', 'per_class', 'per_region'
+]
+_COMPONENT_TABLES = {
+    'avg_label': ['label'],
+    'avg_spatial': ['spatial'],
+    'avg_state_quality': ['state'],
+    'per_class': ['spatial', 'label', 'state'],
+    'per_region': ['spatial', 'label', 'state']
+}
+# Score components only calculated when explicitly requested (i.e. not
+# included when components is None)
+_OPT_IN_COMPONENTS = ['per_class']
+# Attribute of ObjectArrays holding each field of an object proposal dict
+_OBJECT_ARRAYS = {
+    'centroid': 'centroids',
+    'extent': 'extents',
+    'label_probs': 'label_probs',
+    'state_probs': 'state_probs',
+    'scenes': 'scenes'
+}
+_VERIFY_SCORE_KEYS = [
+    'OMQ', 'avg_pairwise', 'avg_label', 'avg_spatial', 'avg_fp_quality',
+    'avg_state_quality', 'TP', 'FP', 'FN'
+]
 
 # NOTE For now we will ignore the concept of foreground and background quality in favor of
 # spatial quality being just the IoU of a detection.
@@ -20,36 +131,132 @@ class OMQ(object):
     https://github.com/david2611/pdq_evaluation
     """
 
-    def __init__(self, scd_mode=False):
+    def __init__(self,
+                 scd_mode=False,
+                 batched=False,
+                 components=None,
+                 regions=None,
+                 assignment=None,
+                 tiling=None,
+                 verify=None,
+                 plan=None,
+                 report=None,
+                 candidates=None,
+                 states=None):
         """
-        Initialisation function for OMQ evaluator
+        Initialisation function for OMQ evaluator. Options of the optional features are grouped in dicts, where any
+        option left out (or the whole group given as None) takes its default from OPTION_DEFAULTS.
         :param: scd_mode: flag for whether OMQ is evaluating a scene change detection system which has
         an extra consideration made for the uncertainty in the map for the state of an object (added, removed, same)
+        :param: batched: flag for whether qualities are calculated for many maps at once in a batch, using a vectorised
+        3D IoU of axis-aligned cuboids. Much faster for many small maps, with spatial qualities that can differ from the
+        default (per pair) calculation by floating point rounding only.
+        :param: components: list of the score components calculated, from 'OMQ', 'avg_pairwise', 'avg_label',
+        'avg_spatial', 'avg_fp_quality', 'avg_state_quality', 'per_class', & 'per_region' (None for all of them
+        except 'per_class', which is only calculated when requested explicitly). The OMQ score, average pairwise
+        quality, & average false positive quality are always calculated, as they need nothing beyond the assignment.
+        Requesting only these (e.g. ['OMQ']) skips all separate spatial, label, & state bookkeeping.
+        :param: regions: list of named regions (e.g. rooms & floors) that scores are also broken down by (see
+        get_per_region_scores()). Each region is a dict with a 'name', & either the 'centroid' & 'extent' of an
+        axis-aligned volume, or a 'polygon' of [x, y] vertices on the ground plane (with an optional [min, max]
+        'height_range' of z values). Regions may overlap, & apply to every map evaluated (None for no regions).
+        :param: assignment: dict of assignment options. 'backend' assigns object proposals to ground-truth objects with
+        either 'hungarian' for the optimal assignment over the full (padded) cost table, or 'sparse' for very large
+        maps, which only considers pairs with non-zero quality & becomes approximate if it exceeds its time budget
+        (reporting a certified bound on how far its total quality is from the optimum, see get_assignment_gap()).
+        'time_budget' is the time in seconds allowed for each map's sparse assignment before the remainder is completed
+        greedily (None for no limit; only used with the 'sparse' backend).
+        :param: tiling: dict of tiling options. 'max_bytes' is the approximate maximum bytes of working memory used to
+        calculate the qualities of a single map. Larger maps have their cost tables filled tile by tile, with tiles
+        calculated concurrently on 'workers' threads (None for no limit, & for the thread pool default). Scores are
+        unchanged, only the peak memory & speed of large maps are affected.
+        :param: verify: dict of verification options. A 'fraction' of randomly chosen maps are also evaluated with the
+        reference implementation (per pair 3D IoU for every pair, & Hungarian assignment), checking the selected fast
+        paths give the same cost tables & scores (None to never verify, see get_verification()). Evaluation fails with a
+        ValueError if any quality or score differs by more than 'tolerance', & 'seed' seeds the choice of maps (None for
+        an unseeded choice).
+        :param: plan: dict of planning options. With 'auto', each map's assignment backend & tiling are chosen from a
+        cost model estimating the work & memory each would need (see _plan_map()). The 'sparse' backend is chosen when
+        its estimated work is lower, & qualities are tiled when needed to stay within 'max_map_bytes', with tiles
+        calculated in parallel when batched. 'max_map_bytes' & 'max_map_seconds' limit the approximate memory & seconds
+        of work any map may need, as estimated by the cost model: all maps are planned before any are evaluated, & a
+        ValueError is raised if any map would exceed a limit (None for no limit). 'seconds' gives the seconds taken by
+        each unit of work in the cost model (None for COST_MODEL_SECONDS, see calibrate_cost_model()). The chosen plans
+        are kept (see get_plans()).
+        :param: report: MatchReport that every match, false positive, & false negative is written to as each map is
+        evaluated (None for no report)
+        :param: candidates: CandidateReport that the k best candidate matches for every ground-truth object & object
+        proposal are written to as each map is evaluated (None for no candidate report)
+        :param: states: MapStates that the state of each map is written to as it is evaluated, & that any previous state
+        of each map (from an evaluation against the same ground truth) is read from. Maps with a previous state only
+        recalculate qualities for the object proposals that changed, & only re-solve the assignment of the connected
+        groups of objects those changes touch (with the 'sparse' backend), giving exactly the same scores as evaluating
+        them from scratch (None to evaluate every map from scratch)
         """
         super(OMQ, self).__init__()
-        self._tot_overall_quality = 0.0
-        self._tot_spatial_quality = 0.0
-        self._tot_label_quality = 0.0
-        self._tot_fp_cost = 0.0
-        self._tot_TP = 0
-        self._tot_FP = 0
-        self._tot_FN = 0
-        self._tot_state_quality = 0.0
+        assignment, tiling, verify, plan = [
+            resolve_options(k, v, OPTION_DEFAULTS[k])
+            for k, v in [('assignment', assignment), ('tiling', tiling),
+                         ('verify', verify), ('plan', plan)]
+        ]
+        if assignment['backend'] not in _ASSIGNMENT_BACKENDS:
+            raise ValueError("Assignment backend '%s' is not one of: %s" %
+                             (assignment['backend'],
+                              ", ".join(_ASSIGNMENT_BACKENDS)))
+        if components is not None and any(c not in _COMPONENTS
+                                          for c in components):
+            raise ValueError("Score components %s are not all from: %s" %
+                             (components, ", ".join(_COMPONENTS)))
+        if states is not None and assignment['time_budget'] is not None:
+            raise ValueError(
+                "Map states can't be used with an assignment time budget, as "
+                "approximate assignments can't be reproduced exactly")
+        if plan['seconds'] is not None:
+            resolve_options('plan seconds', plan['seconds'],
+                            COST_MODEL_SECONDS)
+        _check_regions(regions)
+        self._partial = OMQPartial()
         self.scd_mode = scd_mode
+        self.batched = batched
+        self.components = components
+        self.regions = regions
+        self.assignment = assignment
+        self.tiling = tiling
+        self.verify = verify
+        self.plan = plan
+        self.report = report
+        self.candidates = candidates
+        self.states = states
+        self._plans = []
+        self._verify_rng = np.random.default_rng(verify['seed'])
+        self._verification = {
+            'maps': 0,
+            'tables': {
+                k: 0.0 for k in _component_tables(self._map_components())
+            },
+            'scores': {
+                k: 0.0 for k in _VERIFY_SCORE_KEYS if self.has_component(k)
+            }
+        }
+
+    # Running totals are all held in a mergeable OMQPartial
+    _tot_overall_quality = property(lambda self: self._partial.total('overall'))
+    _tot_spatial_quality = property(lambda self: self._partial.total('spatial'))
+    _tot_label_quality = property(lambda self: self._partial.total('label'))
+    _tot_fp_cost = property(lambda self: self._partial.total('fp_cost'))
+    _tot_TP = property(lambda self: self._partial.total('TP'))
+    _tot_FP = property(lambda self: self._partial.total('FP'))
+    _tot_FN = property(lambda self: self._partial.total('FN'))
+    _tot_state_quality = property(
+        lambda self: self._partial.total('state_change'))
 
     def reset(self):
         """
         Reset all internally stored evaluation measures to zero.
         :return: None
         """
-        self._tot_overall_quality = 0.0
-        self._tot_spatial_quality = 0.0
-        self._tot_label_quality = 0.0
-        self._tot_fp_cost = 0.0
-        self._tot_TP = 0
-        self._tot_FP = 0
-        self._tot_FN = 0
-        self._tot_state_quality = 0.0
+        self._partial = OMQPartial()
+        self._plans = []
 
     def add_map_eval(self, gt_objects, proposed_objects):
         """
@@ -58,15 +265,8 @@ class OMQ(object):
         :param proposed_objects: list of detection dictionaries objects provided for the given map
         :return: None
         """
-        results = _calc_qual_map(gt_objects, proposed_objects, self.scd_mode)
-        self._tot_overall_quality += results['overall']
-        self._tot_spatial_quality += results['spatial']
-        self._tot_label_quality += results['label']
-        self._tot_fp_cost += results['fp_cost']
-        self._tot_TP += results['TP']
-        self._tot_FP += results['FP']
-        self._tot_FN += results['FN']
-        self._tot_state_quality += results['state_change']
+        self._add_map_results(
+            *self._get_map_evals((gt_objects, proposed_objects)))
 
     def get_current_score(self):
         """
@@ -79,7 +279,7 @@ class OMQ(object):
             return self._tot_overall_quality / denominator
         return 0.0
 
-    def score(self, param_lists):
+    def score(self, param_lists, executor=None, workers=None):
         """
         Calculates the average quality score for a set of object proposals on
         a set of ground truth objects over a series of maps.
@@ -87,22 +287,25 @@ class OMQ(object):
         with FPs weighted by confidence.
         Note that this removes any evaluation information that had been stored for previous maps.
         Assumes you want to score just the full list you are given.
+        Maps are independent, so they can be evaluated concurrently by providing an executor or a number of worker
+        processes. Small maps are grouped into chunks to keep dispatch overhead low, and results are always combined
+        in map order so scores do not depend on how maps were distributed.
         :param param_lists: A list of tuples where each tuple holds a list of ground-truth dicts and a list of
         detection dicts. Each map observed is an entry in the main list.
+        :param executor: concurrent.futures.Executor used to evaluate chunks of maps (None to not use an executor)
+        :param workers: number of worker processes to evaluate maps with, if no executor is given (None or 1 evaluates
+        all maps in the current process)
         :return: The OMQ score across all maps as a float
         """
         self.reset()
 
-        for map_params in param_lists:
-            map_results = self._get_map_evals(map_params)
-            self._tot_overall_quality += map_results['overall']
-            self._tot_spatial_quality += map_results['spatial']
-            self._tot_label_quality += map_results['label']
-            self._tot_fp_cost += map_results['fp_cost']
-            self._tot_TP += map_results['TP']
-            self._tot_FP += map_results['FP']
-            self._tot_FN += map_results['FN']
-            self._tot_state_quality += map_results['state_change']
+        if executor is None and (workers is None or workers <= 1):
+            self._add_chunked_map_evals(param_lists, None)
+        elif executor is None:
+            with ProcessPoolExecutor(max_workers=workers) as e:
+                self._add_chunked_map_evals(param_lists, e)
+        else:
+            self._add_chunked_map_evals(param_lists, executor)
 
         return self.get_current_score()
 
@@ -113,6 +316,7 @@ class OMQ(object):
         and FNs like the final Semantic SLAM OMQ score.
         :return: average spatial quality of every assigned detection
         """
+        self._check_component('avg_spatial')
         if self._tot_TP > 0.0:
             return self._tot_spatial_quality / float(self._tot_TP)
         return 0.0
@@ -124,6 +328,7 @@ class OMQ(object):
         and FNs like the final OMQ score.
         :return: average label quality of every assigned detection
         """
+        self._check_component('avg_label')
         if self._tot_TP > 0.0:
             return self._tot_label_quality / float(self._tot_TP)
         return 0.0
@@ -135,6 +340,7 @@ class OMQ(object):
         and FNs like the final OMQ score.
         :return: average label quality of every assigned detection
         """
+        self._check_component('avg_state_quality')
         if self._tot_TP > 0.0:
             return self._tot_state_quality / float(self._tot_TP)
         return 0.0
@@ -170,11 +376,206 @@ class OMQ(object):
         """
         return self._tot_TP, self._tot_FP, self._tot_FN
 
+    def get_assignment_gap(self):
+        """
+        Get the certified upper bound on how much total pairwise quality the assignments for all maps analysed at the
+        current time could be below the optimal assignments. Always zero for the 'hungarian' backend,
+        & for the 'sparse' backend when it stays within its time budget.
+        Note that this bounds the sum of qualities (the numerator of OMQ), not the OMQ score itself.
+        :return: upper bound on the total pairwise quality lost by approximate assignment
+        """
+        return self._partial.total('assignment_gap')
+
+    def get_pair_counts(self):
+        """
+        Get the total number of ground-truth & object proposal pairs across all maps analysed at the current time, &
+        how many of those pairs skipped calculating their spatial quality (3D IoU). Pairs are skipped when their label
+        quality (or state quality in SCD) is zero, as their overall quality is then zero however their cuboids overlap.
+        :return: tuple containing (pairs, skipped_pairs)
+        """
+        return self._partial.total('pairs'), self._partial.total('skipped_pairs')
+
+    def get_plans(self):
+        """
+        Get the plan chosen for each map analysed at the current time, with the cost model's estimates of its work &
+        memory (only kept when planning automatically, or limiting the bytes or seconds of maps)
+        :return: list of plan dictionaries, one for each map in the order evaluated (see _plan_map())
+        """
+        return [dict(p) for p in self._plans]
+
+    def get_verification(self):
+        """
+        Get the largest absolute differences found between the selected fast paths & the reference implementation, over
+        every map verified by this evaluator (see the verify options). Unlike the evaluation measures, these are kept
+        for the lifetime of the evaluator rather than cleared by reset().
+        :return: dictionary with the number of maps verified, & the maximum absolute differences for each quality matrix
+        & each score.
+        Format {'maps': <num_verified_maps>, 'tables': {'overall': <diff>, 'spatial': <diff>, 'label': <diff>,
+        'state': <diff>}, 'scores': {'OMQ': <diff>, 'avg_pairwise': <diff>, ..., 'FN': <diff>}} (only including the
+        quality matrices & scores of the calculated components)
+        """
+        return {
+            'maps': self._verification['maps'],
+            'tables': dict(self._verification['tables']),
+            'scores': dict(self._verification['scores'])
+        }
+
+    def get_per_class_scores(self):
+        """
+        Get the OMQ score and average qualities broken down by class for all maps analysed at the current time.
+        "True positives" and false negatives are attributed to the class of the ground-truth object, and false
+        positives to the maximum (non-background) class of the object proposal.
+        Averages follow the same definitions as their overall counterparts (e.g. get_avg_spatial_score())
+        :return: dictionary of c length numpy arrays, one entry per class id.
+        Format {'OMQ': <omq>, 'avg_pairwise': <avg_overall_quality>, 'avg_label': <avg_label_quality>,
+        'avg_spatial': <avg_spatial_quality>, 'avg_fp_quality': <avg_fp_quality>,
+        'avg_state_quality': <avg_state_quality>, 'TP': <num_true_positives>, 'FP': <num_false_positives>,
+        'FN': <num_false_negatives>}
+        """
+        self._check_component('per_class')
+        return calc_scores(
+            {k: self._partial.class_totals(k) for k in TOTAL_KEYS})
+
+    def get_per_region_scores(self):
+        """
+        Get the OMQ score and average qualities broken down by region (see regions) for all maps analysed at the current
+        time. Every map is assigned as a whole, & each "true positive" and false negative is attributed to every region
+        containing its ground-truth object's centroid, and each false positive to every region containing its object
+        proposal's centroid. Averages follow the same definitions as their overall counterparts (e.g.
+        get_avg_spatial_score()).
+        :return: dictionary of r length numpy arrays, one entry per region (including every region of partial results
+        added with add_partial()).
+        Format {'region': <region names>, 'OMQ': <omq>, 'avg_pairwise': <avg_overall_quality>, ...,
+        'FN': <num_false_negatives>}, with the same scores as get_per_class_scores()
+        """
+        self._check_component('per_region')
+        return {
+            'region':
+                np.array(self._partial.region_names, dtype=np.str_),
+            **calc_scores({
+                k: self._partial.region_totals(k) for k in TOTAL_KEYS
+            })
+        }
+
+    def sweep_thresholds(self, gt_objects, proposed_objects, thresholds):
+        """
+        Calculates the OMQ score and its components for a single map at a series of confidence thresholds, where only
+        object proposals with a confidence (maximum non-background label probability) at or above the threshold are
+        evaluated. Qualities are calculated once, and proposals are added to an incremental assignment in order of
+        descending confidence, so the whole sweep costs only a small multiple of a single evaluation.
+        Each threshold's assignment is optimal, giving the same scores as the 'sparse' assignment backend (which can only
+        differ from the default backend when there are ties between assignments).
+        Note that this does not change any internally stored evaluation measures.
+        :param gt_objects: list of ground-truth dictionaries present in the given map.
+        :param proposed_objects: list of detection dictionaries objects provided for the given map
+        :param thresholds: list of confidence thresholds
+        :return: dictionary of numpy arrays with a value for each threshold (in the order given).
+        Format {'threshold': <thresholds>, 'OMQ': <omq>, 'avg_pairwise': <avg_overall_quality>,
+        'avg_label': <avg_label_quality>, 'avg_spatial': <avg_spatial_quality>, 'avg_fp_quality': <avg_fp_quality>,
+        'avg_state_quality': <avg_state_quality>, 'TP': <num_true_positives>, 'FP': <num_false_positives>,
+        'FN': <num_false_negatives>}
+        """
+        return {
+            'threshold':
+                np.array(thresholds, dtype=np.float64),
+            **calc_scores(
+                _sweep_qual_map(gt_objects, proposed_objects, thresholds,
+                                self.scd_mode))
+        }
+
+    def get_partial(self):
+        """
+        Get a copy of all evaluation measures stored at the current time, as a serialisable partial result.
+        Partial results from evaluations of different maps (e.g. on different machines) can be merged with
+        OMQPartial.merge() & added to an OMQ evaluator with add_partial(), giving the same scores as evaluating
+        all maps with a single evaluator.
+        :return: OMQPartial holding the current evaluation measures
+        """
+        return OMQPartial().merge(self._partial)
+
+    def add_partial(self, partial):
+        """
+        Adds a partial result (from get_partial() of another evaluator) to the current evaluation analysis.
+        :param partial: OMQPartial to be merged into the current evaluation measures
+        :return: None
+        """
+        self._partial = self._partial.merge(partial)
+
+    def _add_map_results(self, results, state_key=None):
+        """
+        Adds the results dictionary produced for a single map to the running totals
+        :param results: results dictionary as returned by _calc_qual_map()
+        :param state_key: key the map's state is written with (see _map_state_key(); None to not write its state)
+        :return: None
+        """
+        if 'verification' in results:
+            self._add_verification(results['verification'])
+        if self.report is not None:
+            self.report.write_map(results['report'])
+        if self.candidates is not None:
+            self.candidates.write_map(results['candidates'])
+        if state_key is not None and results.get('state') is not None:
+            self.states.put(state_key, results['state'])
+        self._partial.add_map_results(results)
+
+    def has_component(self, component):
+        """
+        Check whether a score component is calculated by this evaluator (see components)
+        :param component: name of the score component
+        :return: True if the component is calculated
+        """
+        return _has_component(self._map_components(), component)
+
+    def _check_component(self, component):
+        """
+        Ensure a score component was calculated, as otherwise its totals are never accumulated
+        :param component: name of the score component
+        :return: None
+        """
+        if not self.has_component(component):
+            raise ValueError(
+                "Score component '%s' was not calculated (components: %s)" %
+                (component, "default" if self.components is None else
+                 ", ".join(self.components)))
+
+    def _add_verification(self, verification):
+        """
+        Adds the differences found verifying a single map, failing if any exceed the tolerance
+        :param verification: dictionary of differences as returned by _verify_map()
+        :return: None
+        """
+        self._verification['maps'] += 1
+        failures = []
+        for group in ['tables', 'scores']:
+            for k, diff in verification[group].items():
+                self._verification[group][k] = max(
+                    self._verification[group][k], diff)
+                if diff > self.verify['tolerance']:
+                    failures.append("%s '%s' (%g)" % (group[:-1], k, diff))
+        if failures:
+            raise ValueError(
+                "Map %d differs from the reference implementation by more "
+                "than the tolerance of %g in: %s" %
+                (self._partial.num_maps, self.verify['tolerance'],
+                 ", ".join(failures)))
+
+    def _sample_verified(self, num_maps):
+        """
+        Randomly choose which of the next maps are verified against the reference implementation
+        :param num_maps: number of maps about to be evaluated
+        :return: list of flags, one for each map
+        """
+        if self.verify['fraction'] is None:
+            return [False] * num_maps
+        return (self._verify_rng.random(num_maps) <
+                self.verify['fraction']).tolist()
+
     def _get_map_evals(self, parameters):
         """
         Evaluate the results for a given image
         :param parameters: tuple containing list of ground-truth dicts and object proposal dicts
-        :return: results dictionary containing total overall quality, total spatial quality on positively assigned
+        :return: (results, state_key), the key the map's state is stored with (see _map_state_keys()), & the results
+        dictionary containing total overall quality, total spatial quality on positively assigned
         object proposals, total label quality on positively assigned object proposals,
         total false positive cost for each false positive object proposal, number of true positives,
         number of false positives, number false negatives, and total state quality (relevant only in SCD).
@@ -183,8 +584,987 @@ class OMQ(object):
         'FN': <num_false_positives>, 'state_change': <tot_state_quality>}
         """
         gt_objects, proposed_objects = parameters
-        results = _calc_qual_map(gt_objects, proposed_objects, self.scd_mode)
-        return results
+        plans = self._plan_maps([parameters])
+        keys = self._map_state_keys([parameters], plans)
+        results = _calc_qual_maps([(gt_objects, proposed_objects)],
+                                  self._map_options(),
+                                  verify=self._sample_verified(1),
+                                  previous_states=self._previous_states(keys),
+                                  plans=plans)[0]
+        return results, keys[0]
+
+    def _map_options(self):
+        """
+        Get the options used when evaluating each map
+        :return: dictionary of map options (see _map_options())
+        """
+        return _map_options(
+            scd_mode=self.scd_mode,
+            batched=self.batched,
+            components=self._map_components(),
+            regions=self.regions,
+            assignment=self.assignment['backend'],
+            time_budget=self.assignment['time_budget'],
+            max_tile_bytes=self.tiling['max_bytes'],
+            tile_workers=self.tiling['workers'],
+            report=self.report is not None,
+            attribution=self.report is not None and self.report.attribution,
+            candidates=None if self.candidates is None else self.candidates.k,
+            state=self.states is not None and self.states.writing)
+
+    def _map_components(self):
+        """
+        Get the score components calculated for each map. Reports & map states need every quality, so override the
+        selection (keeping the per-class breakdown only if it was requested).
+        :return: list of score components (None for the default selection, see _has_component())
+        """
+        if (self.report is not None or self.candidates is not None or
+                self.states is not None):
+            return ([c for c in _COMPONENTS if c not in _OPT_IN_COMPONENTS] +
+                    [c for c in _OPT_IN_COMPONENTS
+                     if _has_component(self.components, c)])
+        return self.components
+
+    def _add_chunked_map_evals(self, param_lists, executor):
+        """
+        Evaluates maps in chunks with an executor, adding the results for every map to the running totals in order.
+        :param param_lists: list of (ground-truth dicts, detection dicts) tuples, one for each map
+        :param executor: concurrent.futures.Executor used to evaluate each chunk (None to evaluate them in order in the
+        current process)
+        :return: None
+        """
+        chunks = _chunk_maps(param_lists, _CHUNK_MIN_PAIRS)
+        plans = self._plan_maps(param_lists)
+        keys = self._map_state_keys(param_lists, plans)
+        verify = iter(self._sample_verified(len(param_lists)))
+        previous = iter(self._previous_states(keys))
+        plans = iter(plans)
+        map_options = self._map_options()
+        options = [
+            dict(options=map_options,
+                 verify=[next(verify) for _ in c],
+                 previous_states=[next(previous) for _ in c],
+                 plans=[next(plans) for _ in c]) for c in chunks
+        ]
+        keys = iter(keys)
+        for chunk_results in (map if executor is None else executor.map)(
+                _get_chunk_evals, chunks, options):
+            for results in chunk_results:
+                self._add_map_results(results, next(keys))
+
+    def _map_state_keys(self, param_lists, plans):
+        """
+        Get the keys the states of maps are stored with
+        :param param_lists: list of (ground-truth dicts, detection dicts) tuples, one for each map
+        :param plans: list of the plan for each map (see _plan_maps())
+        :return: list of keys, one for each map (all None if map states aren't used)
+        """
+        if self.states is None:
+            return [None] * len(param_lists)
+        return [
+            _map_state_key(
+                gts, self.scd_mode, self.batched,
+                self.assignment['backend'] if p is None else p['assignment'])
+            for (gts, _), p in zip(param_lists, plans)
+        ]
+
+    def _plan_maps(self, param_lists):
+        """
+        Plan how each map is evaluated with the cost model (see _plan_map()), raising a ValueError before any map is
+        evaluated if one would exceed the configured limits. Plans are kept so they can be reported (see get_plans()).
+        :param param_lists: list of (ground-truth dicts, detection dicts) tuples, one for each map
+        :return: list of plans, one for each map (all None if maps are neither planned automatically nor limited)
+        """
+        auto = self.plan['auto']
+        if (not auto and self.plan['max_map_bytes'] is None and
+                self.plan['max_map_seconds'] is None):
+            return [None] * len(param_lists)
+        plans = []
+        for i, (gts, props) in enumerate(param_lists):
+            plans.append(
+                _plan_map(gts,
+                          props,
+                          self.scd_mode,
+                          batched=self.batched,
+                          tables=_component_tables(self._map_components()),
+                          assignment=None
+                          if auto else self.assignment['backend'],
+                          max_tile_bytes=self.tiling['max_bytes'],
+                          tile_workers=self.tiling['workers'],
+                          max_bytes=self.plan['max_map_bytes']
+                          if auto else None,
+                          seconds=self.plan['seconds']))
+            for k, limit in [('bytes', self.plan['max_map_bytes']),
+                             ('seconds', self.plan['max_map_seconds'])]:
+                if limit is not None and plans[-1][k] > limit:
+                    raise ValueError(
+                        "Map %d (%d ground-truth objects & %d object "
+                        "proposals) is estimated to need %g %s, more than the "
+                        "limit of %g" % (self._partial.num_maps + i, len(gts),
+                                         len(props), plans[-1][k], k, limit))
+        self._plans.extend(plans)
+        return plans
+
+    def _previous_states(self, keys):
+        """
+        Get the previous states of maps
+        :param keys: list of map keys (see _map_state_keys())
+        :return: list of state dictionaries, one for each map (None for maps without a previous state)
+        """
+        return [None if k is None else self.states.get(k) for k in keys]
+
+
+class OMQPartial(object):
+    """
+    Mergeable, serialisable totals of a partially completed OMQ evaluation.
+    Totals of qualities & costs are kept as exact (non-overlapping) partial sums, so merging is exactly associative &
+    commutative: any grouping of maps gives the exact same final scores. Per-class & per-region totals use compensated
+    summation, with regions identified by name.
+    """
+
+    _SUM_KEYS = [
+        'overall', 'spatial', 'label', 'fp_cost', 'state_change',
+        'assignment_gap'
+    ]
+    _COUNT_KEYS = ['TP', 'FP', 'FN', 'pairs', 'skipped_pairs']
+
+    def __init__(self):
+        """
+        Initialisation function for an empty partial result
+        """
+        super(OMQPartial, self).__init__()
+        self.num_maps = 0
+        self._sums = {k: [] for k in OMQPartial._SUM_KEYS}
+        self._counts = {k: 0 for k in OMQPartial._COUNT_KEYS}
+        self._class_sums = {}
+        self._class_comps = {}
+        self.region_names = []
+        self._region_sums = {}
+        self._region_comps = {}
+
+    def total(self, key):
+        """
+        Get the total for an evaluation measure
+        :param key: name of the measure (one of the keys in the _calc_qual_map() results dictionary)
+        :return: total as a float (exactly rounded sum), or integer for counts
+        """
+        if key in self._counts:
+            return self._counts[key]
+        return math.fsum(self._sums[key])
+
+    def class_totals(self, key):
+        """
+        Get the per-class totals for an evaluation measure
+        :param key: name of the measure (one of the keys in the _calc_qual_map() results dictionary)
+        :return: c length numpy array of totals for each class id (the same length for every measure)
+        """
+        totals = _pad_to(
+            self._class_sums.get(
+                key,
+                np.zeros(0,
+                         dtype=np.int64
+                         if key in OMQPartial._COUNT_KEYS else np.float64)),
+            max([len(v) for v in self._class_sums.values()], default=0))
+        if key in self._class_comps:
+            return totals + _pad_to(self._class_comps[key], len(totals))
+        return totals
+
+    def region_totals(self, key):
+        """
+        Get the per-region totals for an evaluation measure
+        :param key: name of the measure (one of the keys in the _calc_qual_map() results dictionary)
+        :return: r length numpy array of totals for each region, in the order of region_names
+        """
+        totals = _pad_to(
+            self._region_sums.get(
+                key,
+                np.zeros(0,
+                         dtype=np.int64
+                         if key in OMQPartial._COUNT_KEYS else np.float64)),
+            len(self.region_names))
+        if key in self._region_comps:
+            return totals + _pad_to(self._region_comps[key], len(totals))
+        return totals
+
+    def add_map_results(self, results):
+        """
+        Adds the results dictionary produced for a single map to the partial result
+        :param results: results dictionary as returned by _calc_qual_map()
+        :return: None
+        """
+        self.num_maps += 1
+        for k in OMQPartial._SUM_KEYS:
+            _exact_add(self._sums[k], results[k])
+        for k in OMQPartial._COUNT_KEYS:
+            self._counts[k] += int(results[k])
+        for k, v in results['per_class'].items():
+            self._add_class_totals(k, v, None)
+        for k, v in results.get('per_region', {}).items():
+            self._add_region_totals(results['regions'], k, v, None)
+
+    def merge(self, other):
+        """
+        Merge two partial results (neither of the originals are modified)
+        :param other: OMQPartial to be merged with this one
+        :return: new OMQPartial containing the totals of both
+        """
+        merged = OMQPartial()
+        for p in [self, other]:
+            merged.num_maps += p.num_maps
+            for k in OMQPartial._SUM_KEYS:
+                for x in p._sums[k]:
+                    _exact_add(merged._sums[k], x)
+            for k in OMQPartial._COUNT_KEYS:
+                merged._counts[k] += p._counts[k]
+            for k, v in p._class_sums.items():
+                merged._add_class_totals(k, v, p._class_comps.get(k))
+            for k, v in p._region_sums.items():
+                merged._add_region_totals(p.region_names, k, v,
+                                          p._region_comps.get(k))
+        return merged
+
+    def to_dict(self):
+        """
+        Get the partial result as a JSON serialisable dictionary (floats are stored exactly)
+        :return: dictionary that can be turned back into an OMQPartial with from_dict()
+        """
+        return {
+            'num_maps': self.num_maps,
+            'sums': {k: list(v) for k, v in self._sums.items()},
+            'counts': dict(self._counts),
+            'class_sums': {k: v.tolist() for k, v in self._class_sums.items()},
+            'class_comps': {k: v.tolist() for k, v in self._class_comps.items()},
+            'region_names': list(self.region_names),
+            'region_sums': {k: v.tolist() for k, v in self._region_sums.items()},
+            'region_comps': {
+                k: v.tolist() for k, v in self._region_comps.items()
+            }
+        }
+
+    @staticmethod
+    def from_dict(partial_dict):
+        """
+        Create a partial result from a dictionary produced by to_dict()
+        :param partial_dict: dictionary as produced by to_dict()
+        :return: OMQPartial holding the stored totals
+        """
+        p = OMQPartial()
+        p.num_maps = partial_dict['num_maps']
+        p._sums = {k: list(v) for k, v in partial_dict['sums'].items()}
+        p._counts.update(partial_dict['counts'])
+        p._class_sums = {
+            k: np.array(v, dtype=np.int64 if k in OMQPartial._COUNT_KEYS else
+                        np.float64)
+            for k, v in partial_dict['class_sums'].items()
+        }
+        p._class_comps = {
+            k: np.array(v, dtype=np.float64)
+            for k, v in partial_dict['class_comps'].items()
+        }
+        p.region_names = list(partial_dict.get('region_names', []))
+        p._region_sums = {
+            k: np.array(v, dtype=np.int64 if k in OMQPartial._COUNT_KEYS else
+                        np.float64)
+            for k, v in partial_dict.get('region_sums', {}).items()
+        }
+        p._region_comps = {
+            k: np.array(v, dtype=np.float64)
+            for k, v in partial_dict.get('region_comps', {}).items()
+        }
+        return p
+
+    def _add_class_totals(self, key, values, comps):
+        # Per-class totals grow to fit the largest class id seen so far
+        _add_compensated(self._class_sums, self._class_comps, key, values,
+                         comps)
+
+    def _add_region_totals(self, names, key, values, comps):
+        # Regions are added to the end of region_names as they are first seen,
+        # & totals are scattered into the order of region_names
+        for n in names:
+            if n not in self.region_names:
+                self.region_names.append(n)
+        idxs = np.array([self.region_names.index(n) for n in names],
+                        dtype=np.int64)
+        scattered = []
+        for v in [values, comps]:
+            if v is not None:
+                scattered.append(
+                    np.zeros(len(self.region_names), dtype=np.asarray(v).dtype))
+                scattered[-1][idxs] = v
+            else:
+                scattered.append(None)
+        _add_compensated(self._region_sums, self._region_comps, key,
+                         *scattered)
+
+
+class ObjectArrays(Sequence):
+    """
+    Object proposals for a map held as arrays, with a row in each array for every object proposal, rather than as a
+    list of dicts. It can be given anywhere a list of object proposal dicts is accepted (indexing it gives the dict of
+    an object proposal), but scoring reads straight from the arrays (see object_array()) without building the dicts.
+    """
+
+    def __init__(self,
+                 centroids,
+                 extents,
+                 label_probs,
+                 state_probs=None,
+                 scenes=None):
+        """
+        Initialisation function for object proposals held as arrays
+        :param centroids: p x 3 numpy array of the centroid of each object proposal
+        :param extents: p x 3 numpy array of the extent of each object proposal
+        :param label_probs: p x c numpy array of the label probability distribution of each object proposal (with the
+        background class last), or a p x c scipy sparse matrix of only the non-zero probabilities of each class id
+        (without the background class, like the dicts of sparse distributions)
+        :param state_probs: p x 3 numpy array of the state probability distribution of each object proposal (None if
+        not evaluated for scene change detection)
+        :param scenes: p x 2 numpy array of the pair of scenes each object proposal is a change between (None if not
+        given)
+        """
+        super(ObjectArrays, self).__init__()
+        self.centroids = centroids
+        self.extents = extents
+        self.label_probs = (sparse.csr_matrix(label_probs)
+                            if sparse.issparse(label_probs) else label_probs)
+        self.state_probs = state_probs
+        self.scenes = (None if scenes is None else np.asarray(scenes).astype(
+            np.int64))
+
+    def __len__(self):
+        return len(self.centroids)
+
+    def __getitem__(self, idx):
+        if not isinstance(idx, (int, np.integer)):
+            # Slices & index arrays select a subset of the object proposals
+            return ObjectArrays(
+                *[None if a is None else a[idx] for a in self._arrays()])
+        if not -len(self) <= idx < len(self):
+            raise IndexError("Object proposal index %d is out of range" % idx)
+        idx = int(idx) % len(self)
+        if sparse.issparse(self.label_probs):
+            start, end = self.label_probs.indptr[idx:idx + 2]
+            label_probs = dict(
+                zip(self.label_probs.indices[start:end].tolist(),
+                    self.label_probs.data[start:end].tolist()))
+        else:
+            label_probs = self.label_probs[idx]
+        o = {
+            'label_probs': label_probs,
+            'centroid': self.centroids[idx],
+            'extent': self.extents[idx]
+        }
+        if self.state_probs is not None:
+            o['state_probs'] = self.state_probs[idx]
+        if self.scenes is not None:
+            o['scenes'] = self.scenes[idx].tolist()
+        return o
+
+    def _arrays(self):
+        # Arrays in the order of the initialisation function's arguments
+        return [
+            self.centroids, self.extents, self.label_probs, self.state_probs,
+            self.scenes
+        ]
+
+
+def object_array(objects, key, idxs=None):
+    """
+    Stack a field of a list of object dicts into an array (read straight from the arrays of ObjectArrays)
+    :param objects: list of object dicts, or ObjectArrays
+    :param key: field of the objects ('centroid', 'extent', or 'state_probs')
+    :param idxs: indices of the objects stacked (None for all of them)
+    :return: n x 3 numpy array of the field of each object, in the order of idxs
+    """
+    if isinstance(objects, ObjectArrays):
+        a = getattr(objects, _OBJECT_ARRAYS[key])
+        return a if idxs is None else a[idxs]
+    return np.array([
+        objects[i][key]
+        for i in (range(len(objects)) if idxs is None else idxs)
+    ],
+                    dtype=np.float64).reshape(-1, 3)
+
+
+def select_objects(objects, idxs):
+    """
+    Select a subset of a list of object dicts (keeping ObjectArrays as arrays)
+    :param objects: list of object dicts, or ObjectArrays
+    :param idxs: indices of the objects selected
+    :return: list of the selected object dicts, or ObjectArrays of the selected objects
+    """
+    if isinstance(objects, ObjectArrays):
+        return objects[np.asarray(idxs, dtype=np.int64)]
+    return [objects[i] for i in idxs]
+
+
+def _concat_objects(object_lists):
+    # Concatenates lists of object dicts, keeping the arrays of ObjectArrays
+    # when every list is one with the same kind of label distributions
+    if (len(object_lists) > 0 and
+            all(isinstance(o, ObjectArrays) for o in object_lists) and
+            len(
+                set((sparse.issparse(o.label_probs), o.label_probs.shape[1],
+                     o.state_probs is None, o.scenes is None)
+                    for o in object_lists)) == 1):
+        return ObjectArrays(*[
+            None if arrays[0] is None else sparse.vstack(arrays, format='csr')
+            if sparse.issparse(arrays[0]) else np.concatenate(arrays)
+            for arrays in zip(*[o._arrays() for o in object_lists])
+        ])
+    return [o for objects in object_lists for o in objects]
+
+
+def calc_scores(totals):
+    """
+    Calculates the OMQ score and average qualities from totals of the evaluation measures, following the same
+    definitions as the OMQ getters (e.g. get_current_score(), get_avg_spatial_score())
+    :param totals: dictionary of equal length numpy arrays of totals, one entry for each of TOTAL_KEYS
+    :return: dictionary of numpy arrays, in the same format as OMQ.get_per_class_scores()
+    """
+    t = totals
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = t['TP'] + t['fp_cost'] + t['FN']
+        tps = t['TP'].astype(np.float64)
+        return {
+            'OMQ':
+                np.where(denominator > 0, t['overall'] / denominator, 0.0),
+            'avg_pairwise':
+                np.where(tps > 0, t['overall'] / tps, 0.0),
+            'avg_label':
+                np.where(tps > 0, t['label'] / tps, 0.0),
+            'avg_spatial':
+                np.where(tps > 0, t['spatial'] / tps, 0.0),
+            'avg_fp_quality':
+                np.where(t['FP'] > 0, (t['FP'] - t['fp_cost']) / t['FP'],
+                         1.0),
+            'avg_state_quality':
+                np.where(tps > 0, t['state_change'] / tps, 0.0),
+            'TP':
+                t['TP'],
+            'FP':
+                t['FP'],
+            'FN':
+                t['FN']
+        }
+
+
+def _add_compensated(sums, all_comps, key, values, comps):
+    """
+    Add an array of values to the running totals of a measure, growing the totals to fit if needed. Counts are added
+    exactly, & qualities with compensated summation, keeping the rounding error of each addition (Knuth's TwoSum) in a
+    separate compensation array.
+    :param sums: dictionary of arrays of running totals, keyed by measure
+    :param all_comps: dictionary of arrays of compensations for the running totals, keyed by measure
+    :param key: name of the measure (one of the keys in the _calc_qual_map() results dictionary)
+    :param values: numpy array of values to add
+    :param comps: numpy array of compensations for the values (None if they are exact)
+    :return: None
+    """
+    is_count = key in OMQPartial._COUNT_KEYS
+    n = max(len(values), len(sums.get(key, [])))
+    current = _pad_to(
+        sums.get(key, np.zeros(0,
+                               dtype=np.int64 if is_count else np.float64)), n)
+    values = _pad_to(values, n)
+    if is_count:
+        sums[key] = current + values
+        return
+
+    total = current + values
+    b = total - current
+    err = (current - (total - b)) + (values - b)
+    sums[key] = total
+    all_comps[key] = (_pad_to(all_comps.get(key, np.zeros(0)), n) + err +
+                      (0 if comps is None else _pad_to(comps, n)))
+
+
+def _pad_to(values, length):
+    return np.pad(values, (0, length - len(values)))
+
+
+def _exact_add(partials, x):
+    """
+    Adds a value to a list of non-overlapping partial sums, such that the sum of the list remains the exact sum of all
+    values added (Shewchuk's algorithm, as used by math.fsum).
+    :param partials: list of non-overlapping partial sums which is modified in place
+    :param x: value to be added
+    :return: None
+    """
+    x = float(x)
+    i = 0
+    for y in partials:
+        if abs(x) < abs(y):
+            x, y = y, x
+        hi = x + y
+        lo = y - (hi - x)
+        if lo:
+            partials[i] = lo
+            i += 1
+        x = hi
+    partials[i:] = [x]
+
+
+def _map_options(**options):
+    """
+    Resolve the options every map is evaluated with, which are passed through the evaluation of each map as a single
+    dictionary (see OMQ._map_options())
+    :param options: any of the options in _MAP_OPTION_DEFAULTS, with every other option left at its default
+    :return: dictionary of every map option
+    """
+    return resolve_options('map', options, _MAP_OPTION_DEFAULTS)
+
+
+def _get_chunk_evals(chunk, options):
+    """
+    Evaluate the results for a chunk of maps (module level so it can be sent to worker processes)
+    :param chunk: list of (ground-truth dicts, detection dicts) tuples
+    :param options: dictionary of keyword arguments for _calc_qual_maps()
+    :return: list of results dictionaries, one for each map in the chunk (see _calc_qual_map())
+    """
+    return _calc_qual_maps(chunk, **options)
+
+
+def _calc_qual_maps(param_lists,
+                    options,
+                    verify=None,
+                    previous_states=None,
+                    plans=None):
+    """
+    Calculates the results for a list of maps, with their cost tables generated together (see _gen_maps_cost_tables()).
+    Maps with a plan use its assignment backend & tiling instead of those in the options (see _plan_map()).
+    :param param_lists: list of (ground-truth dicts, detection dicts) tuples, one for each map
+    :param options: dictionary of the options every map is evaluated with (see _map_options())
+    :param verify: list of flags for which maps are also evaluated with the reference implementation, adding the
+    differences found to their results as 'verification' (see _verify_map(); None to verify no maps)
+    :param previous_states: list of the previous state of each map (see _calc_map_state()), or None for maps without
+    a previous state (None if no maps have a previous state)
+    :param plans: list of the plan for each map (see _plan_map()), or None for maps evaluated as configured (None if
+    no maps have a plan)
+    :return: list of results dictionaries, one for each map (see _calc_qual_map())
+    """
+    verify = verify or [False] * len(param_lists)
+    map_options = [
+        options if p is None else dict(options,
+                                       assignment=p['assignment'],
+                                       max_tile_bytes=p['tile_bytes'],
+                                       tile_workers=p['workers'])
+        for p in plans or [None] * len(param_lists)
+    ]
+
+    # Maps with a previous state only need qualities for their new proposals
+    deltas = [
+        None if s is None or len(gts) == 0 or len(props) == 0 else
+        _diff_map_state(props, s)
+        for (gts, props), s in zip(param_lists, previous_states or
+                                   [None] * len(param_lists))
+    ]
+    all_cost_tables = _gen_maps_cost_tables(param_lists, options, map_options,
+                                            deltas, verify)
+
+    results = []
+    for (gts, props), o, cts, d, v in zip(param_lists, map_options,
+                                          all_cost_tables, deltas, verify):
+        results.append(_calc_qual_map(gts, props, o, cost_tables=cts,
+                                      delta=d))
+        if v:
+            results[-1]['verification'] = _verify_map(gts, props, o,
+                                                      results[-1], cts)
+    return results
+
+
+def _gen_maps_cost_tables(param_lists, options, map_options, deltas, verify):
+    """
+    Generate the cost tables for a list of maps, either one map at a time, or with the qualities of all maps calculated
+    together in a single batch. Maps too large to calculate qualities for within the memory bound are instead
+    calculated tile by tile (see _gen_cost_tables_tiled()). Maps with a previous state only calculate qualities for
+    their changed object proposals (see _merge_map_state()). Maps assigned with the 'sparse' backend get sparse tables
+    instead of cost tables (see _sparse_tables()).
+    :param param_lists: list of (ground-truth dicts, detection dicts) tuples, one for each map
+    :param options: dictionary of the options every map is evaluated with (see _map_options())
+    :param map_options: list of the options each map is evaluated with, including its plan
+    :param deltas: list of the differences of each map from its previous state (see _diff_map_state()), or None for
+    maps without a previous state
+    :param verify: list of flags for which maps are also evaluated with the reference implementation (which always
+    needs the cost tables of the fast paths)
+    :return: list of cost tables (or sparse tables) for each map (see _gen_cost_tables()), or None for maps whose cost
+    tables are left to _calc_qual_map()
+    """
+    scd_mode, batched = options['scd_mode'], options['batched']
+    tables = _component_tables(options['components'])
+    gen_lists = [(gts, props if d is None else select_objects(
+        props, np.flatnonzero(d['new_props'])))
+                 for (gts, props), d in zip(param_lists, deltas)]
+    tiled = [
+        o['max_tile_bytes'] is not None and
+        len(gts) * len(props) * _TILE_BYTES_PER_PAIR > o['max_tile_bytes']
+        for (gts, props), o in zip(gen_lists, map_options)
+    ]
+    sparse_maps = [o['assignment'] == 'sparse' for o in map_options]
+    if batched:
+        batch_tables = iter(
+            _gen_cost_tables_batched(
+                [m for m, t in zip(gen_lists, tiled) if not t], scd_mode,
+                tables, [s for s, t in zip(sparse_maps, tiled) if not t]))
+
+    all_cost_tables = []
+    for (gts, props), (_, gen_props), t, o, d, v, sp in zip(
+            param_lists, gen_lists, tiled, map_options, deltas, verify,
+            sparse_maps):
+        if t:
+            cts = _gen_cost_tables_tiled(gts,
+                                         gen_props,
+                                         scd_mode,
+                                         o['max_tile_bytes'],
+                                         workers=o['tile_workers'],
+                                         aligned=batched,
+                                         tables=tables,
+                                         sparse_tables=sp)
+        else:
+            cts = next(batch_tables) if batched else None
+        if d is not None:
+            if cts is None and len(gen_props) > 0:
+                cts = _gen_map_tables(gts, gen_props, o, tables=tables)
+            cts = _merge_map_state(gts, props, scd_mode, d, cts, tables, sp)
+        if v and cts is None and len(gts) > 0 and len(props) > 0:
+            cts = _gen_map_tables(gts, props, o, tables=tables)
+        all_cost_tables.append(cts)
+    return all_cost_tables
+
+
+def _verify_map(gt_objects, object_proposals, options, results, cost_tables):
+    """
+    Compares the results of a map from the selected fast paths with the reference implementation, which calculates
+    every pair's spatial quality with the per pair 3D IoU (see _calc_spatial_qual()) & assigns objects with the
+    Hungarian algorithm. Quality matrices are compared as they are used for scoring (i.e. with spatial, label, & state
+    qualities of pairs with zero overall quality treated as zero).
+    :param gt_objects: list of ground-truth dicts for the map
+    :param object_proposals: list of object proposal dicts for the map
+    :param options: dictionary of the options the map was evaluated with by the fast paths (see _map_options()), where
+    the score components calculated limit which quality matrices & scores are compared
+    :param results: results dictionary for the map from the fast paths (see _calc_qual_map())
+    :param cost_tables: cost tables for the map from the fast paths (None if the map has no pairs)
+    :return: dictionary of maximum absolute differences between the fast paths & the reference implementation, for each
+    quality matrix & score.
+    Format {'tables': {'overall': <diff>, 'spatial': <diff>, 'label': <diff>, 'state': <diff>},
+    'scores': {'OMQ': <diff>, 'avg_pairwise': <diff>, ..., 'FN': <diff>}}
+    """
+    scd_mode, components = options['scd_mode'], options['components']
+    tables = {k: 0.0 for k in _component_tables(components)}
+    reference_tables = None
+    if cost_tables is not None:
+        reference_tables = _gen_cost_tables(gt_objects,
+                                            object_proposals,
+                                            scd_mode,
+                                            gated=False)
+        g, p = len(gt_objects), len(object_proposals)
+        qualities = []
+        for cts in [cost_tables, reference_tables]:
+            qts = _calc_quality_tables(cts)
+            qualities.append({
+                k: _dense_qualities(qts[_QUALITY_TABLE_NAMES[k]], g,
+                                    p).astype(np.float64) for k in tables
+            })
+        tables = {
+            k: float(np.max(np.abs(qualities[0][k] - qualities[1][k])))
+            for k in tables
+        }
+
+    scores = [
+        calc_scores({k: np.array(r[k]) for k in TOTAL_KEYS})
+        for r in [
+            results,
+            _calc_qual_map(gt_objects,
+                           object_proposals,
+                           _map_options(scd_mode=scd_mode),
+                           cost_tables=reference_tables)
+        ]
+    ]
+    return {
+        'tables': tables,
+        'scores': {
+            k: float(np.abs(scores[0][k] - scores[1][k]))
+            for k in _VERIFY_SCORE_KEYS if _has_component(components, k)
+        }
+    }
+
+
+def _has_component(components, component):
+    """
+    Check whether a score component is calculated for a selection of score components
+    :param components: list of score components (see _COMPONENTS), or None for the default selection (every component
+    except those in _OPT_IN_COMPONENTS)
+    :param component: name of the score component
+    :return: True if the component is calculated
+    """
+    if component in _OPT_IN_COMPONENTS:
+        return components is not None and component in components
+    return (components is None or component in components or
+            component not in _COMPONENT_TABLES)
+
+
+def _component_tables(components):
+    """
+    Find the cost tables needed to calculate a selection of score components. The overall cost table is always needed,
+    as it is used for assignment.
+    :param components: list of score components (see _COMPONENTS), or None for the default selection
+    :return: list of the names of the cost tables needed (keys of the _gen_cost_tables() dictionary)
+    """
+    if components is None:
+        return list(_COST_TABLE_KEYS)
+    return [
+        k for k in _COST_TABLE_KEYS if k == 'overall' or
+        any(k in _COMPONENT_TABLES.get(c, []) for c in components)
+    ]
+
+
+def _chunk_maps(param_lists, min_pairs):
+    """
+    Group consecutive maps into chunks with roughly at least a minimum amount of work each.
+    :param param_lists: list of (ground-truth dicts, detection dicts) tuples, one for each map
+    :param min_pairs: number of ground-truth & object proposal pairs a chunk should have before it is closed
+    :return: list of chunks, each being a list of consecutive (ground-truth dicts, detection dicts) tuples
+    """
+    chunks = []
+    current = []
+    current_pairs = 0
+    for map_params in param_lists:
+        current.append(map_params)
+        current_pairs += max(1, len(map_params[0]) * len(map_params[1]))
+        if current_pairs >= min_pairs:
+            chunks.append(current)
+            current = []
+            current_pairs = 0
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _sample_pair_densities(gt_objects, object_proposals, scd_mode,
+                           num_samples):
+    """
+    Estimate how many of a map's pairs need their spatial quality calculated, & how many have a non-zero overall
+    quality, from a sample of its pairs (every pair if the map is small enough). Only the sampled object proposals'
+    label probabilities are gathered, & the sample is deterministic so plans are repeatable.
+    :param gt_objects: list of all ground-truth object dicts for a given map.
+    :param object_proposals: list of all object proposal dicts for a given map.
+    :param scd_mode: flag for whether the map is evaluated for scene change detection
+    :param num_samples: number of pairs sampled
+    :return: (mask_density, overlap_density). mask_density is the fraction of pairs with non-zero label (& state)
+    quality (see _calc_quality_mask()), & overlap_density the fraction of pairs that also have overlapping cuboids.
+    """
+    n_gts, n_props = len(gt_objects), len(object_proposals)
+    if n_gts * n_props <= num_samples:
+        gt_idxs, prop_idxs = [
+            a.ravel() for a in np.indices((n_gts, n_props))
+        ]
+    else:
+        rng = np.random.default_rng(0)
+        gt_idxs = rng.integers(n_gts, size=num_samples)
+        prop_idxs = rng.integers(n_props, size=num_samples)
+    sample_props, sample_idxs = np.unique(prop_idxs, return_inverse=True)
+    sample_props = select_objects(object_proposals, sample_props)
+
+    label_qual = _gather_label_probs(
+        sample_props, sample_idxs,
+        np.array([gt_objects[i]['class_id'] for i in gt_idxs],
+                 dtype=np.int64)).astype(np.float32)
+    state_qual = None
+    if scd_mode:
+        state_qual = object_array(sample_props, 'state_probs')[
+            sample_idxs,
+            [_STATE_IDS[gt_objects[g]['state']] for g in gt_idxs]].astype(
+                np.float32)
+    mask = _calc_quality_mask(label_qual, state_qual)
+
+    # Cuboids can only overlap if their axis-aligned bounds do
+    gt_centroids, gt_extents, prop_centroids, prop_extents = [
+        object_array(objs, k)
+        for objs, k in [(gt_objects, 'centroid'), (gt_objects, 'extent'),
+                        (sample_props, 'centroid'), (sample_props, 'extent')]
+    ]
+    overlap = np.all(
+        np.abs(gt_centroids[gt_idxs] - prop_centroids[sample_idxs]) <
+        (gt_extents[gt_idxs] + prop_extents[sample_idxs]) / 2,
+        axis=1)
+    return np.mean(mask), np.mean(mask & overlap)
+
+
+def _plan_map(gt_objects,
+              object_proposals,
+              scd_mode,
+              batched=False,
+              tables=None,
+              assignment=None,
+              max_tile_bytes=None,
+              tile_workers=None,
+              max_bytes=None,
+              seconds=None):
+    """
+    Plan how a map is evaluated with a simple cost model, estimating the seconds of work & bytes of memory it needs
+    from its size & a sample of its pairs (see _sample_pair_densities()). Work is estimated for the qualities of every
+    pair, the spatial qualities of the sampled fraction needing them, & the assignment. The dense (Hungarian) assignment
+    grows with the cube of the padded table, while the sparse assignment grows with the non-zero pairs it searches.
+    Memory is estimated for the cost tables, label probabilities, assignment, & the working memory of the qualities.
+    :param gt_objects: list of all ground-truth object dicts for a given map.
+    :param object_proposals: list of all object proposal dicts for a given map.
+    :param scd_mode: flag for whether the map is evaluated for scene change detection
+    :param batched: flag for whether spatial qualities are calculated with the vectorised 3D IoU of axis-aligned cuboids
+    :param tables: list of the cost tables generated (None for all of them, see _component_tables())
+    :param assignment: assignment backend used ('hungarian' or 'sparse'), or None to choose the one with the least
+    estimated work (also calculating unbatched tiles on a single thread, as per pair IoU holds the GIL)
+    :param max_tile_bytes: approximate maximum bytes of working memory used to calculate qualities (None for no limit)
+    :param tile_workers: number of threads calculating tiles (None for the thread pool default)
+    :param max_bytes: approximate maximum bytes of memory for the map, with qualities tiled if needed to stay within it
+    (None to tile only as max_tile_bytes requires)
+    :param seconds: dictionary of the seconds taken by each unit of work (None for COST_MODEL_SECONDS)
+    :return: plan dictionary, with the map's number of ground-truth objects ('gts') & object proposals ('props'), the
+    estimated fraction of pairs with non-zero quality ('density'), the chosen 'assignment' backend, whether qualities
+    are 'tiled' (with 'tile_bytes' the tile memory bound & 'workers' the threads used), & the estimated 'seconds' &
+    'bytes' needed
+    """
+    n_gts, n_props = len(gt_objects), len(object_proposals)
+    plan = {
+        'gts': n_gts,
+        'props': n_props,
+        'density': 0.0,
+        'assignment': 'hungarian' if assignment is None else assignment,
+        'tiled': False,
+        'tile_bytes': max_tile_bytes,
+        'workers': tile_workers,
+        'seconds': 0.0,
+        'bytes': 0
+    }
+    if n_gts == 0 or n_props == 0:
+        return plan
+    pairs, n = n_gts * n_props, max(n_gts, n_props)
+    mask_density, density = _sample_pair_densities(gt_objects,
+                                                   object_proposals, scd_mode,
+                                                   _PLAN_SAMPLE_PAIRS)
+    plan['density'] = float(density)
+    nnz = plan['density'] * pairs
+
+    # Work for qualities (spatial qualities only for pairs needing them), &
+    # for each assignment backend
+    unit = dict(COST_MODEL_SECONDS, **(seconds or {}))
+    quality_seconds = pairs * unit['pair'] + mask_density * pairs * (
+        unit['iou_aligned' if batched else 'iou'])
+    assignment_seconds = {
+        'hungarian':
+            n**3 * unit['hungarian'],
+        'sparse':
+            pairs * unit['sparse_scan'] + nnz * unit['sparse_pair'] *
+            math.sqrt(max(1, nnz / n_gts))
+    }
+    if assignment is None:
+        plan['assignment'] = min(assignment_seconds,
+                                 key=assignment_seconds.get)
+    plan['seconds'] = float(quality_seconds +
+                            assignment_seconds[plan['assignment']])
+
+    # Memory for cost tables (only the pairs with non-zero quality for sparse
+    # tables), label probabilities, & the assignment, plus the working memory
+    # of the qualities (bounded per tile when tiled)
+    num_tables = len(_component_tables(None) if tables is None else tables)
+    if isinstance(object_proposals, ObjectArrays):
+        label_probs = object_proposals.label_probs
+        label_bytes = (16 * label_probs.nnz
+                       if sparse.issparse(label_probs) else label_probs.nbytes)
+    else:
+        label_bytes = (16 * sum(
+            len(o['label_probs']) for o in object_proposals) if any(
+                isinstance(o['label_probs'], dict)
+                for o in object_proposals) else
+                       8 * n_props * len(object_proposals[0]['label_probs']))
+    fixed_bytes = label_bytes + ((num_tables * 4 + 8) * n**2
+                                 if plan['assignment'] == 'hungarian' else
+                                 (num_tables * 8 + 40) * nnz)
+    workers = tile_workers or min(32, (os.cpu_count() or 1) + 4)
+    if assignment is None and not batched:
+        workers = 1
+    tile_bytes = max_tile_bytes
+    if max_bytes is not None and fixed_bytes + pairs * _TILE_BYTES_PER_PAIR > (
+            max_bytes):
+        budget = int(
+            max(_TILE_BYTES_PER_PAIR, (max_bytes - fixed_bytes) // workers))
+        tile_bytes = budget if tile_bytes is None else min(tile_bytes, budget)
+    plan['tiled'] = (tile_bytes is not None and
+                     pairs * _TILE_BYTES_PER_PAIR > tile_bytes)
+    plan.update({'tile_bytes': tile_bytes, 'workers': workers})
+    plan['bytes'] = int(fixed_bytes + (min(
+        pairs, workers * max(1, tile_bytes // _TILE_BYTES_PER_PAIR)) if
+                                       plan['tiled'] else pairs) *
+                        _TILE_BYTES_PER_PAIR)
+    return plan
+
+
+def calibrate_cost_model(size=200, repeats=3, seed=0):
+    """
+    Measures the seconds taken by each unit of work in the cost model on the current machine, by timing each part of
+    the evaluation on a synthetic map. The result can be given to OMQ as plan={'seconds': ...} in place of the rough
+    defaults in COST_MODEL_SECONDS (e.g. measuring once when setting up an evaluation server).
+    :param size: number of ground-truth objects & object proposals in the synthetic map (larger maps give steadier
+    measurements, but take longer)
+    :param repeats: number of times each part is timed, keeping the fastest
+    :param seed: seed for generating the synthetic map
+    :return: dictionary of seconds taken by each unit of work, with the same keys as COST_MODEL_SECONDS
+    """
+    rng = np.random.default_rng(seed)
+    n, num_ious = size, min(size * size, 200)
+    centroids = rng.uniform(0, 10, (2, n, 3))
+    extents = rng.uniform(0.2, 1.5, (2, n, 3))
+    gt_labels = rng.integers(0, 30, n)
+    prop_probs = rng.dirichlet(np.ones(31), n)
+    gt_state_ids = rng.integers(0, 3, n)
+    prop_state_probs = rng.dirichlet(np.ones(3), n)
+    cuboids = [[{
+        'centroid': c,
+        'extent': e
+    } for c, e in zip(centroids[i], extents[i])] for i in range(2)]
+    # Sparse qualities with a few non-zero pairs for each ground-truth object
+    quality = np.where(
+        rng.random((n, n)) < min(1.0, 5 / n), rng.uniform(0.1, 1, (n, n)), 0)
+    nnz = np.count_nonzero(quality)
+
+    def fastest(f):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            f()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    def pair_qualities():
+        label_qual_mat = _calc_label_qual(gt_labels, prop_probs)
+        state_qual_mat = _calc_state_change_qual(gt_state_ids,
+                                                 prop_state_probs)
+        return 1 - _calc_overall_qual(label_qual_mat, label_qual_mat,
+                                      state_qual_mat)
+
+    scan = fastest(lambda: sparse.csr_matrix(np.where(quality > 0, quality, 0))
+                  ) / (n * n)
+    return {
+        'pair':
+            fastest(pair_qualities) / (n * n),
+        'iou':
+            fastest(lambda: [
+                _IOU_TOOL.dict_iou(cuboids[0][i % n], cuboids[1][i // n % n])
+                for i in range(num_ious)
+            ]) / num_ious,
+        'iou_aligned':
+            fastest(lambda: calc_spatial_qual_aligned(
+                centroids[0][:, None], extents[0][:, None], centroids[1][
+                    None], extents[1][None])) / (n * n),
+        'hungarian':
+            fastest(lambda: linear_sum_assignment(1 - quality)) / n**3,
+        'sparse_scan':
+            scan,
+        'sparse_pair':
+            max(0.0,
+                fastest(lambda: sparse_assignment(quality)) - scan * n * n) /
+            (max(1, nnz) * math.sqrt(max(1, nnz / n)))
+    }
 
 
 def _vectorize_map_gts(gt_objects, scd_mode):
@@ -198,7 +1578,7 @@ def _vectorize_map_gts(gt_objects, scd_mode):
     gt_labels: g, numpy array of class labels as an integer for each of the g ground-truth dicts
     """
     gt_labels = np.array([gt_obj['class_id'] for gt_obj in gt_objects],
-                         dtype=np.int)  # g,
+                         dtype=np.int64)  # g,
     gt_cuboids = [{
         "centroid": gt_obj['centroid'],
         "extent": gt_obj["extent"]
@@ -219,64 +1599,136 @@ def _vectorize_map_props(proposed_objects, scd_mode):
     :return: (prop_cuboids, prop_class_probs, det_)
     prop_cuboids: p length list of cuboid centroids and extents stored as dictionaries for the p object proposals
     (dictionary format: {'centroid': <centroid>, 'extent': <extent>})
-    prop_class_probs: p x c numpy array of class label probability scores across all c classes for each of the
-    p object proposals
+    prop_class_probs: p x c numpy array (or scipy sparse matrix, see _label_prob_matrix()) of class label probability
+    scores across all c classes for each of the p object proposals
     prop_state_probs: p x 3 numpy array of state probability scores across all 3 object states for each of the
     p object proposals. Note this is only relevant for SCD and states are (in order) [added, removed, same].
     """
-    prop_class_probs = np.stack(
-        [np.array(prop_obj['label_probs']) for prop_obj in proposed_objects],
-        axis=0)  # d x c
-    prop_cuboids = [{
-        "centroid": prop_obj['centroid'],
-        "extent": prop_obj["extent"]
-    } for prop_obj in proposed_objects]  # d,
+    prop_class_probs = _label_prob_matrix(proposed_objects)  # d x c
+    # NOTE ObjectArrays already give the cuboid dict of each index
+    prop_cuboids = (proposed_objects
+                    if isinstance(proposed_objects, ObjectArrays) else [{
+                        "centroid": prop_obj['centroid'],
+                        "extent": prop_obj["extent"]
+                    } for prop_obj in proposed_objects])  # d,
     if scd_mode:
         # Currently assuming that format of state_probs is 3 dimensional
         # format [<prob_added>, <prob_removed>, <prob_same>]
-        prop_state_probs = np.stack([
-            np.array(prop_obj['state_probs']) for prop_obj in proposed_objects
-        ],
-                                    axis=0)  # d x 3
+        prop_state_probs = object_array(proposed_objects,
+                                        'state_probs')  # d x 3
     else:
         prop_state_probs = np.ones((len(proposed_objects), 3)) * -1
     return prop_cuboids, prop_class_probs, prop_state_probs
 
 
-def _calc_spatial_qual(gt_cuboids, prop_cuboids):
+def _calc_spatial_qual(gt_cuboids, prop_cuboids, mask=None):
     """
     Calculate the spatial quality for all object proposals on all ground truth objects for a given map.
     :param: gt_cuboids: g length list of all ground-truth cuboid dictionaries defining centroid and extent of objects
     :param: prop_cuboids: p length list of all proposed object cuboid dictionaries defining centroid and
     extent of objects
+    :param: mask: g x p boolean numpy array of the pairs whose spatial quality is calculated, with all other pairs left
+    at zero (None to calculate every pair, see _calc_quality_mask())
     :return: spatial_quality: g x p spatial quality score between zero and one for each possible combination of
     g ground truth objects and p object proposals.
     """
-    # TODO optimize in some clever way in future rather than two for loops
     spatial_quality = np.zeros((len(gt_cuboids), len(prop_cuboids)),
-                               dtype=np.float)  # g x d
-    for gt_id, gt_cub_dict in enumerate(gt_cuboids):
-        for prop_id, prop_cub_dict in enumerate(prop_cuboids):
-            spatial_quality[gt_id, prop_id] = _IOU_TOOL.dict_iou(
-                gt_cub_dict, prop_cub_dict)[1]
+                               dtype=np.float64)  # g x d
+    if mask is None:
+        mask = np.ones(spatial_quality.shape, dtype=bool)
+    for gt_id, prop_id in zip(*np.nonzero(mask)):
+        spatial_quality[gt_id, prop_id] = _IOU_TOOL.dict_iou(
+            gt_cuboids[gt_id], prop_cuboids[prop_id])[1]
 
     return spatial_quality
 
 
+def _calc_quality_mask(label_qual_mat, state_qual_mat):
+    """
+    Find the pairs that could have a non-zero overall quality. Overall quality is a geometric mean, so it is zero
+    whenever the label quality (or state quality in SCD) is zero, no matter how well the cuboids overlap. Spatial
+    quality is only ever used for pairs with a non-zero overall quality, so it only needs calculating for these pairs.
+    :param label_qual_mat: g x p label quality matrix (see _calc_label_qual())
+    :param state_qual_mat: g x p state quality matrix (see _calc_state_change_qual()), or None if not in SCD mode
+    :return: g x p boolean numpy array, True for pairs that need their spatial quality calculated
+    """
+    if state_qual_mat is None:
+        return label_qual_mat > 0
+    return (label_qual_mat > 0) & (state_qual_mat > 0)
+
+
 def _calc_label_qual(gt_labels, prop_class_probs):
     """
     Calculate the label quality for all object proposals on all ground truth objects for a given image.
     :param gt_labels:  g, numpy array containing the class label as an integer for each ground-truth object.
-    :param prop_class_probs: p x c numpy array of class label probability scores across all c classes
-    for each of the p object proposals.
+    :param prop_class_probs: p x c numpy array (or scipy sparse matrix) of class label probability scores across all c
+    classes for each of the p object proposals.
     :return: label_qual_mat: g x p label quality score between zero and one for each possible combination of
     g ground truth objects and p object proposals.
     """
+    if sparse.issparse(prop_class_probs):
+        # Gather straight from the sparse storage (classes past the end of the
+        # matrix have no probability)
+        known = gt_labels < prop_class_probs.shape[1]
+        label_qual_mat = np.zeros((len(gt_labels), prop_class_probs.shape[0]),
+                                  dtype=np.float32)
+        label_qual_mat[known] = prop_class_probs[:, gt_labels[known]].T.toarray()
+        return label_qual_mat
     label_qual_mat = prop_class_probs[:, gt_labels].T.astype(
         np.float32)  # g x d
     return label_qual_mat
 
 
+def _label_prob_matrix(object_proposals):
+    """
+    Stack the label probability distributions of object proposals into a matrix. Dense distributions (lists or arrays
+    of probabilities, with the background class last) are stacked as they are, while any sparse distributions (dicts of
+    class id to probability, without the background class) give a sparse matrix holding only the non-zero probabilities.
+    :param object_proposals: list of object proposal dicts, or ObjectArrays (whose label probabilities are used as they
+    are)
+    :return: p x c numpy array if every distribution is dense, otherwise a p x c scipy sparse (CSR) matrix
+    """
+    if isinstance(object_proposals, ObjectArrays):
+        return object_proposals.label_probs
+    if not any(isinstance(o['label_probs'], dict) for o in object_proposals):
+        return np.stack([np.array(o['label_probs']) for o in object_proposals],
+                        axis=0)
+    rows, cols, probs = [], [], []
+    for i, o in enumerate(object_proposals):
+        if isinstance(o['label_probs'], dict):
+            c, p = list(o['label_probs'].keys()), list(
+                o['label_probs'].values())
+        else:
+            c = np.flatnonzero(o['label_probs']).tolist()
+            p = np.asarray(o['label_probs'])[c].tolist()
+        rows.extend([i] * len(c))
+        cols.extend(c)
+        probs.extend(p)
+    return sparse.csr_matrix(
+        (np.array(probs, dtype=np.float64), (np.array(rows, dtype=np.int64),
+                                             np.array(cols, dtype=np.int64))),
+        shape=(len(object_proposals), max(cols, default=0) + 1))
+
+
+def _gather_label_probs(object_proposals, prop_idxs, class_ids):
+    """
+    Gather the label probabilities of a list of (object proposal, class) pairs, straight from sparse storage if any
+    distributions are sparse (see _label_prob_matrix())
+    :param object_proposals: list of object proposal dicts
+    :param prop_idxs: n, numpy array of object proposal indices
+    :param class_ids: n, numpy array of class ids
+    :return: n, numpy array of the label probability of each pair
+    """
+    label_probs = _label_prob_matrix(object_proposals)
+    if not sparse.issparse(label_probs):
+        return label_probs[prop_idxs, class_ids]
+    probs = np.zeros(len(prop_idxs))
+    known = class_ids < label_probs.shape[1]
+    probs[known] = np.asarray(label_probs[prop_idxs[known],
+                                          class_ids[known]]).ravel()
+    return probs
+
+
 def _calc_state_change_qual(gt_state_ids, prop_state_probs):
     """
     Calculate the label quality for all object proposals on all ground truth objects for a given image.
@@ -315,63 +1767,463 @@ def _calc_overall_qual(label_qual_mat, spatial_qual_mat, state_qual_mat):
     # Calculate the geometric mean between all qualities
     # Note we ignore divide by zero warnings here for log(0) calculations internally.
     with np.errstate(divide='ignore'):
-        overall_qual_mat = gmean(combined_mat, axis=2)
+        overall_qual_mat = _gmean(combined_mat, axis=2)
 
     return overall_qual_mat
 
 
-def _gen_cost_tables(gt_objects, object_proposals, scd_mode):
+def _gmean(a, axis):
+    """
+    Geometric mean along an axis, calculated the same way as scipy.stats.gmean() but without its overhead on every
+    call (which outweighs the calculation itself for the small arrays of a single map)
+    :param a: numpy array of values
+    :param axis: axis the mean is taken along
+    :return: numpy array of geometric means
+    """
+    return np.exp(np.mean(np.log(a), axis=axis))
+
+
+def _gen_map_tables(gt_objects, object_proposals, options, tables=None):
+    """
+    Generate the tables a single map is assigned & scored from, as its options ask for: sparse tables for the 'sparse'
+    assignment backend (see _sparse_tables(), calculated tile by tile within the map's memory bound), & otherwise cost
+    tables (see _gen_cost_tables()). Qualities are calculated the same way (with the per pair 3D IoU) either way.
+    :param gt_objects: list of all ground-truth object dicts for a given map.
+    :param object_proposals: list of all object proposal dicts for a given map.
+    :param options: dictionary of the options the map is evaluated with (see _map_options())
+    :param tables: list of the tables to generate (None for all of them, see _component_tables())
+    :return: dictionary of cost tables or sparse tables, in the same format as _gen_cost_tables()
+    """
+    if options['assignment'] == 'sparse':
+        return _gen_cost_tables_tiled(gt_objects,
+                                      object_proposals,
+                                      options['scd_mode'],
+                                      options['max_tile_bytes'],
+                                      workers=options['tile_workers'],
+                                      tables=tables,
+                                      sparse_tables=True)
+    return _gen_cost_tables(gt_objects,
+                            object_proposals,
+                            options['scd_mode'],
+                            tables=tables)
+
+
+def _gen_cost_tables(gt_objects,
+                     object_proposals,
+                     scd_mode,
+                     gated=True,
+                     tables=None):
     """
     Generate the cost tables containing the cost values (1 - quality) for each combination of ground truth objects and
     object proposals within a given map.
     :param gt_objects: list of all ground-truth object dicts for a given map.
     :param object_proposals: list of all object proposal dicts for a given map.
+    :param gated: flag for whether spatial quality is only calculated for pairs with non-zero label & state quality
+    (see _calc_quality_mask()), rather than for every pair
+    :param tables: list of the cost tables to generate (None for all of them, see _component_tables())
     :return: dictionary of g x p cost tables for each combination of ground truth objects and object proposals.
     Note that all costs are simply 1 - quality scores (required for Hungarian algorithm implementation)
     Format: {'overall': overall summary cost table, 'spatial': spatial quality cost table,
-    'label': label quality cost table, 'state': state cost table}
+    'label': label quality cost table, 'state': state cost table, 'skipped_pairs': number of pairs whose spatial
+    quality was never calculated (see _calc_quality_mask())}, with only the requested tables
     """
-    # Initialise cost tables
-    n_pairs = max(len(gt_objects), len(object_proposals))
-    overall_cost_table = np.ones((n_pairs, n_pairs), dtype=np.float32)
-    spatial_cost_table = np.ones((n_pairs, n_pairs), dtype=np.float32)
-    label_cost_table = np.ones((n_pairs, n_pairs), dtype=np.float32)
-    state_cost_table = np.ones((n_pairs, n_pairs), dtype=np.float32)
-
     # Generate all the matrices needed for calculations
     gt_cuboids, gt_labels, gt_state_ids = _vectorize_map_gts(
         gt_objects, scd_mode)
     prop_cuboids, prop_class_probs, prop_state_probs = _vectorize_map_props(
         object_proposals, scd_mode)
 
-    # Calculate spatial, label and state qualities (state only used in SCD)
+    # Calculate label and state qualities (state only used in SCD), then
+    # spatial qualities for only the pairs they don't already rule out
     label_qual_mat = _calc_label_qual(gt_labels, prop_class_probs)
-    spatial_qual = _calc_spatial_qual(gt_cuboids, prop_cuboids)
     state_change_qual = _calc_state_change_qual(gt_state_ids, prop_state_probs)
+    spatial_qual = _calc_spatial_qual(
+        gt_cuboids, prop_cuboids,
+        _calc_quality_mask(label_qual_mat, state_change_qual)
+        if gated else None)
 
-    # Generate the overall cost table (1 - overall quality)
-    overall_cost_table[:len(gt_objects
-                           ), :len(object_proposals)] -= _calc_overall_qual(
-                               label_qual_mat, spatial_qual, state_change_qual)
-
-    # Generate the spatial, label and (optionally) state cost tables
-    spatial_cost_table[:len(gt_objects), :len(object_proposals
-                                             )] -= spatial_qual
-    label_cost_table[:len(gt_objects), :len(object_proposals
-                                           )] -= label_qual_mat
-    if scd_mode:
-        state_cost_table[:len(gt_objects), :len(object_proposals
-                                               )] -= state_change_qual
+    return _fill_cost_tables(gt_objects, object_proposals, label_qual_mat,
+                             spatial_qual, state_change_qual, scd_mode, tables)
 
-    return {
-        'overall': overall_cost_table,
-        'spatial': spatial_cost_table,
-        'label': label_cost_table,
-        'state': state_cost_table
-    }
 
+def _fill_cost_tables(gt_objects,
+                      object_proposals,
+                      label_qual_mat,
+                      spatial_qual,
+                      state_change_qual,
+                      scd_mode,
+                      tables=None,
+                      overall_qual=None):
+    """
+    Fill the (padded) cost tables for a map from its g x p quality matrices.
+    :param gt_objects: list of all ground-truth object dicts for a given map.
+    :param object_proposals: list of all object proposal dicts for a given map.
+    :param label_qual_mat: g x p label quality matrix (see _calc_label_qual())
+    :param spatial_qual: g x p spatial quality matrix (see _calc_spatial_qual())
+    :param state_change_qual: g x p state quality matrix (see _calc_state_change_qual()), or None if not in SCD mode
+    :param scd_mode: flag for whether the map is evaluated for scene change detection
+    :param tables: list of the cost tables to generate (None for all of them, see _component_tables())
+    :param overall_qual: g x p overall quality matrix if it has already been calculated (see _calc_overall_qual())
+    :return: dictionary of cost tables in the same format as _gen_cost_tables()
+    """
+    cost_tables = _init_cost_tables(gt_objects, object_proposals, tables)
+    cost_tables['skipped_pairs'] = _fill_cost_tables_tile(
+        cost_tables, 0, 0, label_qual_mat, spatial_qual, state_change_qual,
+        scd_mode, overall_qual)
+    return cost_tables
+
+
+def _init_cost_tables(gt_objects, object_proposals, tables=None):
+    """
+    Initialise the (padded) cost tables for a map, with every pair at the maximum cost of 1.
+    :param gt_objects: list of all ground-truth object dicts for a given map.
+    :param object_proposals: list of all object proposal dicts for a given map.
+    :param tables: list of the cost tables to initialise (None for all of them, see _component_tables())
+    :return: dictionary of n x n cost tables in the same format as _gen_cost_tables(), where n = max(g, p)
+    """
+    n_pairs = max(len(gt_objects), len(object_proposals))
+    return {
+        k: np.ones((n_pairs, n_pairs), dtype=np.float32)
+        for k in (_COST_TABLE_KEYS if tables is None else tables)
+    }
+
+
+def _fill_cost_tables_tile(cost_tables,
+                           row,
+                           col,
+                           label_qual_mat,
+                           spatial_qual,
+                           state_change_qual,
+                           scd_mode,
+                           overall_qual=None):
+    """
+    Fill a tile of the cost tables from the quality matrices of a block of ground-truth objects and object proposals.
+    :param cost_tables: dictionary of cost tables to be filled (see _init_cost_tables())
+    :param row: index of the first ground-truth object in the tile
+    :param col: index of the first object proposal in the tile
+    :param label_qual_mat: tile of the label quality matrix (see _calc_label_qual())
+    :param spatial_qual: tile of the spatial quality matrix (see _calc_spatial_qual())
+    :param state_change_qual: tile of the state quality matrix (see _calc_state_change_qual()), or None if not in SCD
+    mode
+    :param scd_mode: flag for whether the map is evaluated for scene change detection
+    :param overall_qual: tile of the overall quality matrix if it has already been calculated (see
+    _calc_overall_qual())
+    :return: number of pairs in the tile whose spatial quality didn't need calculating (see _calc_quality_mask())
+    """
+    rows = slice(row, row + label_qual_mat.shape[0])
+    cols = slice(col, col + label_qual_mat.shape[1])
+
+    # Generate the overall cost table (1 - overall quality)
+    cost_tables['overall'][rows, cols] -= (_calc_overall_qual(
+        label_qual_mat, spatial_qual, state_change_qual)
+                                           if overall_qual is None else
+                                           overall_qual)
+
+    # Generate the spatial, label and (optionally) state cost tables, if they
+    # are needed
+    if 'spatial' in cost_tables:
+        cost_tables['spatial'][rows, cols] -= spatial_qual
+    if 'label' in cost_tables:
+        cost_tables['label'][rows, cols] -= label_qual_mat
+    if scd_mode and 'state' in cost_tables:
+        cost_tables['state'][rows, cols] -= state_change_qual
+    return int(
+        np.count_nonzero(~_calc_quality_mask(label_qual_mat,
+                                             state_change_qual)))
+
+
+def _calc_tile_pairs(row,
+                     col,
+                     label_qual_mat,
+                     spatial_qual,
+                     state_change_qual,
+                     scd_mode,
+                     tables=None,
+                     overall_qual=None):
+    """
+    Find the pairs with non-zero overall quality in a tile of ground-truth objects and object proposals, with their
+    qualities exactly as the (float32) cost tables would give them (see _fill_cost_tables_tile() &
+    _calc_quality_tables()), but without a table of every pair.
+    :param row: index of the first ground-truth object in the tile
+    :param col: index of the first object proposal in the tile
+    :param label_qual_mat: tile of the label quality matrix (see _calc_label_qual())
+    :param spatial_qual: tile of the spatial quality matrix (see _calc_spatial_qual())
+    :param state_change_qual: tile of the state quality matrix (see _calc_state_change_qual()), or None if not in SCD
+    mode
+    :param scd_mode: flag for whether the map is evaluated for scene change detection
+    :param tables: list of the tables to find qualities for (None for all of them, see _component_tables())
+    :param overall_qual: tile of the overall quality matrix if it has already been calculated (see
+    _calc_overall_qual())
+    :return: (rows, cols, qualities, skipped_pairs). The ground-truth & object proposal indices of the pairs within the
+    map, a dictionary of their qualities in each table (keyed like _gen_cost_tables()), & the number of pairs in the
+    tile whose spatial quality didn't need calculating (see _calc_quality_mask())
+    """
+    overall = _table_qualities(
+        _calc_overall_qual(label_qual_mat, spatial_qual, state_change_qual)
+        if overall_qual is None else overall_qual)
+    rows, cols = np.nonzero(overall > 0)
+    tile_quals = {
+        'spatial': spatial_qual,
+        'label': label_qual_mat,
+        'state': state_change_qual if scd_mode else None
+    }
+    qualities = {}
+    for k in (_COST_TABLE_KEYS if tables is None else tables):
+        if k == 'overall':
+            qualities[k] = overall[rows, cols]
+        elif tile_quals[k] is None:
+            qualities[k] = np.zeros(len(rows), dtype=np.float32)
+        else:
+            qualities[k] = _table_qualities(tile_quals[k][rows, cols])
+    return (rows + row, cols + col, qualities,
+            int(
+                np.count_nonzero(~_calc_quality_mask(label_qual_mat,
+                                                     state_change_qual))))
+
+
+def _table_qualities(qualities):
+    """
+    Round qualities the same way as storing them in the (float32) cost tables & transforming them back (see
+    _fill_cost_tables_tile() & _calc_quality_tables()), so sparse tables hold exactly the same qualities.
+    :param qualities: numpy array of qualities
+    :return: float32 numpy array of the rounded qualities
+    """
+    return 1 - (1 - np.asarray(qualities, dtype=np.float64)).astype(np.float32)
+
+
+def _sparse_tables(n_gts, n_props, tile_pairs, tables=None):
+    """
+    Assemble the sparse tables of a map (used by the 'sparse' assignment backend) from the pairs found in its tiles.
+    Unlike cost tables, sparse tables are g x p scipy sparse (CSR) matrices of qualities (not costs), holding only the
+    pairs with non-zero overall quality, so their size only depends on how many pairs could ever be matched. Every
+    other pair has zero quality, just like in the quality tables of the cost tables (see _calc_quality_tables()).
+    :param n_gts: number of ground-truth objects g
+    :param n_props: number of object proposals p
+    :param tile_pairs: list of the pairs found in each tile, as returned by _calc_tile_pairs()
+    :param tables: list of the tables to assemble (None for all of them, see _component_tables())
+    :return: dictionary of g x p sparse tables keyed like _gen_cost_tables() (including 'skipped_pairs')
+    """
+    rows = np.concatenate([t[0] for t in tile_pairs])
+    cols = np.concatenate([t[1] for t in tile_pairs])
+    sparse_tables = {}
+    for k in (_COST_TABLE_KEYS if tables is None else tables):
+        sparse_tables[k] = sparse.csr_matrix(
+            (np.concatenate([t[2][k] for t in tile_pairs]), (rows, cols)),
+            shape=(n_gts, n_props))
+        sparse_tables[k].sort_indices()
+    sparse_tables['skipped_pairs'] = sum(t[3] for t in tile_pairs)
+    return sparse_tables
 
-def _calc_qual_map(gt_objects, object_proposals, scd_mode):
+
+def _gen_cost_tables_tiled(gt_objects,
+                           object_proposals,
+                           scd_mode,
+                           max_tile_bytes,
+                           workers=None,
+                           aligned=False,
+                           tables=None,
+                           sparse_tables=False):
+    """
+    Generate the cost tables for a map tile by tile, so the working memory used to calculate qualities is bounded
+    regardless of the size of the map. Tiles are calculated concurrently on a thread pool, each writing directly into
+    the preallocated cost tables. Cost tables are identical to those from _gen_cost_tables() (or from
+    _gen_cost_tables_batched() if aligned).
+    :param gt_objects: list of all ground-truth object dicts for a given map.
+    :param object_proposals: list of all object proposal dicts for a given map.
+    :param scd_mode: flag for whether the map is evaluated for scene change detection
+    :param max_tile_bytes: approximate maximum bytes of working memory used to calculate each tile (None for a single
+    tile of every pair)
+    :param workers: number of threads calculating tiles (None for the thread pool default)
+    :param aligned: flag for whether spatial quality is calculated with the vectorised 3D IoU of axis-aligned cuboids
+    (which releases the GIL, so tiles are calculated in parallel), rather than for each pair at a time
+    :param tables: list of the cost tables to generate (None for all of them, see _component_tables())
+    :param sparse_tables: flag for whether each tile only keeps its pairs with non-zero overall quality, giving sparse
+    tables (see _sparse_tables()) instead of the padded cost tables
+    :return: dictionary of cost tables in the same format as _gen_cost_tables(), or of sparse tables
+    """
+    cost_tables = (None if sparse_tables else _init_cost_tables(
+        gt_objects, object_proposals, tables))
+    gt_cuboids, gt_labels, gt_state_ids = _vectorize_map_gts(
+        gt_objects, scd_mode)
+    prop_cuboids, prop_class_probs, prop_state_probs = _vectorize_map_props(
+        object_proposals, scd_mode)
+    if aligned:
+        gt_centroids, gt_extents, prop_centroids, prop_extents = [
+            object_array(cubs, k)
+            for cubs, k in [(gt_cuboids, 'centroid'), (gt_cuboids, 'extent'),
+                            (prop_cuboids, 'centroid'), (prop_cuboids,
+                                                          'extent')]
+        ]
+
+    # Roughly square tiles, with as many pairs as the memory bound allows
+    if max_tile_bytes is None:
+        n_rows, n_cols = len(gt_objects), len(object_proposals)
+    else:
+        tile_pairs = max(1, max_tile_bytes // _TILE_BYTES_PER_PAIR)
+        n_cols = int(min(len(object_proposals), max(1,
+                                                    math.sqrt(tile_pairs))))
+        n_rows = int(min(len(gt_objects), max(1, tile_pairs // n_cols)))
+
+    def fill_tile(tile):
+        r, c = tile
+        gts, props = slice(r, r + n_rows), slice(c, c + n_cols)
+        label_qual_mat = _calc_label_qual(gt_labels[gts],
+                                          prop_class_probs[props])
+        state_change_qual = _calc_state_change_qual(gt_state_ids[gts],
+                                                    prop_state_probs[props])
+        mask = _calc_quality_mask(label_qual_mat, state_change_qual)
+        if aligned:
+            spatial_qual = np.zeros(mask.shape)
+            rows, cols = np.nonzero(mask)
+            spatial_qual[rows, cols] = calc_spatial_qual_aligned(
+                gt_centroids[gts][rows], gt_extents[gts][rows],
+                prop_centroids[props][cols], prop_extents[props][cols])
+        else:
+            spatial_qual = _calc_spatial_qual(gt_cuboids[gts],
+                                              prop_cuboids[props], mask)
+        if sparse_tables:
+            return _calc_tile_pairs(r, c, label_qual_mat, spatial_qual,
+                                    state_change_qual, scd_mode, tables)
+        return _fill_cost_tables_tile(cost_tables, r, c, label_qual_mat,
+                                      spatial_qual, state_change_qual,
+                                      scd_mode)
+
+    tiles = [(r, c)
+             for r in range(0, len(gt_objects), n_rows)
+             for c in range(0, len(object_proposals), n_cols)]
+    if len(tiles) == 1 or workers == 1:
+        filled = list(map(fill_tile, tiles))
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            filled = list(executor.map(fill_tile, tiles))
+    if sparse_tables:
+        return _sparse_tables(len(gt_objects), len(object_proposals), filled,
+                              tables)
+    cost_tables['skipped_pairs'] = sum(filled)
+    return cost_tables
+
+
+def _gen_cost_tables_batched(param_lists,
+                             scd_mode,
+                             tables=None,
+                             sparse_maps=None):
+    """
+    Generate the cost tables for many maps at once. The ground-truth objects & object proposals of all maps are
+    concatenated into flat arrays, and qualities are calculated in a single vectorised pass over only the pairs within
+    each map (i.e. the block diagonal of all pairs), using a vectorised 3D IoU of axis-aligned cuboids.
+    :param param_lists: list of (ground-truth dicts, detection dicts) tuples, one for each map
+    :param scd_mode: flag for whether maps are evaluated for scene change detection
+    :param tables: list of the cost tables to generate (None for all of them, see _component_tables())
+    :param sparse_maps: list of flags for which maps get sparse tables (see _sparse_tables()) instead of cost tables
+    (None for no maps)
+    :return: list of cost tables (or sparse tables) for each map (see _gen_cost_tables()), or None for maps with no
+    ground-truth objects or no object proposals
+    """
+    sparse_maps = [
+        s for (gts, props), s in zip(
+            param_lists, sparse_maps or [False] * len(param_lists))
+        if len(gts) > 0 and len(props) > 0
+    ]
+    maps = [(gts, props) for gts, props in param_lists
+            if len(gts) > 0 and len(props) > 0]
+    if not maps:
+        return [None] * len(param_lists)
+    gts = [o for m in maps for o in m[0]]
+    props = _concat_objects([m[1] for m in maps])
+    n_gts = np.array([len(m[0]) for m in maps], dtype=np.int64)
+    n_props = np.array([len(m[1]) for m in maps], dtype=np.int64)
+
+    # Index of the ground-truth object & object proposal of every pair, with
+    # the pairs of each map laid out in row-major (g x p) order
+    n_map_pairs = n_gts * n_props
+    map_idxs = np.repeat(np.arange(len(maps)), n_map_pairs)
+    pair_idxs = np.arange(np.sum(n_map_pairs)) - np.repeat(
+        np.cumsum(n_map_pairs) - n_map_pairs, n_map_pairs)
+    gt_idxs = (np.cumsum(n_gts) - n_gts)[map_idxs] + pair_idxs // n_props[
+        map_idxs]
+    prop_idxs = (np.cumsum(n_props) -
+                 n_props)[map_idxs] + pair_idxs % n_props[map_idxs]
+
+    # Calculate label and state qualities for every pair (state only used in
+    # SCD), then spatial qualities for only the pairs they don't already rule
+    # out, with the same precision as each map's _gen_cost_tables()
+    gt_labels = np.array([o['class_id'] for o in gts], dtype=np.int64)
+    label_qual = _gather_label_probs(props, prop_idxs,
+                                     gt_labels[gt_idxs]).astype(np.float32)
+    state_qual = (object_array(props, 'state_probs')[
+        prop_idxs,
+        np.array([_STATE_IDS[o['state']] for o in gts])[gt_idxs]].astype(
+            np.float32) if scd_mode else None)
+    mask = _calc_quality_mask(label_qual, state_qual)
+    spatial_qual = np.zeros(len(mask))
+    spatial_qual[mask] = calc_spatial_qual_aligned(
+        np.array([o['centroid'] for o in gts],
+                 dtype=np.float64)[gt_idxs[mask]],
+        np.array([o['extent'] for o in gts], dtype=np.float64)[gt_idxs[mask]],
+        object_array(props, 'centroid')[prop_idxs[mask]],
+        object_array(props, 'extent')[prop_idxs[mask]])
+
+    # Overall qualities are element-wise, so can also be calculated in a
+    # single pass for every map
+    overall_qual = _calc_overall_qual(label_qual, spatial_qual,
+                                      state_qual).ravel()
+
+    # Split the qualities back into each map's cost tables
+    cost_tables = []
+    starts = np.cumsum(n_map_pairs) - n_map_pairs
+    for (m_gts, m_props), a, g, p, sp in zip(maps, starts, n_gts, n_props,
+                                             sparse_maps):
+        m_label, m_spatial, m_overall = [
+            q[a:a + g * p].reshape(g, p)
+            for q in [label_qual, spatial_qual, overall_qual]
+        ]
+        m_state = (None if state_qual is None else
+                   state_qual[a:a + g * p].reshape(g, p))
+        cost_tables.append(
+            _sparse_tables(g, p, [
+                _calc_tile_pairs(0, 0, m_label, m_spatial, m_state, scd_mode,
+                                 tables, m_overall)
+            ], tables) if sp else _fill_cost_tables(
+                m_gts, m_props, m_label, m_spatial, m_state, scd_mode, tables,
+                m_overall))
+    cost_tables = iter(cost_tables)
+    return [
+        next(cost_tables) if len(m_gts) > 0 and len(m_props) > 0 else None
+        for m_gts, m_props in param_lists
+    ]
+
+
+def calc_spatial_qual_aligned(gt_centroids, gt_extents, prop_centroids,
+                               prop_extents):
+    """
+    Calculate the spatial quality (3D IoU) for pairs of ground-truth objects and object proposals, all at once. All
+    cuboids are assumed axis-aligned, which makes the intersection of two cuboids a cuboid itself.
+    :param gt_centroids: n x 3 numpy array of ground-truth cuboid centroids, one for each of the n pairs
+    :param gt_extents: n x 3 numpy array of ground-truth cuboid extents
+    :param prop_centroids: n x 3 numpy array of object proposal cuboid centroids
+    :param prop_extents: n x 3 numpy array of object proposal cuboid extents
+    (all arrays can instead have any shapes that broadcast together, as long as the last dimension is 3)
+    :return: spatial_quality: n length numpy array of spatial quality scores between zero and one for each pair
+    """
+    # NOTE corners & volumes are calculated the same way as in iou_tools
+    overlap = np.maximum(
+        np.minimum(gt_centroids + 0.5 * gt_extents,
+                   prop_centroids + 0.5 * prop_extents) -
+        np.maximum(gt_centroids + 0.5 * -gt_extents,
+                   prop_centroids + 0.5 * -prop_extents), 0)
+    vol_int = overlap[..., 2] * (overlap[..., 0] * overlap[..., 1])
+    union = (np.prod(gt_extents, axis=-1) + np.prod(prop_extents, axis=-1) -
+             vol_int)
+    spatial_quality = np.zeros(union.shape)
+    np.divide(vol_int, union, out=spatial_quality, where=union != 0)
+    return spatial_quality
+
+
+def _calc_qual_map(gt_objects,
+                   object_proposals,
+                   options,
+                   cost_tables=None,
+                   delta=None):
     """
     Calculates the sum of qualities for the best matches between ground truth objects and object proposals for a map.
     Each ground truth object can only be matched to a single object proposal and vice versa as an gt-proposal pair.
@@ -385,124 +2237,1269 @@ def _calc_qual_map(gt_objects, object_proposals, scd_mode):
     will not contribute to average score.
     :param gt_objects: list of ground-truth dictionaries describing the ground truth objects in the current map.
     :param object_proposals: list of object proposal dictionaries describing the object proposals for the current map.
+    :param options: dictionary of the options the map is evaluated with (see _map_options()). Totals only needed for
+    score components that weren't requested are left at zero, & each optional part of the results (see
+    _calc_map_breakdowns() & _calc_map_outputs()) is only included if requested.
+    :param cost_tables: cost tables for the map if they have already been generated (see _gen_cost_tables()), or sparse
+    tables if the map is assigned with the 'sparse' backend (see _sparse_tables())
+    :param delta: differences from the map's previous state (see _diff_map_state()), whose cost tables must already have
+    been merged into cost_tables (see _merge_map_state()). None if there is no previous state.
     :return: results dictionary containing total overall spatial quality, total spatial quality on positively assigned
     object proposals, total label quality on positively assigned object proposals, total false positive cost,
     number of true positives, number of false positives, number false negatives, and total state change quality on
-    positively assigned object proposals (relevant only for SCD).
+    positively assigned object proposals (relevant only for SCD), upper bound on the total overall quality lost by
+    approximate assignment, number of ground-truth & proposal pairs, number of those pairs whose spatial quality was
+    skipped (as their label or state quality was zero), and any of the optional parts of the results requested.
     Format {'overall':<tot_overall_quality>, 'spatial': <tot_tp_spatial_quality>, 'label': <tot_tp_label_quality>,
     'fp_cost': <tot_fp_cost>, 'TP': <num_true_positives>, 'FP': <num_false_positives>, 'FN': <num_false_positives>,
-    'state_change': <tot_tp_state_quality>}
+    'state_change': <tot_tp_state_quality>, 'assignment_gap': <assignment_gap>, 'pairs': <num_pairs>,
+    'skipped_pairs': <num_skipped_pairs>, 'per_class': <per_class_totals>, ...}
     """
-
-    tot_fp_cost = 0.0
     # if there are no object proposals or gt instances respectively the quality is zero
     if len(gt_objects) == 0 or len(object_proposals) == 0:
-        if len(object_proposals) > 0:
-            # Calculate FP quality
-            # NOTE background class is the final class in the distribution which is ignored when calculating FP cost
-            tot_fp_cost = np.sum([
-                np.max(det_instance['label_probs'][:-1])
-                for det_instance in object_proposals
-            ])
-
-        return {
-            'overall': 0.0,
-            'spatial': 0.0,
-            'label': 0.0,
-            'fp_cost': tot_fp_cost,
-            'TP': 0,
-            'FP': len(object_proposals),
-            'FN': len(gt_objects),
-            'state_change': 0.0
-        }
+        return _calc_empty_map(gt_objects, object_proposals, options)
 
     # For each possible pairing, calculate the quality of that pairing and convert it to a cost
     # to enable use of the Hungarian algorithm.
-    cost_tables = _gen_cost_tables(gt_objects, object_proposals, scd_mode)
-
-    # Use the Hungarian algorithm with the cost table to find the best match between ground truth
-    # object and detection (lowest overall cost representing highest overall pairwise quality)
-    row_idxs, col_idxs = linear_sum_assignment(cost_tables['overall'])
-
-    # Transform the loss tables back into quality tables with values between 0 and 1
-    overall_quality_table = 1 - cost_tables['overall']
-    spatial_quality_table = 1 - cost_tables['spatial']
-    label_quality_table = 1 - cost_tables['label']
-    state_change_quality_table = 1 - cost_tables['state']
-
-    # Go through all optimal assignments and summarize all pairwise statistics
-    # Calculate the number of TPs, FPs, and FNs for the image during the process
-    true_positives = 0
-    false_positives = 0
-    false_negatives = 0
-    false_positive_idxs = []
+    if cost_tables is None:
+        cost_tables = _gen_map_tables(gt_objects,
+                                      object_proposals,
+                                      options,
+                                      tables=_component_tables(
+                                          options['components']))
 
-    for match_idx, match in enumerate(zip(row_idxs, col_idxs)):
-        row_id, col_id = match
-        # Handle "true positives"
-        if overall_quality_table[row_id, col_id] > 0:
-            true_positives += 1
-        else:
-            # Handle false negatives
-            if row_id < len(gt_objects):
-                false_negatives += 1
-            # Handle false positives
-            if col_id < len(object_proposals):
-                # Check if false positive is actually a proposal of an isgroup object that has a better match
-                # only ignored if best match otherwise would be isgroup object (non-zero quality) and max class matches
-                if np.sum(overall_quality_table[:, col_id]) > 0:
-                    # check if max match class is a grouped object
-                    best_gt_idx = np.argmax(overall_quality_table[:, col_id])
-                    if 'isgroup' in gt_objects[best_gt_idx] and gt_objects[best_gt_idx]['isgroup']:
-                        # check if the class of the proposal matches the class of the object
-                        # (ignoring final class which should be background)
-                        if np.argmax(object_proposals[col_id]['label_probs'][:-1]) == gt_objects[best_gt_idx]['class_id']:
-                            # Check if at least 50% of the proposal is within the ground-truth object
-                            if _IOU_TOOL.dict_prop_fraction(object_proposals[col_id], gt_objects[best_gt_idx]) >= 0.5:
-                                # if all criteria met, skip this detection in both fp quality and number of fps
-                                continue
-                false_positives += 1
-                false_positive_idxs.append(col_id)
-
-    # Calculate the sum of quality at the best matching pairs to calculate total qualities for the image
-    tot_overall_img_quality = np.sum(overall_quality_table[row_idxs, col_idxs])
-
-    # Force spatial and label qualities to zero for total calculations as there is no actual association between
-    # object proposals and therefore no TP when this is the case.
-    spatial_quality_table[overall_quality_table == 0] = 0.0
-    label_quality_table[overall_quality_table == 0] = 0.0
-    state_change_quality_table[overall_quality_table == 0] = 0.0
-
-    # Calculate the sum of spatial and label qualities only for TP samples
-    tot_tp_spatial_quality = np.sum(spatial_quality_table[row_idxs, col_idxs])
-    tot_tp_label_quality = np.sum(label_quality_table[row_idxs, col_idxs])
-    tot_tp_state_change_quality = np.sum(
-        state_change_quality_table[row_idxs, col_idxs])
+    # Find the best match between ground truth object and detection (lowest overall cost representing highest overall
+    # pairwise quality)
+    row_idxs, col_idxs, assignment_gap = _assign_map(cost_tables['overall'],
+                                                     len(gt_objects),
+                                                     len(object_proposals),
+                                                     options, delta)
+
+    # Transform the loss tables back into quality tables with values between 0 and 1, & sort the assignments into
+    # "true positives", false negatives, & false positives
+    quality_tables = _calc_quality_tables(cost_tables)
+    matches = _split_assignment(gt_objects, object_proposals,
+                                quality_tables['overall'], row_idxs, col_idxs,
+                                options['scd_mode'])
+
+    # Calculate the sum of quality at the best matching pairs to calculate total qualities for the image, with the sum
+    # of spatial and label qualities only for TP samples
+    tot_overall_img_quality = np.sum(
+        _pair_qualities(quality_tables['overall'], row_idxs, col_idxs))
+    tot_tp_qualities = {
+        k: (np.sum(_pair_qualities(quality_tables[k], row_idxs, col_idxs))
+            if k in quality_tables else 0.0)
+        for k in ['spatial', 'label', 'state_change']
+    }
+
+    results = {
+        'overall': tot_overall_img_quality,
+        'spatial': tot_tp_qualities['spatial'],
+        'label': tot_tp_qualities['label'],
+        'fp_cost': np.sum(matches['fp_costs']),
+        'TP': len(matches['tp_rows']),
+        'FP': len(matches['fp_cols']),
+        'FN': len(matches['fn_rows']),
+        'state_change': tot_tp_qualities['state_change'],
+        'assignment_gap': assignment_gap,
+        'pairs': len(gt_objects) * len(object_proposals),
+        'skipped_pairs': cost_tables['skipped_pairs']
+    }
+    results.update(
+        _calc_map_breakdowns(gt_objects, object_proposals, options, matches,
+                             quality_tables))
+    results.update(
+        _calc_map_outputs(gt_objects, object_proposals, options, matches,
+                          results, quality_tables, cost_tables, delta))
+    return results
+
+
+def _calc_empty_map(gt_objects, object_proposals, options):
+    """
+    Calculates the results for a map without any ground-truth objects or without any object proposals (see
+    _calc_qual_map()). Every ground-truth object is a false negative, & every object proposal is a false positive.
+    :param gt_objects: list of ground-truth dictionaries describing the ground truth objects in the current map.
+    :param object_proposals: list of object proposal dictionaries describing the object proposals for the current map.
+    :param options: dictionary of the options the map is evaluated with (see _map_options())
+    :return: results dictionary in the same format as _calc_qual_map()
+    """
+    tot_fp_cost = 0.0
+    fp_costs = np.zeros(0)
+    if len(object_proposals) > 0:
+        # Calculate FP quality
+        # NOTE background class is the final class in the distribution which is ignored when calculating FP cost
+        fp_costs = _max_labels(object_proposals,
+                               range(len(object_proposals)))[0]
+        tot_fp_cost = np.sum(fp_costs)
+
+    empty_idxs = np.zeros(0, dtype=np.int64)
+    matches = {
+        'tp_rows': empty_idxs,
+        'tp_cols': empty_idxs,
+        'fn_rows': np.arange(len(gt_objects)),
+        'fp_cols': np.arange(len(object_proposals)),
+        'exempt_cols': empty_idxs,
+        'fp_costs': fp_costs
+    }
+    results = {
+        'overall': 0.0,
+        'spatial': 0.0,
+        'label': 0.0,
+        'fp_cost': tot_fp_cost,
+        'TP': 0,
+        'FP': len(object_proposals),
+        'FN': len(gt_objects),
+        'state_change': 0.0,
+        'assignment_gap': 0.0,
+        'pairs': 0,
+        'skipped_pairs': 0
+    }
+    results.update(
+        _calc_map_breakdowns(gt_objects, object_proposals, options, matches,
+                             None))
+    results.update(
+        _calc_map_outputs(gt_objects, object_proposals, options, matches,
+                          results))
+    return results
+
+
+def _assign_map(overall_cost_table, n_gts, n_props, options, delta=None):
+    """
+    Assign ground-truth objects to object proposals with the assignment backend chosen in a map's options.
+    :param overall_cost_table: padded n x n overall cost table as generated by _gen_cost_tables(), or the overall sparse
+    table for the 'sparse' backend (see _sparse_tables())
+    :param n_gts: number of ground-truth objects g
+    :param n_props: number of object proposals p
+    :param options: dictionary of the options the map is evaluated with (see _map_options())
+    :param delta: differences from the map's previous state, merged with its cost tables (see _merge_map_state()). Only
+    the assignment of groups of objects touched by the differences is re-solved with the 'sparse' backend. None if
+    there is no previous state.
+    :return: (row_idxs, col_idxs, gap). A full assignment of the padded table (like linear_sum_assignment()), and an
+    upper bound on the total overall quality lost compared to the optimal assignment (zero unless approximate).
+    """
+    if options['assignment'] == 'sparse' and delta is not None:
+        # Only the groups of objects touched by changes need re-solving
+        return _assignment_delta(overall_cost_table, n_gts, n_props,
+                                 delta) + (0.0,)
+    elif options['assignment'] == 'sparse':
+        # Sparse assignment only considers pairs with non-zero quality, then
+        # pairs up everything left over like the padded Hungarian table
+        return _assignment_sparse(overall_cost_table, n_gts, n_props,
+                                  options['time_budget'])
+    return linear_sum_assignment(overall_cost_table) + (0.0,)
+
+
+def _split_assignment(gt_objects, object_proposals, overall_quality_table,
+                      row_idxs, col_idxs, scd_mode):
+    """
+    Sort the assignments of a map into "true positives" (pairs with non-zero overall quality), false negatives, & false
+    positives, exempting any false positives that are proposals of an isgroup object (see _is_isgroup_exempt()).
+    :param gt_objects: list of ground-truth dicts for the map
+    :param object_proposals: list of object proposal dicts for the map
+    :param overall_quality_table: (padded) overall quality table indexed by (ground-truth, proposal), or the overall
+    sparse table (see _sparse_tables())
+    :param row_idxs: ground-truth indices of a full assignment of the padded table
+    :param col_idxs: object proposal indices of a full assignment of the padded table
+    :param scd_mode: flag for whether the map is evaluated for scene change detection
+    :return: dictionary of numpy arrays, with the indices of the ground-truth objects & object proposals of every
+    "true positive" (in assignment order), the ground-truth indices of the false negatives, the proposal indices of the
+    false positives & of the exempt proposals (in index order), & the cost of each false positive.
+    Format {'tp_rows': <tp gt indices>, 'tp_cols': <tp proposal indices>, 'fn_rows': <fn gt indices>,
+    'fp_cols': <fp proposal indices>, 'exempt_cols': <exempt proposal indices>, 'fp_costs': <fp costs>}
+    """
+    # Calculate the number of TPs, FPs, and FNs for the image (all at once,
+    # keeping the order of the assignments)
+    is_match = _pair_qualities(overall_quality_table, row_idxs, col_idxs) > 0
+    true_positive_idxs = np.flatnonzero(is_match)
+
+    # Handle false negatives
+    false_negative_idxs = row_idxs[~is_match]
+    false_negative_idxs = false_negative_idxs[
+        false_negative_idxs < len(gt_objects)]
+
+    # Handle false positives. Only proposals whose best match is an isgroup
+    # object can be exempt (see _is_isgroup_exempt()), which is quick to check
+    # for all proposals at once
+    isgroup_candidates = np.array(
+        [bool(gt_obj.get('isgroup', False)) for gt_obj in gt_objects],
+        dtype=bool)[_best_gts(overall_quality_table, len(gt_objects))]
+    false_positive_idxs = []
+    isgroup_exempt_idxs = []
+    for col_id in np.sort(col_idxs[~is_match]):
+        if col_id < len(object_proposals):
+            if isgroup_candidates[col_id] and _is_isgroup_exempt(
+                    gt_objects, object_proposals, overall_quality_table,
+                    col_id):
+                # if all criteria met, skip this detection in both fp quality and number of fps
+                isgroup_exempt_idxs.append(col_id)
+                continue
+            false_positive_idxs.append(col_id)
 
     # Calculate the penalty for assigning a high label probability to false positives
-    # NOTE background class is final class in the class list and is not considered
-    # This will be the geometric mean between the maximum label quality and maximum state estimated (ignore same)
-    if scd_mode:
-        with np.errstate(divide='ignore'):
-            tot_fp_cost = np.sum([
-                gmean([
-                    np.max(object_proposals[i]['label_probs'][:-1]),
-                    np.max(object_proposals[i]['state_probs'][:-1])
-                ]) for i in false_positive_idxs
-            ])
+    return {
+        'tp_rows': row_idxs[true_positive_idxs],
+        'tp_cols': col_idxs[true_positive_idxs],
+        'fn_rows': np.array(false_negative_idxs, dtype=np.int64),
+        'fp_cols': np.array(false_positive_idxs, dtype=np.int64),
+        'exempt_cols': np.array(isgroup_exempt_idxs, dtype=np.int64),
+        'fp_costs': _calc_fp_costs(object_proposals, false_positive_idxs,
+                                   scd_mode)
+    }
+
+
+def _calc_quality_tables(cost_tables):
+    """
+    Transform the cost tables of a map (only those generated) back into quality tables. Spatial, label, & state
+    qualities are forced to zero for pairs with zero overall quality, as there is no actual association between the
+    pair (and therefore no TP) when this is the case. Sparse tables already hold only those qualities, so are used as
+    they are.
+    :param cost_tables: dictionary of cost tables (or sparse tables) for the map (see _gen_cost_tables())
+    :return: dictionary of (padded) quality tables indexed by (ground-truth, proposal), or of sparse tables, keyed like
+    the results of _calc_qual_map() ('overall', 'spatial', 'label', & 'state_change')
+    """
+    if sparse.issparse(cost_tables['overall']):
+        return {
+            _QUALITY_TABLE_NAMES[k]: cost_tables[k]
+            for k in _COST_TABLE_KEYS if k in cost_tables
+        }
+    quality_tables = {'overall': 1 - cost_tables['overall']}
+    no_match = quality_tables['overall'] == 0
+    for k in _COST_TABLE_KEYS[1:]:
+        if k in cost_tables:
+            quality_tables[_QUALITY_TABLE_NAMES[k]] = 1 - cost_tables[k]
+            quality_tables[_QUALITY_TABLE_NAMES[k]][no_match] = 0.0
+    return quality_tables
+
+
+def _pair_qualities(quality_table, row_idxs, col_idxs):
+    """
+    Get the qualities of a list of pairs from a quality table, or from a sparse table (where pairs outside the table,
+    i.e. padding, have zero quality).
+    :param quality_table: (padded) quality table indexed by (ground-truth, proposal), or sparse table (see
+    _sparse_tables())
+    :param row_idxs: ground-truth indices of the pairs
+    :param col_idxs: object proposal indices of the pairs
+    :return: numpy array of the quality of each pair
+    """
+    if not sparse.issparse(quality_table):
+        return quality_table[row_idxs, col_idxs]
+    row_idxs, col_idxs = np.asarray(row_idxs), np.asarray(col_idxs)
+    qualities = np.zeros(len(row_idxs), dtype=quality_table.dtype)
+    inside = ((row_idxs < quality_table.shape[0]) &
+              (col_idxs < quality_table.shape[1]))
+    if np.any(inside):
+        qualities[inside] = np.asarray(
+            quality_table[row_idxs[inside], col_idxs[inside]]).ravel()
+    return qualities
+
+
+def _dense_qualities(quality_table, n_gts, n_props):
+    """
+    Get the unpadded g x p quality matrix of a quality table, or of a sparse table
+    :param quality_table: (padded) quality table indexed by (ground-truth, proposal), or sparse table (see
+    _sparse_tables())
+    :param n_gts: number of ground-truth objects g
+    :param n_props: number of object proposals p
+    :return: g x p numpy array of qualities
+    """
+    if sparse.issparse(quality_table):
+        return quality_table.toarray()
+    return quality_table[:n_gts, :n_props]
+
+
+def _best_gts(overall_quality_table, n_gts):
+    """
+    Find the ground-truth object each object proposal has the highest overall quality with (the lowest index of any
+    tied, & 0 for proposals without any non-zero quality), like numpy's argmax.
+    :param overall_quality_table: (padded) overall quality table indexed by (ground-truth, proposal), or the overall
+    sparse table (see _sparse_tables())
+    :param n_gts: number of ground-truth objects g
+    :return: numpy array of the best ground-truth index for each column of the table
+    """
+    if not sparse.issparse(overall_quality_table):
+        return np.argmax(overall_quality_table[:n_gts], axis=0)
+    best = np.zeros(overall_quality_table.shape[1], dtype=np.int64)
+    pairs = overall_quality_table.tocoo()
+    order = np.lexsort((pairs.row, -pairs.data, pairs.col))
+    firsts = order[np.flatnonzero(np.diff(pairs.col[order], prepend=-1))]
+    best[pairs.col[firsts]] = pairs.row[firsts]
+    return best
+
+
+def _calc_map_breakdowns(gt_objects, object_proposals, options, matches,
+                         quality_tables):
+    """
+    Break the totals of a map down by class & by region (if requested in its options), using the assignment already
+    found for the whole map.
+    :param gt_objects: list of ground-truth dicts for the map
+    :param object_proposals: list of object proposal dicts for the map
+    :param options: dictionary of the options the map is evaluated with (see _map_options())
+    :param matches: dictionary of the map's assignment (see _split_assignment())
+    :param quality_tables: dictionary of quality tables for the map (see _calc_quality_tables()). Can be None if there
+    are no "true positives".
+    :return: dictionary with the per-class totals (empty unless 'per_class' is requested, see _calc_per_class_totals()),
+    & if regions are requested, their names & per-region totals (see _calc_per_region_totals()).
+    Format {'per_class': <per_class_totals>, 'regions': <region names>, 'per_region': <per_region_totals>}
+    """
+    components, regions = options['components'], options['regions']
+    breakdowns = {'per_class': {}}
+    if _has_component(components, 'per_class'):
+        gt_labels = np.array([gt_obj['class_id'] for gt_obj in gt_objects],
+                             dtype=np.int64)  # g,
+        num_classes = (_num_classes(object_proposals[0])
+                       if len(object_proposals) > 0 else
+                       (np.max(gt_labels) + 1 if len(gt_labels) > 0 else 0))
+        breakdowns['per_class'] = _calc_per_class_totals(
+            num_classes, gt_labels, matches['tp_rows'], matches['tp_cols'],
+            matches['fn_rows'],
+            _max_class_ids(object_proposals, matches['fp_cols']),
+            matches['fp_costs'], quality_tables)
+    if regions is not None and _has_component(components, 'per_region'):
+        # Regions are attributed from the same assignment as the whole map
+        breakdowns['regions'] = [r['name'] for r in regions]
+        breakdowns['per_region'] = _calc_per_region_totals(
+            regions, gt_objects, object_proposals, matches['tp_rows'],
+            matches['tp_cols'], matches['fn_rows'], matches['fp_cols'],
+            matches['fp_costs'], quality_tables)
+    return breakdowns
+
+
+def _calc_map_outputs(gt_objects,
+                      object_proposals,
+                      options,
+                      matches,
+                      results,
+                      quality_tables=None,
+                      cost_tables=None,
+                      delta=None):
+    """
+    Calculate the outputs of a map requested in its options beyond its scores: its report (see _calc_map_report()),
+    its candidate matches (see _calc_map_candidates()), & its state (see _calc_map_state(), never for maps without
+    ground-truth objects or object proposals).
+    :param gt_objects: list of ground-truth dicts for the map
+    :param object_proposals: list of object proposal dicts for the map
+    :param options: dictionary of the options the map is evaluated with (see _map_options())
+    :param matches: dictionary of the map's assignment (see _split_assignment())
+    :param results: results dictionary of the map's totals (see _calc_qual_map())
+    :param quality_tables: dictionary of quality tables for the map (see _calc_quality_tables()). Can be None if the
+    map has no pairs.
+    :param cost_tables: cost tables for the map (see _gen_cost_tables()). Can be None if the map has no pairs.
+    :param delta: differences from the map's previous state if it was re-evaluated from one (see _diff_map_state())
+    :return: dictionary of the requested outputs.
+    Format {'report': <report columns>, 'candidates': <candidate arrays>, 'state': <state arrays>}
+    """
+    outputs = {}
+    if options['report']:
+        gt_labels = np.array([gt_obj['class_id'] for gt_obj in gt_objects],
+                             dtype=np.int64)  # g,
+        outputs['report'] = _calc_map_report(
+            gt_labels, object_proposals, matches['tp_rows'],
+            matches['tp_cols'], matches['fn_rows'], matches['fp_cols'],
+            matches['fp_costs'], matches['exempt_cols'], quality_tables,
+            (None if not options['attribution'] else _calc_map_attribution(
+                gt_objects, object_proposals, None if quality_tables is None
+                else quality_tables['overall'], results, options['scd_mode'])))
+    if options['candidates'] is not None:
+        outputs['candidates'] = _calc_map_candidates(len(gt_objects),
+                                                     len(object_proposals),
+                                                     quality_tables,
+                                                     options['candidates'])
+    if options['state'] and cost_tables is not None:
+        outputs['state'] = _calc_map_state(gt_objects, object_proposals,
+                                           options['scd_mode'], cost_tables,
+                                           matches['tp_rows'],
+                                           matches['tp_cols'], delta)
+    return outputs
+
+
+def _sweep_qual_map(gt_objects, object_proposals, thresholds, scd_mode):
+    """
+    Calculates the totals for a map at a series of confidence thresholds (see OMQ.sweep_thresholds()).
+    :param gt_objects: list of ground-truth dictionaries describing the ground truth objects in the current map.
+    :param object_proposals: list of object proposal dictionaries describing the object proposals for the current map.
+    :param thresholds: list of confidence thresholds
+    :param scd_mode: flag for whether the map is evaluated for scene change detection
+    :return: dictionary of numpy arrays with the total for each threshold, with the same keys as _calc_qual_map()
+    results (excluding 'assignment_gap' & 'per_class')
+    """
+    n_gts, n_props = len(gt_objects), len(object_proposals)
+    confidences = _calc_fp_costs(object_proposals, range(n_props), False)
+    fp_costs = _calc_fp_costs(object_proposals, range(n_props), scd_mode)
+    if n_gts > 0 and n_props > 0:
+        cost_tables = _gen_cost_tables(gt_objects, object_proposals, scd_mode)
+        quality_tables = {
+            k: 1 - cost_tables[c][:n_gts, :n_props]
+            for k, c in [('overall', 'overall'), ('spatial', 'spatial'),
+                         ('label', 'label'), ('state_change', 'state')]
+        }
     else:
-        tot_fp_cost = np.sum([
-            np.max(object_proposals[i]['label_probs'][:-1])
-            for i in false_positive_idxs
-        ])
+        quality_tables = {
+            k: np.zeros((n_gts, n_props), dtype=np.float32)
+            for k in ['overall', 'spatial', 'label', 'state_change']
+        }
+    exempt = np.array([
+        _is_isgroup_exempt(gt_objects, object_proposals,
+                           quality_tables['overall'], i)
+        for i in range(n_props)
+    ], dtype=bool)
+
+    # Proposals are the rows of the assignment, added in order of descending
+    # confidence as the threshold is lowered
+    solver = IncrementalAssignment(
+        np.where(quality_tables['overall'] > 0, quality_tables['overall'],
+                 0).T)
+    order = np.argsort(-confidences, kind='stable')
+    added = np.zeros(n_props, dtype=bool)
+    num_added = 0
+    totals = {
+        k: np.zeros(len(thresholds))
+        for k in ['overall', 'spatial', 'label', 'fp_cost', 'state_change']
+    }
+    totals.update({
+        k: np.zeros(len(thresholds), dtype=np.int64)
+        for k in ['TP', 'FP', 'FN']
+    })
+    for i in np.argsort(-np.array(thresholds, dtype=np.float64),
+                        kind='stable'):
+        while (num_added < n_props and
+               confidences[order[num_added]] >= thresholds[i]):
+            solver.add(order[num_added])
+            added[order[num_added]] = True
+            num_added += 1
+
+        prop_idxs, gt_idxs = solver.matching()
+        fps = added & ~exempt
+        fps[prop_idxs] = False
+        for k in ['overall', 'spatial', 'label', 'state_change']:
+            totals[k][i] = np.sum(quality_tables[k][gt_idxs, prop_idxs])
+        totals['fp_cost'][i] = np.sum(fp_costs[fps])
+        totals['TP'][i] = len(prop_idxs)
+        totals['FP'][i] = np.sum(fps)
+        totals['FN'][i] = n_gts - len(prop_idxs)
+    if not scd_mode:
+        totals['state_change'][:] = 0.0
+    return totals
+
+
+def _is_isgroup_exempt(gt_objects, object_proposals, overall_quality_table,
+                       prop_idx):
+    """
+    Check if an unassigned object proposal is actually a proposal of an isgroup object that has a better match, in
+    which case it is not counted as a false positive.
+    Only exempt if the best match otherwise would be an isgroup object (non-zero quality), the max class matches, and at
+    least 50% of the proposal is within the ground-truth object.
+    :param gt_objects: list of ground-truth object dicts for the map
+    :param object_proposals: list of object proposal dicts for the map
+    :param overall_quality_table: overall quality table indexed by (ground-truth, proposal), or the overall sparse table
+    (see _sparse_tables())
+    :param prop_idx: index of the unassigned object proposal
+    :return: True if the object proposal is exempt from being a false positive
+    """
+    qualities = (overall_quality_table[:, prop_idx].toarray().ravel()
+                 if sparse.issparse(overall_quality_table) else
+                 overall_quality_table[:len(gt_objects), prop_idx])
+    if np.sum(qualities) > 0:
+        # check if max match class is a grouped object
+        best_gt_idx = np.argmax(qualities)
+        if 'isgroup' in gt_objects[best_gt_idx] and gt_objects[best_gt_idx]['isgroup']:
+            # check if the class of the proposal matches the class of the object
+            # (ignoring final class which should be background)
+            if _max_labels(object_proposals, [prop_idx])[1][0] == gt_objects[best_gt_idx]['class_id']:
+                # Check if at least 50% of the proposal is within the ground-truth object
+                return _IOU_TOOL.dict_prop_fraction(
+                    object_proposals[prop_idx], gt_objects[best_gt_idx]) >= 0.5
+    return False
+
+
+def _calc_fp_costs(object_proposals, idxs, scd_mode):
+    """
+    Calculate the penalty for assigning a high label probability to false positives.
+    NOTE background class is final class in the class list and is not considered
+    In SCD this will be the geometric mean between the maximum label quality and maximum state estimated (ignore same)
+    :param object_proposals: list of object proposal dicts for the map
+    :param idxs: indices of the false positive object proposals
+    :param scd_mode: flag for whether the map is evaluated for scene change detection
+    :return: numpy array of the cost of each false positive
+    """
+    if len(idxs) == 0:
+        return np.zeros(0)
+    label_costs = _max_labels(object_proposals, idxs)[0]
+    if not scd_mode:
+        return label_costs
+    state_costs = np.max(object_array(object_proposals, 'state_probs',
+                                      idxs)[:, :-1],
+                         axis=1)
+    with np.errstate(divide='ignore'):
+        return _gmean(np.stack((label_costs, state_costs), axis=1), axis=1)
+
+
+def _assignment_sparse(overall_table, n_gts, n_props, time_budget):
+    """
+    Assign ground-truth objects to object proposals considering only the sparse set of pairs with non-zero overall
+    quality (approximately if the time budget is exceeded).
+    :param overall_table: overall sparse table of the map's pairs with non-zero overall quality (see _sparse_tables())
+    :param n_gts: number of ground-truth objects g
+    :param n_props: number of object proposals p
+    :param time_budget: time in seconds allowed for the assignment (None for no limit)
+    :return: (row_idxs, col_idxs, gap). A full assignment of the padded n x n table, where n = max(g, p) (like
+    linear_sum_assignment()), and an upper bound on the total overall quality lost compared to the optimal assignment.
+    """
+    rows, cols, gap = sparse_assignment(overall_table, time_budget=time_budget)
+    rows, cols = pad_assignment(rows, cols, max(n_gts, n_props))
+    return rows, cols, gap
+
+
+def _map_state_key(gt_objects, scd_mode, batched, assignment):
+    """
+    Create the key the state of a map is stored with. States can be reused by any map with the same ground truth that
+    is evaluated the same way, whatever its object proposals.
+    :param gt_objects: list of ground-truth dicts for the map
+    :param scd_mode: flag for whether the map is evaluated for scene change detection
+    :param batched: flag for whether qualities are calculated in a batch (which can change spatial qualities by
+    floating point rounding)
+    :param assignment: assignment backend used for the map
+    :return: key string (see cache.content_hash())
+    """
+    return content_hash('map_state', gt_objects, scd_mode, batched, assignment)
+
+
+def _prop_hashes(object_proposals):
+    """
+    Hash the content of every object proposal, so changed proposals can be found between evaluations
+    :param object_proposals: list of object proposal dicts
+    :return: p, numpy array of hash strings
+    """
+    return np.array([content_hash(o) for o in object_proposals],
+                    dtype=np.str_)
 
+
+def _diff_map_state(object_proposals, state):
+    """
+    Find which object proposals of a map are unchanged from the map's previous state. Proposals are only reused when
+    their content is unique in both the previous & current proposals, so every reused proposal has exactly one previous
+    counterpart (any duplicates are treated as new proposals).
+    :param object_proposals: list of object proposal dicts for the map
+    :param state: previous state of the map (see _calc_map_state())
+    :return: dictionary describing the differences, with the hash of each proposal, the index of each proposal's
+    previous counterpart (-1 for new proposals), & a flag for each new proposal.
+    Format {'hashes': <p hashes>, 'previous': <p previous indices>, 'new_props': <p flags>, 'state': <state>}
+    """
+    hashes = _prop_hashes(object_proposals)
+    previous_idxs = {}
+    for i, h in enumerate(state['prop_hashes'].tolist()):
+        previous_idxs[h] = -1 if h in previous_idxs else i
+    unique, counts = np.unique(hashes, return_counts=True)
+    duplicates = set(unique[counts > 1].tolist())
+    previous = np.array([
+        -1 if h in duplicates else previous_idxs.get(h, -1)
+        for h in hashes.tolist()
+    ],
+                        dtype=np.int64)
     return {
-        'overall': tot_overall_img_quality,
-        'spatial': tot_tp_spatial_quality,
-        'label': tot_tp_label_quality,
-        'fp_cost': tot_fp_cost,
-        'TP': true_positives,
-        'FP': false_positives,
-        'FN': false_negatives,
-        'state_change': tot_tp_state_change_quality
+        'hashes': hashes,
+        'previous': previous,
+        'new_props': previous < 0,
+        'state': state
+    }
+
+
+def _merge_map_state(gt_objects,
+                     object_proposals,
+                     scd_mode,
+                     delta,
+                     new_cost_tables,
+                     tables=None,
+                     sparse_tables=False):
+    """
+    Build the cost tables of a map from the qualities stored in its previous state for unchanged object proposals, &
+    newly calculated qualities for new proposals. The differences are updated with everything needed to re-solve the
+    assignment (see _assignment_delta()): the previous matches & the ground-truth objects that lost a candidate
+    match, along with the number of skipped pairs of each proposal.
+    :param gt_objects: list of all ground-truth object dicts for a given map.
+    :param object_proposals: list of all object proposal dicts for a given map.
+    :param scd_mode: flag for whether the map is evaluated for scene change detection
+    :param delta: differences from the previous state (see _diff_map_state())
+    :param new_cost_tables: cost tables (or sparse tables) for the ground-truth objects & only the new proposals (see
+    _gen_cost_tables(); None if there are no new proposals)
+    :param tables: list of the cost tables to generate (None for all of them, see _component_tables())
+    :param sparse_tables: flag for whether the map has sparse tables (see _sparse_tables()) rather than cost tables
+    :return: dictionary of cost tables (or sparse tables) in the same format as _gen_cost_tables()
+    """
+    g = len(gt_objects)
+    state = delta['state']
+    previous = delta['previous']
+    kept = np.flatnonzero(previous >= 0)
+    new = np.flatnonzero(previous < 0)
+    current_idxs = np.full(len(state['prop_hashes']), -1, dtype=np.int64)
+    current_idxs[previous[kept]] = kept
+
+    # Copy the stored pairs of unchanged proposals, & the calculated pairs of
+    # new proposals (every other pair has zero overall quality)
+    rows, cols = state['rows'], current_idxs[state['cols']]
+    is_kept = cols >= 0
+    if sparse_tables:
+        tile_pairs = [(rows[is_kept], cols[is_kept], {
+            k: state[k][is_kept] for k in _COST_TABLE_KEYS if k in state
+        }, 0)]
+        if new_cost_tables is not None:
+            new_pairs = new_cost_tables['overall'].tocoo()
+            tile_pairs.append((new_pairs.row, new[new_pairs.col], {
+                k: _pair_qualities(new_cost_tables[k], new_pairs.row,
+                                   new_pairs.col)
+                for k in _COST_TABLE_KEYS if k in new_cost_tables
+            }, 0))
+        cost_tables = _sparse_tables(g, len(object_proposals), tile_pairs,
+                                     tables)
+    else:
+        cost_tables = _init_cost_tables(gt_objects, object_proposals, tables)
+        for k in _COST_TABLE_KEYS:
+            if k in cost_tables:
+                cost_tables[k][rows[is_kept],
+                               cols[is_kept]] = state[k][is_kept]
+                if new_cost_tables is not None:
+                    cost_tables[k][:g, new] = new_cost_tables[k][:g, :len(new)]
+
+    delta['skipped'] = np.zeros(len(object_proposals), dtype=np.int64)
+    delta['skipped'][kept] = state['skipped'][previous[kept]]
+    if len(new) > 0:
+        delta['skipped'][new] = _calc_skipped_props(
+            gt_objects, select_objects(object_proposals, new), scd_mode)
+    cost_tables['skipped_pairs'] = int(np.sum(delta['skipped']))
+    delta['changed_gts'] = np.zeros(g, dtype=bool)
+    delta['changed_gts'][rows[~is_kept]] = True
+    delta['matches'] = np.where(state['matches'] >= 0,
+                                current_idxs[state['matches']], -1)
+    return cost_tables
+
+
+def _calc_skipped_props(gt_objects, object_proposals, scd_mode):
+    """
+    Count the pairs of each object proposal whose spatial quality is skipped (see _calc_quality_mask())
+    :param gt_objects: list of all ground-truth object dicts for a given map.
+    :param object_proposals: list of all object proposal dicts for a given map.
+    :param scd_mode: flag for whether the map is evaluated for scene change detection
+    :return: p, numpy array of the number of skipped pairs of each proposal
+    """
+    _, gt_labels, gt_state_ids = _vectorize_map_gts(gt_objects, scd_mode)
+    _, prop_class_probs, prop_state_probs = _vectorize_map_props(
+        object_proposals, scd_mode)
+
+    # Label & state qualities only depend on the class & state of each
+    # ground-truth object, so each distinct class & state only needs checking
+    # once
+    gt_kinds, counts = np.unique(np.stack(
+        (gt_labels, np.array(gt_state_ids, dtype=np.int64)), axis=1),
+                                 axis=0,
+                                 return_counts=True)
+    mask = _calc_quality_mask(
+        _calc_label_qual(gt_kinds[:, 0], prop_class_probs),
+        _calc_state_change_qual(gt_kinds[:, 1], prop_state_probs))
+    return counts @ ~mask
+
+
+def _calc_map_state(gt_objects, object_proposals, scd_mode, cost_tables,
+                    tp_rows, tp_cols, delta=None):
+    """
+    Calculate the state of an evaluated map, holding everything needed to re-evaluate it after only some of its object
+    proposals change: the hash of each proposal, every pair with a non-zero overall quality (& its costs), the number of
+    skipped pairs of each proposal, & the proposal matched to each ground-truth object.
+    :param gt_objects: list of all ground-truth object dicts for a given map.
+    :param object_proposals: list of all object proposal dicts for a given map.
+    :param scd_mode: flag for whether the map is evaluated for scene change detection
+    :param cost_tables: cost tables (or sparse tables) for the map (see _gen_cost_tables())
+    :param tp_rows: ground-truth indices of the matched pairs
+    :param tp_cols: object proposal indices of the matched pairs
+    :param delta: differences from the map's previous state if it was re-evaluated from one (see _diff_map_state())
+    :return: dictionary of the map's state arrays, holding the costs of each pair (or their qualities, for sparse
+    tables).
+    Format {'prop_hashes': <p hashes>, 'rows': <n gt indices>, 'cols': <n proposal indices>, 'overall': <n costs>,
+    ..., 'skipped': <p skipped pair counts>, 'matches': <g matched proposal indices, -1 if unmatched>}
+    """
+    g, p = len(gt_objects), len(object_proposals)
+    is_sparse = sparse.issparse(cost_tables['overall'])
+    if is_sparse:
+        pairs = cost_tables['overall'].tocoo()
+        rows, cols = pairs.row, pairs.col
+    else:
+        rows, cols = np.nonzero(cost_tables['overall'][:g, :p] < 1)
+    state = {
+        'prop_hashes':
+            _prop_hashes(object_proposals) if delta is None else delta['hashes'],
+        'rows':
+            rows.astype(np.int64),
+        'cols':
+            cols.astype(np.int64)
+    }
+    for k in _COST_TABLE_KEYS:
+        if k in cost_tables:
+            state[k] = (_pair_qualities(cost_tables[k], rows, cols)
+                        if is_sparse else cost_tables[k][rows, cols])
+    state['skipped'] = (_calc_skipped_props(gt_objects, object_proposals,
+                                            scd_mode)
+                        if delta is None else delta['skipped'])
+    state['matches'] = np.full(g, -1, dtype=np.int64)
+    state['matches'][tp_rows] = tp_cols
+    return state
+
+
+def _assignment_delta(overall_table, n_gts, n_props, delta):
+    """
+    Re-solve the sparse assignment of a map after only some of its object proposals changed (see _assignment_sparse()).
+    The assignment of each connected group of objects (linked by pairs with non-zero quality) is independent of every
+    other group, & the sparse assignment adds rows in order, so groups that are unchanged from the previous state
+    (with no new proposals, no ground-truth objects that lost a candidate, & proposals in the same order) keep their
+    previous matches exactly. Only the remaining groups are re-solved, giving the same assignment as a full solve.
+    :param overall_table: overall sparse table of the map's pairs with non-zero overall quality (see _sparse_tables())
+    :param n_gts: number of ground-truth objects g
+    :param n_props: number of object proposals p
+    :param delta: differences from the previous state, merged with its sparse tables (see _merge_map_state())
+    :return: (row_idxs, col_idxs), a full assignment of the padded n x n table, where n = max(g, p) (like
+    linear_sum_assignment())
+    """
+    quality = overall_table.tocsr()
+    _, labels = csgraph.connected_components(sparse.bmat([[None, quality],
+                                                          [quality.T, None]]),
+                                             directed=False)
+    gt_groups, prop_groups = labels[:n_gts], labels[n_gts:]
+
+    # Find the groups changed since the previous state
+    changed = np.zeros(np.max(labels) + 1, dtype=bool)
+    changed[prop_groups[delta['new_props']]] = True
+    changed[gt_groups[delta['changed_gts']]] = True
+    previous = delta['previous']
+    kept = np.flatnonzero(previous >= 0)
+    kept = kept[np.argsort(prop_groups[kept], kind='stable')]
+    reordered = ((prop_groups[kept[1:]] == prop_groups[kept[:-1]]) &
+                 (previous[kept[1:]] < previous[kept[:-1]]))
+    changed[prop_groups[kept[1:]][reordered]] = True
+
+    # Re-solve the changed groups together, & keep the previous matches of
+    # all others
+    rows = np.flatnonzero(changed[gt_groups])
+    cols = np.flatnonzero(changed[prop_groups])
+    sub_rows, sub_cols, _ = sparse_assignment(quality[rows][:, cols])
+    unchanged = np.flatnonzero(~changed[gt_groups] & (delta['matches'] >= 0))
+    return pad_assignment(
+        np.concatenate((rows[sub_rows], unchanged)),
+        np.concatenate((cols[sub_cols], delta['matches'][unchanged])),
+        max(n_gts, n_props))
+
+
+def _max_class_ids(object_proposals, idxs):
+    """
+    Get the most likely (non-background) class for a set of object proposals.
+    :param object_proposals: list of object proposal dicts for a given map.
+    :param idxs: indices of the object proposals to be queried
+    :return: numpy array of the most likely class id for each queried object proposal
+    """
+    return _max_labels(object_proposals, idxs)[1]
+
+
+def _max_labels(object_proposals, idxs):
+    """
+    Get the largest (non-background) label probability, & its class, for a set of object proposals. Ties go to the
+    lowest class id, & proposals with no non-zero probability have a class id of 0.
+    NOTE background class is the final class in dense distributions which is ignored (sparse distributions never hold
+    the background class)
+    :param object_proposals: list of object proposal dicts for a given map.
+    :param idxs: indices of the object proposals to be queried
+    :return: (probs, class_ids) numpy arrays, with the probability & class for each queried object proposal
+    """
+    if isinstance(object_proposals, ObjectArrays):
+        return _max_labels_matrix(
+            object_proposals.label_probs[np.asarray(idxs, dtype=np.int64)])
+    idxs = list(idxs)
+    is_dense = np.array(
+        [not isinstance(object_proposals[i]['label_probs'], dict) for i in idxs],
+        dtype=bool)
+    probs = np.zeros(len(idxs))
+    class_ids = np.zeros(len(idxs), dtype=np.int64)
+    if np.any(is_dense):
+        label_probs = np.array([
+            object_proposals[i]['label_probs']
+            for i, d in zip(idxs, is_dense)
+            if d
+        ])[:, :-1]
+        probs[is_dense] = np.max(label_probs, axis=1)
+        class_ids[is_dense] = np.argmax(label_probs, axis=1)
+    for k in np.flatnonzero(~is_dense):
+        label_probs = object_proposals[idxs[k]]['label_probs']
+        if label_probs:
+            c = min(label_probs, key=lambda c: (-label_probs[c], c))
+            if label_probs[c] > 0:
+                probs[k], class_ids[k] = label_probs[c], c
+    return probs, class_ids
+
+
+def _max_labels_matrix(label_probs):
+    """
+    Get the largest (non-background) label probability, & its class, for each row of a label probability matrix, in
+    the same way as _max_labels()
+    :param label_probs: n x c numpy array (background class last), or scipy sparse matrix (without the background class)
+    of label probabilities (see _label_prob_matrix())
+    :return: (probs, class_ids) numpy arrays, with the probability & class for each row
+    """
+    probs = np.zeros(label_probs.shape[0])
+    class_ids = np.zeros(label_probs.shape[0], dtype=np.int64)
+    if label_probs.shape[0] == 0:
+        return probs, class_ids
+    elif not sparse.issparse(label_probs):
+        return (np.max(label_probs[:, :-1], axis=1),
+                np.argmax(label_probs[:, :-1], axis=1))
+
+    # Sort each row's probabilities from largest to smallest (ties by class
+    # id), & keep the first of each row that has a non-zero probability
+    label_probs = sparse.csr_matrix(label_probs)
+    rows = np.repeat(np.arange(label_probs.shape[0]),
+                     np.diff(label_probs.indptr))
+    order = np.lexsort((label_probs.indices, -label_probs.data, rows))
+    first = order[np.flatnonzero(np.diff(rows[order], prepend=-1))]
+    first = first[label_probs.data[first] > 0]
+    probs[rows[first]] = label_probs.data[first]
+    class_ids[rows[first]] = label_probs.indices[first]
+    return probs, class_ids
+
+
+def _num_classes(object_proposal):
+    # Number of classes in a proposal's label distribution (sparse
+    # distributions only know their largest class)
+    label_probs = object_proposal['label_probs']
+    if isinstance(label_probs, dict):
+        return max(label_probs, default=-1) + 1
+    return len(label_probs)
+
+
+def _calc_per_class_totals(num_classes, gt_labels, tp_rows, tp_cols, fn_rows,
+                           fp_labels, fp_costs, quality_tables):
+    """
+    Reduce the assignment for a map into totals per class (totals are the same as those returned by
+    _calc_qual_map(), just split by class).
+    :param num_classes: number of classes c in the label probability distributions
+    :param gt_labels: g, numpy array of class labels as an integer for each of the g ground-truth objects
+    :param tp_rows: ground-truth indices of all "true positive" assignments
+    :param tp_cols: object proposal indices of all "true positive" assignments
+    :param fn_rows: ground-truth indices of all false negatives
+    :param fp_labels: most likely (non-background) class of each false positive
+    :param fp_costs: cost of each false positive
+    :param quality_tables: dictionary of quality tables indexed by (ground-truth, proposal), with the same keys as the
+    returned results. Can be None if there are no "true positives".
+    :return: dictionary of c length numpy arrays with the same keys as the _calc_qual_map() results
+    """
+    # Every total is sized to fit all of the classes seen (sparse
+    # distributions don't know how many classes there are)
+    tp_labels = gt_labels[tp_rows]
+    num_classes = max([num_classes] +
+                      [np.max(l) + 1 for l in [gt_labels, fp_labels]
+                       if len(l) > 0])
+    per_class = {
+        'TP': np.bincount(tp_labels, minlength=num_classes),
+        'FP': np.bincount(fp_labels, minlength=num_classes),
+        'FN': np.bincount(gt_labels[fn_rows], minlength=num_classes),
+        'fp_cost': np.bincount(fp_labels, weights=fp_costs,
+                               minlength=num_classes)
+    }
+    for k in ['overall', 'spatial', 'label', 'state_change']:
+        per_class[k] = (np.zeros(num_classes) if quality_tables is None else
+                        np.bincount(tp_labels,
+                                    weights=_pair_qualities(
+                                        quality_tables[k], tp_rows, tp_cols),
+                                    minlength=num_classes))
+    return per_class
+
+
+def _check_regions(regions):
+    """
+    Ensure a list of regions is valid (see OMQ's regions), raising a ValueError if not
+    :param regions: list of region dicts (or None)
+    :return: None
+    """
+    if regions is None:
+        return
+    names = set()
+    for r in regions:
+        if 'name' not in r:
+            raise ValueError("Region %s has no 'name'" % r)
+        elif r['name'] in names:
+            raise ValueError("Region name '%s' is used more than once" %
+                             r['name'])
+        elif 'polygon' in r:
+            if len(r['polygon']) < 3 or any(len(v) != 2 for v in r['polygon']):
+                raise ValueError(
+                    "Region '%s' polygon must have at least 3 [x, y] vertices" %
+                    r['name'])
+        elif 'centroid' not in r or 'extent' not in r:
+            raise ValueError(
+                "Region '%s' needs either a 'polygon', or a 'centroid' & "
+                "'extent'" % r['name'])
+        names.add(r['name'])
+
+
+def _region_membership(centroids, regions):
+    """
+    Find which regions contain each of a set of points, with a vectorised point-in-region test for each region (inside
+    the cuboid of an axis-aligned volume, or inside a polygon by even-odd ray casting on the ground plane). Points on the
+    boundary of a volume are inside it.
+    :param centroids: n x 3 numpy array of points
+    :param regions: list of r region dicts (see OMQ's regions)
+    :return: n x r boolean numpy array, True where a point is inside a region
+    """
+    centroids = np.asarray(centroids, dtype=np.float64).reshape(-1, 3)
+    inside = np.zeros((len(centroids), len(regions)), dtype=bool)
+    x, y = centroids[:, 0, np.newaxis], centroids[:, 1, np.newaxis]
+    z = centroids[:, 2]
+    for i, r in enumerate(regions):
+        if 'polygon' not in r:
+            inside[:, i] = np.all(np.abs(centroids - r['centroid']) <=
+                                  np.asarray(r['extent']) / 2,
+                                  axis=1)
+            continue
+
+        # Count the polygon edges crossed by a ray from each point along +x
+        x1, y1 = np.asarray(r['polygon'], dtype=np.float64).T
+        x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+        straddles = (y1 > y) != (y2 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing_x = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        inside[:, i] = np.count_nonzero(straddles & (x < crossing_x),
+                                        axis=1) % 2 == 1
+        if 'height_range' in r:
+            inside[:, i] &= ((z >= r['height_range'][0]) &
+                             (z <= r['height_range'][1]))
+    return inside
+
+
+def _region_totals(membership, values=None):
+    """
+    Sum values over the regions containing them, with a single segment reduction over every (object, region) pair
+    :param membership: n x r boolean numpy array of the regions containing each object (see _region_membership())
+    :param values: n, numpy array of values for each object (None to count the objects)
+    :return: r length numpy array of totals for each region
+    """
+    objs, regs = np.nonzero(membership)
+    return np.bincount(regs,
+                       weights=None if values is None else values[objs],
+                       minlength=membership.shape[1])
+
+
+def _calc_per_region_totals(regions, gt_objects, object_proposals, tp_rows,
+                            tp_cols, fn_rows, fp_cols, fp_costs,
+                            quality_tables):
+    """
+    Reduce the assignment for a map into totals per region (totals are the same as those returned by _calc_qual_map(),
+    just split by region). "True positives" & false negatives are attributed to every region containing the centroid of
+    their ground-truth object, & false positives to every region containing the centroid of their object proposal, so
+    totals only add up to the map's totals if every object is in exactly one region.
+    :param regions: list of r region dicts (see OMQ's regions)
+    :param gt_objects: list of ground-truth dicts for the map
+    :param object_proposals: list of object proposal dicts for the map
+    :param tp_rows: ground-truth indices of all "true positive" assignments
+    :param tp_cols: object proposal indices of all "true positive" assignments
+    :param fn_rows: ground-truth indices of all false negatives
+    :param fp_cols: object proposal indices of all false positives
+    :param fp_costs: cost of each false positive
+    :param quality_tables: dictionary of quality tables indexed by (ground-truth, proposal), with the same keys as the
+    returned results. Can be None if there are no "true positives".
+    :return: dictionary of r length numpy arrays with the same keys as the _calc_qual_map() results
+    """
+    gt_regions = _region_membership(
+        [o['centroid'] for o in gt_objects], regions)
+    fp_regions = _region_membership(
+        object_array(object_proposals, 'centroid', fp_cols), regions)
+    per_region = {
+        'TP': _region_totals(gt_regions[tp_rows]),
+        'FP': _region_totals(fp_regions),
+        'FN': _region_totals(gt_regions[fn_rows]),
+        'fp_cost': _region_totals(fp_regions, np.asarray(fp_costs,
+                                                         dtype=np.float64))
     }
+    for k in ['overall', 'spatial', 'label', 'state_change']:
+        per_region[k] = (np.zeros(len(regions)) if quality_tables is None else
+                         _region_totals(
+                             gt_regions[tp_rows],
+                             _pair_qualities(quality_tables[k], tp_rows,
+                                             tp_cols)))
+    return per_region
+
+
+def _calc_map_report(gt_labels,
+                     object_proposals,
+                     tp_rows,
+                     tp_cols,
+                     fn_rows,
+                     fp_cols,
+                     fp_costs,
+                     exempt_cols,
+                     quality_tables,
+                     attribution=None):
+    """
+    Lay out every "true positive" match, false positive, & false negative for a map as columns of a report (see
+    report.REPORT_COLUMNS). Rows are ordered as all "true positives", then false negatives, false positives, & finally
+    the proposals exempted from being false positives by an isgroup ground-truth object.
+    :param gt_labels: g, numpy array of class labels as an integer for each of the g ground-truth objects
+    :param object_proposals: list of object proposal dicts for the map
+    :param tp_rows: ground-truth indices of all "true positive" assignments
+    :param tp_cols: object proposal indices of all "true positive" assignments
+    :param fn_rows: ground-truth indices of all false negatives
+    :param fp_cols: object proposal indices of all false positives
+    :param fp_costs: cost of each false positive
+    :param exempt_cols: object proposal indices of all proposals exempted from being false positives
+    :param quality_tables: dictionary of quality tables indexed by (ground-truth, proposal). Can be None if there are
+    no "true positives".
+    :param attribution: leave-one-out contributions of the map's objects, as returned by _calc_map_attribution() (None
+    for no attribution columns)
+    :return: dictionary of equal length numpy arrays, one for each report column (except 'source' & 'map'), including
+    the report.ATTRIBUTION_COLUMNS if attribution is given (NaN for rows without that object)
+    """
+    n_tp, n_fn, n_fp, n_ex = len(tp_rows), len(fn_rows), len(fp_cols), len(
+        exempt_cols)
+    none = lambda n: np.full(n, -1, dtype=np.int64)
+    gt_idxs = np.concatenate((tp_rows, fn_rows, none(n_fp + n_ex)))
+    prop_idxs = np.concatenate((tp_cols, none(n_fn), fp_cols, exempt_cols))
+    has_prop = prop_idxs >= 0
+    map_report = {
+        'type':
+            np.repeat(np.array(['TP', 'FN', 'FP', 'FP']),
+                      [n_tp, n_fn, n_fp, n_ex]),
+        'gt_idx':
+            gt_idxs,
+        'prop_idx':
+            prop_idxs,
+        'gt_class':
+            np.where(gt_idxs >= 0, gt_labels[np.maximum(gt_idxs, 0)]
+                     if len(gt_labels) > 0 else -1, -1),
+        'prop_class':
+            none(len(prop_idxs)),
+        'fp_cost':
+            np.concatenate((np.zeros(n_tp + n_fn), fp_costs, np.zeros(n_ex))),
+        'isgroup_exempt':
+            np.concatenate((np.zeros(n_tp + n_fn + n_fp,
+                                     dtype=np.int64), np.ones(n_ex,
+                                                              dtype=np.int64)))
+    }
+    map_report['prop_class'][has_prop] = _max_class_ids(
+        object_proposals, prop_idxs[has_prop])
+    for k in ['overall', 'spatial', 'label', 'state_change']:
+        map_report[k] = np.zeros(len(gt_idxs))
+        if quality_tables is not None:
+            map_report[k][:n_tp] = _pair_qualities(quality_tables[k],
+                                                   tp_rows, tp_cols)
+    if attribution is not None:
+        for k, v in attribution.items():
+            idxs = gt_idxs if k.startswith('gt_') else prop_idxs
+            map_report[k] = np.full(len(idxs), np.nan)
+            map_report[k][idxs >= 0] = v[idxs[idxs >= 0]]
+    return map_report
+
+
+def _calc_map_attribution(gt_objects, object_proposals, overall_quality_table,
+                          results, scd_mode):
+    """
+    Find the leave-one-out contribution of every ground-truth object & object proposal of a map: how the map's total
+    overall quality, total FP cost, & OMQ would change if that object alone was removed & the map re-assigned.
+    Starting from an optimal assignment (& its dual potentials, see IncrementalAssignment), removing an assigned object
+    only needs its partner re-inserted along a single augmenting path, which is limited to the connected component
+    (of pairs with non-zero quality) containing it. Removing an unassigned object never changes the assignment.
+    NOTE contributions assume the map was assigned optimally. With exactly tied assignments they are relative to one of
+    the optimal assignments, which may not be the one scored.
+    :param gt_objects: list of ground-truth object dicts for the map
+    :param object_proposals: list of object proposal dicts for the map
+    :param overall_quality_table: (padded) overall quality table indexed by (ground-truth, proposal). Can be None if
+    the map has no pairs.
+    :param results: results dictionary of the map's totals (see _calc_qual_map())
+    :param scd_mode: flag for whether the map is evaluated for scene change detection
+    :return: dictionary of g & p length numpy arrays, one for each of report.ATTRIBUTION_COLUMNS
+    """
+    n_gts, n_props = len(gt_objects), len(object_proposals)
+    quality = (np.zeros((n_gts, n_props))
+               if overall_quality_table is None else _dense_qualities(
+                   overall_quality_table, n_gts, n_props))
+    quality = np.where(quality > 0, quality, 0)
+    # NOTE maps without ground-truth objects only have label FP costs (see
+    # _calc_qual_map()), including once their last ground-truth is removed
+    fp_costs = _calc_fp_costs(object_proposals, range(n_props), scd_mode and
+                              n_gts > 0)
+    is_group = np.array(
+        [bool(gt_obj.get('isgroup', False)) for gt_obj in gt_objects],
+        dtype=bool)
+    best_gts = (np.argmax(quality, axis=0)
+                if n_gts > 0 else np.zeros(n_props, dtype=np.int64))
+    has_best = np.any(quality > 0, axis=0)
+
+    def exempt(prop_idx):
+        return bool(has_best[prop_idx] and is_group[best_gts[prop_idx]] and
+                    _is_isgroup_exempt(gt_objects, object_proposals, quality,
+                                       prop_idx))
+
+    exempts = np.array([exempt(j) for j in range(n_props)], dtype=bool)
+
+    # Solve the map in both orientations, so either kind of object's partner
+    # can be re-inserted as a row
+    by_gt, by_prop = (IncrementalAssignment(quality),
+                      IncrementalAssignment(quality.T))
+    for solver in [by_gt, by_prop]:
+        for row in range(solver.quality.shape[0]):
+            solver.add(row)
+
+    # Removing a proposal: its ground-truth object (if any) is re-inserted,
+    # either matching a previously unassigned proposal or becoming a FN
+    deltas = {
+        k: np.zeros(n) for k, n in [('overall', n_props), ('fp_cost', n_props),
+                                    ('TP', n_props), ('FN', n_props)]
+    }
+    for j in range(n_props):
+        i = by_gt.col_match[j]
+        if i < 0:
+            deltas['fp_cost'][j] = 0.0 if exempts[j] else -fp_costs[j]
+            continue
+        gain, end_gt, end_prop = by_gt.reinsertion(i)
+        deltas['overall'][j] = gain - quality[i, j]
+        if end_prop >= 0:
+            deltas['fp_cost'][j] = 0.0 if exempts[end_prop] else -fp_costs[
+                end_prop]
+        else:
+            deltas['TP'][j] = -1
+            deltas['FN'][j] = 1
+    attribution = _attribution_columns('prop', deltas, results)
+
+    # Removing a ground-truth object: its proposal (if any) is re-inserted,
+    # either matching a FN or becoming unassigned. Unassigned proposals whose
+    # best match was the removed object may also gain or lose an exemption.
+    deltas = {
+        k: np.zeros(n_gts) for k in ['overall', 'fp_cost', 'TP', 'FN']
+    }
+    unassigned = by_prop.row_match < 0
+    affected = _group_by_index(best_gts[unassigned & has_best],
+                               np.flatnonzero(unassigned & has_best), n_gts)
+    for i in range(n_gts):
+        if n_gts == 1:
+            deltas['fp_cost'][i] = np.sum(
+                _calc_fp_costs(object_proposals, range(n_props),
+                               False)) - results['fp_cost']
+            for k in ['overall', 'TP', 'FN']:
+                deltas[k][i] = -results[k]
+            continue
+        j = by_prop.col_match[i]
+        changed = set(affected[i])
+        newly_unassigned = -1
+        if j < 0:
+            deltas['FN'][i] = -1
+        else:
+            gain, newly_unassigned, end_gt = by_prop.reinsertion(j)
+            deltas['overall'][i] = gain - quality[i, j]
+            if end_gt >= 0:
+                deltas['FN'][i] = -1
+            else:
+                deltas['TP'][i] = -1
+                changed.add(newly_unassigned)
+        if not changed:
+            continue
+        row = quality[i].copy()
+        quality[i] = 0.0
+        best_gts[list(changed)] = np.argmax(quality[:, list(changed)], axis=0)
+        has_best[list(changed)] = np.any(quality[:, list(changed)] > 0, axis=0)
+        for x in changed:
+            was_fp = unassigned[x] and not exempts[x]
+            is_fp = (unassigned[x] or x == newly_unassigned) and not exempt(x)
+            deltas['fp_cost'][i] += fp_costs[x] * (int(is_fp) - int(was_fp))
+        quality[i] = row
+        best_gts[list(changed)] = np.argmax(quality[:, list(changed)], axis=0)
+        has_best[list(changed)] = np.any(quality[:, list(changed)] > 0, axis=0)
+    attribution.update(_attribution_columns('gt', deltas, results))
+    return attribution
+
+
+def _attribution_columns(prefix, deltas, results):
+    # Report columns for the leave-one-out changes of one kind of object, with
+    # the change in OMQ found from the change in each total
+    def omq(overall, tps, fns, fp_cost):
+        denominator = np.asarray(tps + fns + fp_cost, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(denominator > 0, overall / denominator, 0.0)
+
+    base = omq(results['overall'], results['TP'], results['FN'],
+               results['fp_cost'])
+    return {
+        prefix + '_delta_overall':
+            deltas['overall'],
+        prefix + '_delta_fp_cost':
+            deltas['fp_cost'],
+        prefix + '_delta_omq':
+            omq(results['overall'] + deltas['overall'],
+                results['TP'] + deltas['TP'], results['FN'] + deltas['FN'],
+                results['fp_cost'] + deltas['fp_cost']) - base
+    }
+
+
+def _group_by_index(keys, values, num_keys):
+    # Values grouped by their (integer) key, in their original order
+    order = np.argsort(keys, kind='stable')
+    return np.split(values[order],
+                    np.searchsorted(keys[order], np.arange(1, num_keys)))
+
+
+def _calc_map_candidates(n_gts, n_props, quality_tables, k):
+    """
+    Find the k best candidate matches (by overall quality) for every ground-truth object & object proposal of a map, as
+    arrays for a candidate report (see report.CANDIDATE_ARRAYS). Only pairs with non-zero overall quality are
+    candidates.
+    :param n_gts: number of ground-truth objects g
+    :param n_props: number of object proposals p
+    :param quality_tables: dictionary of (padded) quality tables indexed by (ground-truth, proposal), with the spatial,
+    label, & state qualities of pairs with zero overall quality already zeroed. Can be None if the map has no pairs, &
+    tables that weren't generated are treated as all zero.
+    :param k: number of candidates found for each object
+    :return: dictionary of g x k & p x k numpy arrays, one for each of report.CANDIDATE_ARRAYS
+    """
+    candidates = {}
+    for prefix, n_rows, n_cols, transpose in [('gt', n_gts, n_props, False),
+                                              ('prop', n_props, n_gts, True)]:
+        tables = {
+            key: (np.zeros((n_rows, n_cols), dtype=np.float32)
+                  if quality_tables is None or key not in quality_tables else
+                  (_dense_qualities(quality_tables[key], n_gts, n_props).T
+                   if transpose else _dense_qualities(
+                       quality_tables[key], n_gts, n_props)))
+            for key in ['overall', 'spatial', 'label', 'state_change']
+        }
+        idxs = _top_k(tables['overall'], k)
+        candidates[prefix + '_candidates'] = idxs.astype(np.int32)
+        for key, t in tables.items():
+            candidates['%s_%s' % (prefix, key)] = (np.where(
+                idxs >= 0,
+                np.take_along_axis(t, np.maximum(idxs, 0), axis=1), 0).astype(
+                    np.float32) if n_cols > 0 else np.zeros(
+                        (n_rows, k), dtype=np.float32))
+    return candidates
+
+
+def _top_k(quality, k):
+    """
+    Find the columns of the k highest non-zero values in each row of a matrix by partial selection (no full sort of any
+    row). Rows are selected a block at a time, so the working memory stays bounded however large the matrix.
+    Partial selection only finds the k-th highest value of each row, so values tied with it are then kept in column
+    order, making the columns found independent of how numpy partitions.
+    :param quality: n x m numpy array of non-negative values
+    :param k: number of columns found for each row
+    :return: n x k numpy array of column indices, ordered by descending value (ties by column) & padded with -1 where a
+    row has fewer than k non-zero values
+    """
+    n, m = quality.shape
+    top = np.full((n, k), -1, dtype=np.int64)
+    k_m = min(k, m)
+    if k_m == 0:
+        return top
+    step = max(1, _CHUNK_MIN_PAIRS // m)
+    for start in range(0, n, step):
+        block = quality[start:start + step]
+        kth = -np.partition(-block, k_m - 1, axis=1)[:, k_m - 1, np.newaxis]
+        above = block > kth
+        tied = block == kth
+        keep = above | (tied & (np.cumsum(tied, axis=1) <= k_m - np.sum(
+            above, axis=1, keepdims=True)))
+        idxs = np.nonzero(keep)[1].reshape(-1, k_m)
+        values = np.take_along_axis(block, idxs, axis=1)
+        order = np.lexsort((idxs, -values), axis=1)
+        idxs = np.take_along_axis(idxs, order, axis=1)
+        top[start:start + step, :k_m] = np.where(
+            np.take_along_axis(values, order, axis=1) > 0, idxs, -1)
+    return top
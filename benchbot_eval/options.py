@@ -0,0 +1,22 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+
+def resolve_options(name, options, defaults):
+    """
+    Fills in the defaults of a group of related options, which are given as a dict so each feature adds a single
+    keyword argument (e.g. OMQ's tiling={'max_bytes': 2**30}).
+    :param name: name of the option group (only used in error messages)
+    :param options: dict of the options given (None to use every default)
+    :param defaults: dict of every option in the group, with its default value
+    :return: new dict holding every option in the group
+    """
+    if options is None:
+        options = {}
+    if not isinstance(options, dict):
+        raise ValueError("Options for '%s' must be a dict (got '%s')" %
+                         (name, options))
+    unknown = sorted(k for k in options if k not in defaults)
+    if unknown:
+        raise ValueError("Unknown options for '%s': %s (options are: %s)" %
+                         (name, ", ".join(unknown), ", ".join(defaults)))
+    return dict(defaults, **options)
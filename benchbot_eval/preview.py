@@ -0,0 +1,191 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import numpy as np
+
+from .omq import TOTAL_KEYS, calc_scores, calc_spatial_qual_aligned, object_array, select_objects
+
+# NOTE previews evaluate only a sample of regions from each map, treating every sampled region as a small map of its
+# own. Regions are the sampling units: the ratio scores (OMQ & the averages) of the pooled sample estimate the scores
+# of the full map, & resampling regions gives confidence intervals for those estimates.
+
+_SCORE_KEYS = [
+    'OMQ', 'avg_pairwise', 'avg_label', 'avg_spatial', 'avg_fp_quality',
+    'avg_state_quality'
+]
+
+
+def sample_map(gt_objects, proposed_objects, fraction, region_size=2.0,
+               rng=None):
+    """
+    Draws a stratified spatial sample of regions from a map. The map is divided into square regions of region_size
+    (in the x-y plane), & the occupied regions are ordered along a Hilbert curve, which keeps regions that are close
+    along the curve close in the map. Consecutive runs of occupied regions along the curve form strata of neighbouring
+    regions, with one region randomly sampled from each stratum. Each object proposal is pulled into the region of the ground-truth object it overlaps
+    most (only searching neighbouring regions), or otherwise belongs to the region containing its centroid.
+    :param gt_objects: list of ground-truth dicts for the map
+    :param proposed_objects: list of object proposal dicts for the map
+    :param fraction: approximate fraction of occupied regions sampled (greater than zero, and at most one)
+    :param region_size: width of each square region (in the units of the map, typically metres). Should be at least
+    as large as most objects, as overlaps are only found between objects in neighbouring regions.
+    :param rng: numpy random Generator used to sample regions (None for an unseeded generator)
+    :return: (samples, num_regions). samples: list of (ground-truth dicts, proposal dicts) tuples, one for each
+    sampled region. num_regions: number of occupied regions in the map
+    """
+    if not 0 < fraction <= 1:
+        raise ValueError(
+            "Preview fraction must be greater than 0 & at most 1, not %s" %
+            fraction)
+    rng = np.random.default_rng() if rng is None else rng
+    gt_centroids, gt_extents, prop_centroids, prop_extents = [
+        object_array(objs, k)
+        for objs, k in [(gt_objects, 'centroid'), (gt_objects, 'extent'),
+                        (proposed_objects, 'centroid'), (proposed_objects,
+                                                         'extent')]
+    ]
+    if len(gt_objects) + len(proposed_objects) == 0:
+        return [], 0
+
+    # Find the occupied regions (ordered along a Hilbert curve, so
+    # consecutive regions are close together), & the region holding each
+    # object's centroid
+    regions, cell_idxs = np.unique(np.floor(
+        np.concatenate((gt_centroids, prop_centroids))[:, :2] /
+        region_size).astype(np.int64),
+                                   axis=0,
+                                   return_inverse=True)
+    order = np.argsort(_hilbert_index(regions - np.min(regions, axis=0)))
+    regions = regions[order]
+    cell_idxs = np.argsort(order)[cell_idxs.ravel()]
+    gt_cells = cell_idxs[:len(gt_objects)]
+    prop_cells = cell_idxs[len(gt_objects):].copy()
+    gts_by_cell = _group_by_cell(gt_cells, len(regions))
+    props_by_cell = _group_by_cell(prop_cells, len(regions))
+
+    # Sample one region from each stratum of consecutive regions
+    stratum_size = max(1, int(round(1 / fraction)))
+    starts = np.arange(0, len(regions), stratum_size)
+    sampled = starts + (rng.random(len(starts)) * np.minimum(
+        stratum_size,
+        len(regions) - starts)).astype(np.int64)
+
+    # Pull proposals into the region of the ground-truth object they overlap
+    # most (only proposals near a sampled region can move into or out of it)
+    lookup = {tuple(r): i for i, r in enumerate(regions.tolist())}
+
+    def neighbours(i):
+        x, y = regions[i]
+        return [
+            lookup[(x + dx, y + dy)]
+            for dx in [-1, 0, 1]
+            for dy in [-1, 0, 1]
+            if (x + dx, y + dy) in lookup
+        ]
+
+    for c in sorted(set(n for i in sampled for n in neighbours(i))):
+        props = props_by_cell[c]
+        gts = np.concatenate([gts_by_cell[n] for n in neighbours(c)])
+        if len(props) == 0 or len(gts) == 0:
+            continue
+        iou = calc_spatial_qual_aligned(
+            gt_centroids[np.newaxis, gts], gt_extents[np.newaxis, gts],
+            prop_centroids[props, np.newaxis], prop_extents[props,
+                                                            np.newaxis])
+        best = np.argmax(iou, axis=1)
+        overlapping = iou[np.arange(len(props)), best] > 0
+        prop_cells[props[overlapping]] = gt_cells[gts[best[overlapping]]]
+
+    return [([gt_objects[i] for i in gts_by_cell[c]],
+             select_objects(proposed_objects, np.flatnonzero(prop_cells == c)))
+            for c in sampled], len(regions)
+
+
+def evaluate_sample(evaluator, param_lists, fraction, region_size=2.0,
+                    rng=None):
+    """
+    Evaluates a stratified spatial sample of every map with an OMQ evaluator (see sample_map()), so that the
+    evaluator's scores become estimates of the scores for the full maps. Like OMQ.score(), this removes any evaluation
+    information that had been stored for previous maps.
+    :param evaluator: OMQ evaluator the sampled regions are evaluated with
+    :param param_lists: list of (ground-truth dicts, proposal dicts) tuples, one for each map
+    :param fraction: approximate fraction of occupied regions sampled from each map
+    :param region_size: width of each square region (see sample_map())
+    :param rng: numpy random Generator used to sample regions (None for an unseeded generator)
+    :return: (partials, num_regions). partials: list of OMQPartial results, one for each sampled region.
+    num_regions: total number of occupied regions in all maps
+    """
+    partials = []
+    num_regions = 0
+    for gt_objects, proposed_objects in param_lists:
+        samples, n = sample_map(gt_objects, proposed_objects, fraction,
+                                region_size, rng)
+        num_regions += n
+        for sample in samples:
+            evaluator.reset()
+            evaluator.add_map_eval(*sample)
+            partials.append(evaluator.get_partial())
+
+    # Partial results merge exactly, so this is the same as evaluating every
+    # sampled region with the one evaluator
+    evaluator.reset()
+    for p in partials:
+        evaluator.add_partial(p)
+    return partials, num_regions
+
+
+def confidence_intervals(partials, confidence=0.95, resamples=1000,
+                         rng=None):
+    """
+    Percentile bootstrap confidence intervals for the scores estimated from a sample of regions, resampling the
+    regions with replacement.
+    :param partials: list of OMQPartial results, one for each sampled region (see evaluate_sample())
+    :param confidence: confidence level of the intervals
+    :param resamples: number of bootstrap resamples
+    :param rng: numpy random Generator used to resample regions (None for an unseeded generator)
+    :return: dictionary of [lower, upper] intervals for each score.
+    Format {'OMQ': <omq>, 'avg_pairwise': <avg_overall_quality>, 'avg_label': <avg_label_quality>,
+    'avg_spatial': <avg_spatial_quality>, 'avg_fp_quality': <avg_fp_quality>,
+    'avg_state_quality': <avg_state_quality>}
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    totals = np.array([[p.total(k)
+                        for k in TOTAL_KEYS]
+                       for p in partials] or [[0] * len(TOTAL_KEYS)],
+                      dtype=np.float64)
+    counts = rng.multinomial(len(totals),
+                             np.full(len(totals), 1 / len(totals)),
+                             size=resamples)
+    scores = calc_scores(dict(zip(TOTAL_KEYS, (counts @ totals).T)))
+    alpha = (1 - confidence) / 2
+    return {
+        k: [float(x) for x in np.quantile(scores[k], [alpha, 1 - alpha])]
+        for k in _SCORE_KEYS
+    }
+
+
+def _hilbert_index(cells):
+    # Distance along a Hilbert curve (covering a square with a power of two
+    # side) of each of a set of non-negative (x, y) cells. Cells one step apart
+    # along the curve are always neighbours, & every run of steps along the
+    # curve stays within a compact block of cells.
+    x, y = cells[:, 0].copy(), cells[:, 1].copy()
+    n = 1 << int(np.max(cells, initial=0)).bit_length()
+    d = np.zeros(len(cells), dtype=np.int64)
+    s = n // 2
+    while s > 0:
+        rx, ry = (x & s) > 0, (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+
+        # Rotate the quadrant, so the curve within it has the right orientation
+        flip = ~ry & rx
+        x[flip], y[flip] = n - 1 - x[flip], n - 1 - y[flip]
+        swap = ~ry
+        x[swap], y[swap] = y[swap], x[swap]
+        s //= 2
+    return d
+
+
+def _group_by_cell(cells, num_cells):
+    # Indices of the objects in each cell (in their original order)
+    order = np.argsort(cells, kind='stable')
+    return np.split(order,
+                    np.searchsorted(cells[order], np.arange(1, num_cells)))
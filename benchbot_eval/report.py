@@ -0,0 +1,153 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import csv
+import numpy as np
+import zipfile
+
+# Columns of a match report, in order. Every row is a single "true positive"
+# match, false positive (FP), or false negative (FN) from one map. Indices
+# that don't apply to a row (e.g. the proposal of a FN) are -1.
+REPORT_COLUMNS = [
+    'source', 'map', 'type', 'gt_idx', 'prop_idx', 'gt_class', 'prop_class',
+    'overall', 'spatial', 'label', 'state_change', 'fp_cost', 'isgroup_exempt'
+]
+
+# Extra columns of a match report with attribution. Every row has the change
+# in its map's total overall quality, total FP cost, & OMQ if its ground-truth
+# object (or its proposal) alone was removed from the map. Rows without that
+# object have NaN changes.
+ATTRIBUTION_COLUMNS = [
+    'gt_delta_overall', 'gt_delta_fp_cost', 'gt_delta_omq',
+    'prop_delta_overall', 'prop_delta_fp_cost', 'prop_delta_omq'
+]
+
+# Arrays of a candidate report, for each map. Every ground-truth object (and
+# every object proposal) has a row of its k best counterparts, ranked by
+# overall quality. Rows with fewer than k counterparts of non-zero overall
+# quality are padded with indices of -1 & qualities of zero.
+CANDIDATE_ARRAYS = [
+    'gt_candidates', 'gt_overall', 'gt_spatial', 'gt_label',
+    'gt_state_change', 'prop_candidates', 'prop_overall', 'prop_spatial',
+    'prop_label', 'prop_state_change'
+]
+
+
+class MatchReport(object):
+    """
+    Columnar (CSV) report of every match, false positive, & false negative found while evaluating maps.
+    Rows are written as each map is evaluated, so the report never needs to be held in memory as a whole.
+    """
+
+    def __init__(self, report_filename, attribution=False):
+        """
+        Initialisation function for a report, creating (or overwriting) the report file
+        :param report_filename: name of the CSV file the report is written to
+        :param attribution: flag for whether the report also has the leave-one-out contribution of every ground-truth
+        object & object proposal (see ATTRIBUTION_COLUMNS)
+        """
+        super(MatchReport, self).__init__()
+        self.report_filename = report_filename
+        self.attribution = attribution
+        self.columns = REPORT_COLUMNS + (ATTRIBUTION_COLUMNS
+                                         if attribution else [])
+        self.source = ''
+        self.num_maps = 0
+        self._f = open(report_filename, 'w', newline='')
+        self._writer = csv.writer(self._f)
+        self._writer.writerow(self.columns)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write_map(self, map_report):
+        """
+        Writes the rows for a single map to the report. Rows are labelled with the current value of the source
+        attribute (e.g. the results file being evaluated), & a running map number.
+        :param map_report: dictionary of equal length columns for the map, as returned in the 'report' of
+        _calc_qual_map() results (i.e. all of the report's columns except 'source' & 'map')
+        :return: None
+        """
+        columns = [map_report[c] for c in self.columns[2:]]
+        n = len(columns[0])
+        self._writer.writerows(
+            zip([self.source] * n, [self.num_maps] * n,
+                *[c.tolist() for c in columns]))
+        self._f.flush()
+        self.num_maps += 1
+
+    def close(self):
+        """
+        Closes the report file
+        :return: None
+        """
+        self._f.close()
+
+
+class CandidateReport(object):
+    """
+    Compact (*.npz) report of the k best candidate matches for every ground-truth object & object proposal found while
+    evaluating maps, e.g. to see which proposals nearly matched a false negative. Arrays are written as each map is
+    evaluated, so the report never needs to be held in memory as a whole. The report can be read lazily with
+    numpy.load(), where the arrays of each map are keyed '<map>/<array>' (e.g. '0/gt_candidates', see
+    CANDIDATE_ARRAYS), 'sources' holds the source of each map, & 'k' the number of candidates.
+    """
+
+    def __init__(self, report_filename, k=5):
+        """
+        Initialisation function for a candidate report, creating (or overwriting) the report file
+        :param report_filename: name of the *.npz file the report is written to
+        :param k: number of candidates reported for each ground-truth object & object proposal
+        """
+        super(CandidateReport, self).__init__()
+        if k < 1:
+            raise ValueError("Number of candidates must be at least 1, not %s" %
+                             k)
+        self.report_filename = report_filename
+        self.k = k
+        self.source = ''
+        self.num_maps = 0
+        self._sources = []
+        self._zip = zipfile.ZipFile(report_filename,
+                                    'w',
+                                    compression=zipfile.ZIP_DEFLATED,
+                                    allowZip64=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write_map(self, map_candidates):
+        """
+        Writes the candidates for a single map to the report, labelled with the current value of the source attribute
+        (e.g. the results file being evaluated), & a running map number.
+        :param map_candidates: dictionary of arrays for the map, as returned in the 'candidates' of _calc_qual_map()
+        results (i.e. all of CANDIDATE_ARRAYS)
+        :return: None
+        """
+        for name in CANDIDATE_ARRAYS:
+            self._write_array('%d/%s' % (self.num_maps, name),
+                              map_candidates[name])
+        self._sources.append(self.source)
+        self.num_maps += 1
+
+    def close(self):
+        """
+        Finishes the report file with the source of each map, & closes it
+        :return: None
+        """
+        if self._zip is None:
+            return
+        self._write_array('sources', np.array(self._sources, dtype=np.str_))
+        self._write_array('k', np.array(self.k))
+        self._zip.close()
+        self._zip = None
+
+    def _write_array(self, name, array):
+        # Arrays are stored like numpy.savez_compressed(), one *.npy per array
+        with self._zip.open(name + '.npy', 'w', force_zip64=True) as f:
+            np.lib.format.write_array(f, np.asarray(array), allow_pickle=False)
@@ -0,0 +1,96 @@
+import json
+import random
+
+import numpy as np
+import pytest
+
+from benchbot_eval import class_list as cl
+
+from helpers import TASK_SCD, TASK_SS
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+@pytest.fixture
+def evaluation_dir(tmp_path):
+    # Ground truth for two environments of three scenes each (scenes share
+    # most of their objects, so there are changes between them), along with
+    # semantic SLAM results for every scene & SCD results for scenes 1 & 2
+    r = random.Random(0)
+    names = cl.CLASS_LIST[:-1]
+
+    def obj():
+        return {
+            'class': r.choice(names),
+            'centroid': [r.uniform(0, 10),
+                         r.uniform(0, 10),
+                         r.uniform(0, 2)],
+            'extent': [r.uniform(0.2, 1.5) for _ in range(3)]
+        }
+
+    def proposal(o, scd=False):
+        p = [r.random() * 0.1 for _ in cl.CLASS_LIST]
+        p[cl.CLASS_IDS[o['class']] if r.random() < 0.8 else r.
+          randrange(len(p))] += 0.7
+        d = {
+            'centroid': [c + r.gauss(0, 0.15) for c in o['centroid']],
+            'extent': [max(0.05, e + r.gauss(0, 0.1)) for e in o['extent']],
+            'label_probs': p
+        }
+        if scd:
+            d['state_probs'] = [r.random(), r.random(), 0.1]
+        return d
+
+    gt_dir, results_dir = tmp_path / 'gt', tmp_path / 'results'
+    gt_dir.mkdir()
+    results_dir.mkdir()
+    results = {'ss': [], 'scd': []}
+    for env in ['miniroom', 'house']:
+        base = [obj() for _ in range(30)]
+        scenes = {}
+        for n in range(1, 4):
+            scenes[n] = [dict(o) for o in base if r.random() > 0.15
+                        ] + [obj() for _ in range(4)]
+            if n == 2:
+                scenes[n][0]['isgroup'] = True
+            with open(str(gt_dir / ('%s_%d.json' % (env, n))), 'w') as f:
+                json.dump({'objects': scenes[n]}, f)
+            fn = str(results_dir / ('ss_%s_%d.json' % (env, n)))
+            with open(fn, 'w') as f:
+                json.dump(
+                    {
+                        'task_details': TASK_SS,
+                        'environment_details': {
+                            'name': env,
+                            'numbers': [n]
+                        },
+                        'class_list': cl.CLASS_LIST,
+                        'objects':
+                            [proposal(o) for o in scenes[n] if r.random() > 0.2
+                            ] + [proposal(obj()) for _ in range(5)]
+                    }, f)
+            results['ss'].append(fn)
+        a, b = scenes[1], scenes[2]
+        changes = [o for o in a if o not in b] + [o for o in b if o not in a]
+        fn = str(results_dir / ('scd_%s.json' % env))
+        with open(fn, 'w') as f:
+            json.dump(
+                {
+                    'task_details': TASK_SCD,
+                    'environment_details': {
+                        'name': env,
+                        'numbers': [1, 2]
+                    },
+                    'class_list': cl.CLASS_LIST,
+                    'objects': [proposal(o, True) for o in changes] +
+                               [proposal(obj(), True) for _ in range(4)]
+                }, f)
+        results['scd'].append(fn)
+    return {
+        'ground_truth_dir': str(gt_dir),
+        'results': results,
+        'tmp_path': tmp_path
+    }
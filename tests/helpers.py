@@ -0,0 +1,54 @@
+import numpy as np
+
+from benchbot_eval import class_list as cl
+
+TASK_SS = {
+    'type': 'semantic_slam',
+    'control_mode': 'passive',
+    'localisation_mode': 'ground_truth'
+}
+TASK_SCD = dict(TASK_SS, type='scd')
+STATES = ['added', 'removed']
+
+
+def random_map(rng, n_gts, n_props, scd_mode=False, size=10.0,
+               num_classes=None):
+    # A map of ground-truth objects & object proposals in the format OMQ
+    # expects, with most proposals near a ground-truth object (so there are
+    # matches) & some spread over the map (so there are false positives)
+    num_classes = len(cl.CLASS_LIST) if num_classes is None else num_classes
+    gts = []
+    for _ in range(n_gts):
+        gts.append({
+            'class_id': int(rng.integers(num_classes - 1)),
+            'centroid': (rng.random(3) * [size, size, 2]).tolist(),
+            'extent': (rng.random(3) + 0.2).tolist()
+        })
+        if rng.random() < 0.05:
+            gts[-1]['isgroup'] = True
+        if scd_mode:
+            gts[-1]['state'] = STATES[int(rng.integers(len(STATES)))]
+    props = []
+    for i in range(n_props):
+        label_probs = rng.random(num_classes) * 0.1
+        if i < n_gts and rng.random() < 0.8:
+            g = gts[i]
+            centroid = np.array(g['centroid']) + rng.normal(0, 0.15, 3)
+            extent = np.maximum(
+                0.05,
+                np.array(g['extent']) + rng.normal(0, 0.1, 3))
+            label_probs[g['class_id']] += 0.6
+        else:
+            centroid = rng.random(3) * [size, size, 2]
+            extent = rng.random(3) + 0.2
+            label_probs[int(rng.integers(num_classes - 1))] += 0.6
+        props.append({
+            'centroid': centroid.tolist(),
+            'extent': extent.tolist(),
+            'label_probs': (label_probs / label_probs.sum()).tolist()
+        })
+        if scd_mode:
+            state_probs = rng.random(3)
+            props[-1]['state_probs'] = (state_probs /
+                                        state_probs.sum()).tolist()
+    return gts, props
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+from scipy.optimize import linear_sum_assignment
+
+from benchbot_eval import omq
+from benchbot_eval.assignment import sparse_assignment
+from benchbot_eval.omq import OMQ
+
+from helpers import random_map
+
+
+def _sparse_quality(rng, rows, cols, density):
+    return np.where(
+        rng.random((rows, cols)) < density, rng.random((rows, cols)), 0)
+
+
+def _optimum(quality):
+    rows, cols = linear_sum_assignment(-quality)
+    return quality[rows, cols].sum()
+
+
+def test_sparse_assignment_is_optimal(rng):
+    for rows, cols, density in [(30, 30, 0.1), (20, 45, 0.2), (45, 20, 0.05),
+                                (10, 10, 1.0)]:
+        quality = _sparse_quality(rng, rows, cols, density)
+        row_idxs, col_idxs, gap = sparse_assignment(quality)
+        assert gap == 0.0
+        assert len(set(row_idxs)) == len(row_idxs)
+        assert len(set(col_idxs)) == len(col_idxs)
+        assert np.all(quality[row_idxs, col_idxs] > 0)
+        assert quality[row_idxs, col_idxs].sum() == pytest.approx(
+            _optimum(quality))
+
+
+def test_sparse_assignment_gap_bounds_the_loss(rng):
+    # Running out of time completes the assignment greedily, with a gap that
+    # is never less than the quality actually lost
+    for _ in range(5):
+        quality = _sparse_quality(rng, 40, 40, 0.15)
+        row_idxs, col_idxs, gap = sparse_assignment(quality, time_budget=0)
+        total = quality[row_idxs, col_idxs].sum()
+        assert len(set(col_idxs)) == len(col_idxs)
+        assert 0 <= _optimum(quality) - total <= gap + 1e-9
+
+
+def test_sparse_backend_matches_hungarian(rng):
+    maps = [random_map(rng, 40, 50) for _ in range(3)]
+    hungarian, sparse = OMQ(), OMQ(assignment={'backend': 'sparse'})
+    assert sparse.score(maps) == pytest.approx(hungarian.score(maps))
+    assert sparse.get_assignment_gap() == 0.0
+
+
+def test_sparse_backend_never_builds_full_tables(rng, monkeypatch):
+    # Maps assigned with the sparse backend only ever hold their pairs with
+    # non-zero quality, yet score exactly as they do with full cost tables
+    maps = [random_map(rng, 30, 35, scd_mode=True) for _ in range(3)]
+
+    def full_tables(*args, **kwargs):
+        raise AssertionError('Built a table of every pair')
+
+    for options in [{}, {
+            'batched': True
+    }, {
+            'tiling': {
+                'max_bytes': 5000
+            }
+    }, {
+            'batched': True,
+            'tiling': {
+                'max_bytes': 5000,
+                'workers': 4
+            }
+    }]:
+        hungarian = OMQ(scd_mode=True, **options)
+        hungarian.score(maps)
+        with monkeypatch.context() as m:
+            m.setattr(omq, '_init_cost_tables', full_tables)
+            sparse = OMQ(scd_mode=True,
+                         assignment={'backend': 'sparse'},
+                         **options)
+            sparse.score(maps)
+        assert sparse.get_partial().to_dict() == hungarian.get_partial(
+        ).to_dict()
+
+    # Only the reference the sparse tables are verified against is full
+    OMQ(scd_mode=True,
+        assignment={'backend': 'sparse'},
+        verify={
+            'fraction': 1.0,
+            'tolerance': 0.0
+        }).score(maps)
@@ -0,0 +1,74 @@
+import os
+
+from benchbot_eval import cache
+
+
+def _entries(cache_dir):
+    return sorted(fn for fn in os.listdir(cache_dir) if fn.endswith('.json'))
+
+
+def _touch(score_cache, key, t):
+    fn = score_cache._entry_filename(key)
+    os.utime(fn, (t, t))
+
+
+def test_cache_round_trip(tmp_path):
+    c = cache.ScoreCache(str(tmp_path / 'cache'))
+    key = cache.content_hash({'a': 1, 'b': [1, 2]})
+    assert key == cache.content_hash({'b': [1, 2], 'a': 1})
+    assert c.get(key) is None
+    c.put(key, {'score': 0.5})
+    assert c.get(key) == {'score': 0.5}
+
+
+def test_cache_stays_below_bound(tmp_path):
+    c = cache.ScoreCache(str(tmp_path / 'cache'), max_bytes=2000)
+    for i in range(100):
+        c.put(cache.content_hash(i), {'scores': [i] * 20})
+        total = sum(
+            os.path.getsize(os.path.join(c.cache_dir, fn))
+            for fn in _entries(c.cache_dir))
+        assert total <= c.max_bytes
+        assert c._read_total() == total
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    c = cache.ScoreCache(str(tmp_path / 'cache'), max_bytes=550)
+    keys = [cache.content_hash(i) for i in range(5)]
+    for i, k in enumerate(keys):
+        c.put(k, {'scores': [i] * 30})
+        _touch(c, k, 1000 + i)
+    # Reading the oldest entry makes it the most recently used
+    assert c.get(keys[0]) is not None
+    c.put(cache.content_hash('new'), {'scores': [0] * 30})
+    assert c.get(keys[0]) is not None
+    assert c.get(keys[1]) is None
+
+
+def test_cache_only_scans_when_evicting(tmp_path, monkeypatch):
+    c = cache.ScoreCache(str(tmp_path / 'cache'), max_bytes=10**6)
+    c.put(cache.content_hash(0), {'score': 0})
+
+    scans = []
+    listdir = os.listdir
+    monkeypatch.setattr(cache.os, 'listdir',
+                        lambda p: scans.append(p) or listdir(p))
+    for i in range(1, 50):
+        c.put(cache.content_hash(i), {'score': i})
+    assert not scans
+
+    c.max_bytes = 100
+    c.put(cache.content_hash('over'), {'score': -1})
+    assert len(scans) == 1
+
+
+def test_cache_total_recovers(tmp_path):
+    c = cache.ScoreCache(str(tmp_path / 'cache'), max_bytes=10**6)
+    for i in range(5):
+        c.put(cache.content_hash(i), {'score': i})
+    with open(os.path.join(c.cache_dir, '.size'), 'w') as f:
+        f.write('garbage')
+    c.put(cache.content_hash(0), {'score': 'replaced'})
+    assert c._read_total() == sum(
+        os.path.getsize(os.path.join(c.cache_dir, fn))
+        for fn in _entries(c.cache_dir))
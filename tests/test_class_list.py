@@ -0,0 +1,49 @@
+import pytest
+
+from benchbot_eval import class_list as cl
+
+
+@pytest.fixture
+def restore_class_list():
+    class_list, synonyms = list(cl.CLASS_LIST), dict(cl.SYNONYMS)
+    yield
+    cl.set_class_list(class_list, synonyms)
+
+
+def test_synonyms_resolve_to_classes():
+    assert cl.get_nearest_class_name('TV Monitor') == 'tv'
+    assert cl.get_nearest_class_id('diningtable') == cl.CLASS_IDS['table']
+    assert cl.get_nearest_class_id('unicorn') is None
+
+
+def test_synonyms_of_removed_classes_are_ignored(restore_class_list):
+    cl.set_class_list(['chair', 'table', 'background'])
+    assert cl.get_nearest_class_id('television') is None
+    assert cl.get_nearest_class_id('desk') == 1
+
+
+def test_taxonomy_leaves_the_default_class_list_alone():
+    class_list = list(cl.CLASS_LIST)
+    taxonomy = cl.ClassTaxonomy(['Chair', 'table', 'background'],
+                                {'stool': 'chair'})
+    assert taxonomy.get_nearest_class_id('stool') == 0
+    assert taxonomy.get_nearest_class_id('desk') is None
+    assert taxonomy.get_nearest_class_id('tv') is None
+    assert cl.CLASS_LIST == class_list
+    assert cl.ClassTaxonomy().get_nearest_class_id('tv') == cl.CLASS_IDS['tv']
+
+
+def test_invalid_class_lists_are_rejected():
+    with pytest.raises(ValueError):
+        cl.ClassTaxonomy(['chair', 'table'])
+    with pytest.raises(ValueError):
+        cl.ClassTaxonomy(['chair', 'Chair', 'background'])
+
+
+def test_taxonomy_keeps_its_own_copy_of_the_default(restore_class_list):
+    taxonomy = cl.ClassTaxonomy()
+    tv, couch = cl.CLASS_IDS['tv'], cl.CLASS_IDS['couch']
+    cl.set_class_list(['chair', 'table', 'background'], {'sofa': 'chair'})
+    assert taxonomy.get_nearest_class_id('television') == tv
+    assert taxonomy.get_nearest_class_id('sofa') == couch
+    assert len(taxonomy.class_list) == len(taxonomy.class_ids) > 3
@@ -0,0 +1,430 @@
+import asyncio
+import concurrent.futures
+import json
+import os
+import zipfile
+
+import numpy as np
+import pytest
+
+from benchbot_eval import EvaluationCancelled, Evaluator, class_list as cl
+
+
+def evaluate(d, results, filename='scores.json', **kwargs):
+    return Evaluator(results,
+                     d['ground_truth_dir'],
+                     str(d['tmp_path'] / filename),
+                     print_all=False,
+                     quiet=True,
+                     **kwargs).evaluate()
+
+
+def scores_json(scores):
+    return json.dumps(scores, sort_keys=True)
+
+
+def rewrite_results(d, results, name, rewrite):
+    # Copies results files with each result's objects rewritten
+    filenames = []
+    for i, fn in enumerate(results):
+        with open(fn, 'r') as f:
+            data = json.load(f)
+        rewrite(data)
+        filenames.append(str(d['tmp_path'] / ('%s_%d.json' % (name, i))))
+        with open(filenames[-1], 'w') as f:
+            json.dump(data, f)
+    return filenames
+
+
+def test_sparse_label_probs_match_dense(evaluation_dir):
+    # Every sparse format holding the same non-zero probabilities scores
+    # exactly the same as the dense distributions
+    d = evaluation_dir
+    for kind in ['ss', 'scd']:
+        dense = evaluate(d, d['results'][kind])
+
+        def as_dict(data):
+            for o in data['objects']:
+                o['label_probs'] = {
+                    c: p
+                    for c, p in zip(data['class_list'], o['label_probs'])
+                    if p > 0
+                }
+
+        def as_pairs(data):
+            for o in data['objects']:
+                o['label_probs'] = [[i, p]
+                                    for i, p in enumerate(o['label_probs'])
+                                    if p > 0]
+
+        for name, rewrite in [('dict', as_dict), ('pairs', as_pairs)]:
+            assert scores_json(
+                evaluate(d, rewrite_results(d, d['results'][kind], name,
+                                            rewrite))) == scores_json(dense)
+
+        npzs = []
+        for i, fn in enumerate(d['results'][kind]):
+            with open(fn, 'r') as f:
+                data = json.load(f)
+            probs = np.array([o['label_probs'] for o in data['objects']])
+            top = np.argsort(-probs, axis=1)[:, :probs.shape[1] // 2]
+            npzs.append(str(d['tmp_path'] / ('topk_%d.npz' % i)))
+            Evaluator.save_results_arrays(
+                npzs[-1],
+                data['task_details'],
+                data['environment_details'],
+                np.array([o['centroid'] for o in data['objects']]),
+                np.array([o['extent'] for o in data['objects']]),
+                np.take_along_axis(probs, top, axis=1),
+                state_probs=(np.array([o['state_probs'] for o in data['objects']
+                                      ]) if kind == 'scd' else None),
+                class_list=data['class_list'],
+                label_indices=top)
+
+            def top_k(data, top=top):
+                for o, t in zip(data['objects'], top):
+                    o['label_probs'] = [[int(i), o['label_probs'][i]]
+                                        for i in t]
+
+            npzs.append(
+                rewrite_results(d, [fn], 'topk_dense_%d' % i, top_k)[0])
+        assert scores_json(evaluate(d, npzs[0::2])) == scores_json(
+            evaluate(d, npzs[1::2]))
+
+
+def test_custom_taxonomy_is_contained(evaluation_dir):
+    # Evaluating against a reordered taxonomy gives the same scores (keyed by
+    # class name), without changing the class list of other evaluations
+    d = evaluation_dir
+    components = ['OMQ', 'avg_label', 'avg_spatial', 'per_class']
+    default = evaluate(d, d['results']['ss'], components=components)
+    custom = evaluate(d,
+                      d['results']['ss'],
+                      components=components,
+                      taxonomy=cl.ClassTaxonomy(cl.CLASS_LIST[-2::-1] +
+                                                ['background']))
+    assert sorted(custom['scores']['per_class']) == sorted(
+        default['scores']['per_class'])
+    for c, v in custom['scores']['per_class'].items():
+        assert v == pytest.approx(default['scores']['per_class'][c])
+    assert custom['scores']['OMQ'] == pytest.approx(default['scores']['OMQ'])
+    assert scores_json(evaluate(
+        d, d['results']['ss'], components=components)) == scores_json(default)
+    assert 'per_class' not in evaluate(d, d['results']['ss'])['scores']
+
+
+def test_preview_intervals_hold_the_estimates(evaluation_dir):
+    d = evaluation_dir
+    for kind in ['ss', 'scd']:
+        scores = evaluate(d, d['results'][kind], preview={'fraction': 0.5})
+        assert scores['preview']['fraction'] == 0.5
+        for k, (lower, upper) in scores['preview']['intervals'].items():
+            if k in scores['scores']:
+                assert lower <= scores['scores'][k] + 1e-12
+                assert scores['scores'][k] <= upper + 1e-12
+
+
+def test_evaluate_async_matches_evaluate(evaluation_dir):
+    d = evaluation_dir
+
+    def evaluator(filename):
+        return Evaluator(d['results']['ss'],
+                         d['ground_truth_dir'],
+                         str(d['tmp_path'] / filename),
+                         print_all=False,
+                         quiet=True)
+
+    expected = scores_json(evaluator('sync.json').evaluate())
+    assert scores_json(asyncio.run(
+        evaluator('async.json').evaluate_async())) == expected
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        assert scores_json(
+            asyncio.run(evaluator('pool.json').evaluate_async(
+                executor))) == expected
+    with open(str(d['tmp_path'] / 'async.json'), 'r') as f:
+        assert scores_json(json.load(f)) == expected
+
+
+def test_verification_is_reproducible(evaluation_dir):
+    # Verifying never changes the scores, & the same seed verifies the same
+    # maps (so the verification details are identical too)
+    d = evaluation_dir
+    for kind in ['ss', 'scd']:
+        plain = evaluate(d, d['results'][kind])
+        verified = [
+            evaluate(d,
+                     d['results'][kind],
+                     batched=True,
+                     verify={
+                         'fraction': 0.5,
+                         'seed': seed
+                     }) for seed in [3, 3, 4]
+        ]
+        assert verified[0]['verification'] == verified[1]['verification']
+        for v in verified:
+            assert v['verification']['maps'] <= len(d['results'][kind])
+            del v['verification']
+            assert v['scores']['OMQ'] == pytest.approx(plain['scores']['OMQ'])
+
+
+def test_shards_match_evaluate(evaluation_dir):
+    # Reducing shards gives the scores of evaluating every results file in
+    # one evaluator, listing results in the order they were given
+    d = evaluation_dir
+    results = d['results']['ss'][::-1]
+    expected = evaluate(d, results)
+    assert [e['name'] for e in expected['environment_details']
+           ] == ['house'] * 3 + ['miniroom'] * 3
+    assert [e['numbers'] for e in expected['environment_details']
+           ] == [[3], [2], [1]] * 2
+
+    shards = []
+    for i, fns in enumerate([results[:1], results[1:4], results[4:]]):
+        shards.append(str(d['tmp_path'] / ('shard_%d.json' % i)))
+        Evaluator(fns,
+                  d['ground_truth_dir'],
+                  None,
+                  print_all=False,
+                  quiet=True).evaluate_shard(shards[-1])
+    assert scores_json(
+        Evaluator.reduce_shards(shards,
+                                str(d['tmp_path'] / 'reduced.json'),
+                                quiet=True)) == scores_json(expected)
+    reordered = evaluate(d, d['results']['ss'])
+    assert reordered['environment_details'] == expected[
+        'environment_details'][::-1]
+    assert scores_json(reordered['scores']) == scores_json(expected['scores'])
+
+
+def test_option_groups_are_resolved(evaluation_dir):
+    d = evaluation_dir
+
+    def evaluator(**kwargs):
+        return Evaluator(d['results']['ss'],
+                         d['ground_truth_dir'],
+                         None,
+                         quiet=True,
+                         **kwargs)
+
+    # Options left at their defaults don't change the scoring options (so
+    # cached scores are still reused), while options that change scores do
+    options = evaluator()._scoring_options()
+    assert evaluator(assignment={},
+                     tiling={'max_bytes': 2**20},
+                     plan={'max_map_seconds': 60},
+                     outputs={})._scoring_options() == options
+    assert evaluator(verify={'fraction': 0.1})._scoring_options() != options
+    assert evaluator(plan={'auto': True})._scoring_options() != options
+    with pytest.raises(ValueError):
+        evaluator(outputs={'report_filename': 'report.csv'})
+    with pytest.raises(ValueError):
+        evaluator(cache={'cache_dir': str(d['tmp_path'])})
+
+
+def test_cached_scores_match_evaluate(evaluation_dir):
+    d = evaluation_dir
+    cache = {'dir': str(d['tmp_path'] / 'cache')}
+    for kind in ['ss', 'scd']:
+        expected = scores_json(evaluate(d, d['results'][kind]))
+        for source in ['scored', 'cached']:
+            events = []
+            scores = evaluate(d,
+                              d['results'][kind],
+                              cache=cache,
+                              progress=events.append)
+            assert scores_json(scores) == expected
+            assert [e['source'] for e in events if e['type'] == 'map_scored'
+                   ] == [source] * len(d['results'][kind])
+
+
+def test_array_results_match_json(evaluation_dir):
+    # Dense *.npz results (alone, or inside a compressed zip submission)
+    # score exactly the same as the JSON results they hold
+    d = evaluation_dir
+    for kind in ['ss', 'scd']:
+        expected = scores_json(evaluate(d, d['results'][kind]))
+        npzs = []
+        for i, fn in enumerate(d['results'][kind]):
+            with open(fn, 'r') as f:
+                data = json.load(f)
+            objects = data['objects']
+            npzs.append(str(d['tmp_path'] / ('arrays_%s_%d.npz' % (kind, i))))
+            Evaluator.save_results_arrays(
+                npzs[-1],
+                data['task_details'],
+                data['environment_details'],
+                np.array([o['centroid'] for o in objects]),
+                np.array([o['extent'] for o in objects]),
+                np.array([o['label_probs'] for o in objects]),
+                state_probs=(np.array([o['state_probs'] for o in objects])
+                             if kind == 'scd' else None),
+                class_list=data['class_list'])
+        assert scores_json(evaluate(d, npzs)) == expected
+
+        submission = str(d['tmp_path'] / ('submission_%s.zip' % kind))
+        with zipfile.ZipFile(submission, 'w', zipfile.ZIP_DEFLATED) as z:
+            z.writestr('submission.json', '{}')
+            for fn in npzs:
+                z.write(fn, os.path.basename(fn))
+        assert scores_json(evaluate(d, [submission])) == expected
+
+
+def test_pipelined_scores_match_evaluate(evaluation_dir):
+    d = evaluation_dir
+    for kind in ['ss', 'scd']:
+        expected = scores_json(evaluate(d, d['results'][kind]))
+        for depth in [1, 3]:
+            assert scores_json(
+                evaluate(d, d['results'][kind],
+                         pipeline_depth=depth)) == expected
+
+    # Invalid sets are rejected from their headers, before any scoring
+    events = []
+    with pytest.raises(ValueError):
+        evaluate(d,
+                 d['results']['ss'] + d['results']['scd'][:1],
+                 pipeline_depth=1,
+                 progress=events.append)
+    assert [e['type'] for e in events] == ['started']
+
+
+def test_pipeline_loads_each_file_once(evaluation_dir, monkeypatch):
+    # Pipelined evaluation only loads each results file once (headers are
+    # read without loading the objects), & the ground truth of each scene
+    # once, even when results share scenes
+    d = evaluation_dir
+    fn = [f for f in d['results']['scd'] if 'miniroom' in f][0]
+
+    def later(data):
+        data['environment_details']['numbers'] = [2, 3]
+
+    def objects_first(data):
+        items = list(data.items())
+        data.clear()
+        data['objects'] = dict(items)['objects']
+        data.update(items)
+
+    # (headers are still found when the objects come first)
+    files = ([fn] + rewrite_results(d, [fn], 'later', later) +
+             rewrite_results(d, [f for f in d['results']['scd'] if f != fn],
+                             'first', objects_first))
+    expected = scores_json(evaluate(d, files))
+
+    loads = []
+    json_load = json.load
+
+    def load(f, *args, **kwargs):
+        loads.append(f.name)
+        return json_load(f, *args, **kwargs)
+
+    monkeypatch.setattr(json, 'load', load)
+    events = []
+    assert scores_json(
+        evaluate(d, files, pipeline_depth=1,
+                 progress=events.append)) == expected
+    assert sorted(f for f in loads if f in files) == sorted(files)
+    gts = [e['filename'] for e in events if e['type'] == 'ground_truth_loaded']
+    assert len(gts) == len(set(gts)) == 5
+
+
+def test_scd_chains_score_each_scene_pair(evaluation_dir):
+    # Each pair in a chain scores the same as evaluating that pair alone
+    d = evaluation_dir
+    fn = [f for f in d['results']['scd'] if 'miniroom' in f][0]
+    pair = evaluate(d, [fn], filename='pair.json')
+
+    def chain(data):
+        data['environment_details']['numbers'] = [1, 2, 3]
+        data['objects'] = [dict(o, scenes=s) for s in [[1, 2], [2, 3]]
+                           for o in data['objects']]
+
+    chained = rewrite_results(d, [fn], 'chain', chain)
+    scores = evaluate(d, chained)
+    per_pair = scores['scores']['per_scene_pair']
+    assert sorted(per_pair) == ['miniroom:1:2', 'miniroom:2:3']
+    for k in ['OMQ', 'avg_pairwise', 'avg_state_quality']:
+        assert per_pair['miniroom:1:2'][k] == pytest.approx(
+            pair['scores'][k])
+    assert sorted(
+        evaluate(d, chained, scd_pairs='all')['scores']
+        ['per_scene_pair']) == ['miniroom:1:2', 'miniroom:1:3', 'miniroom:2:3']
+
+    # Chains of array results are split by their 'scenes' array
+    with open(chained[0], 'r') as f:
+        data = json.load(f)
+    arrays = str(d['tmp_path'] / 'chain.npz')
+    Evaluator.save_results_arrays(
+        arrays,
+        data['task_details'],
+        data['environment_details'],
+        *[
+            np.array([o[k] for o in data['objects']])
+            for k in ['centroid', 'extent', 'label_probs']
+        ],
+        state_probs=np.array([o['state_probs'] for o in data['objects']]),
+        class_list=data['class_list'],
+        scenes=np.array([o['scenes'] for o in data['objects']]))
+    assert scores_json(evaluate(d, [arrays])) == scores_json(scores)
+
+    def unknown_pair(data):
+        chain(data)
+        data['objects'][0]['scenes'] = [1, 3]
+
+    with pytest.raises(ValueError):
+        evaluate(d, rewrite_results(d, [fn], 'unknown', unknown_pair))
+
+
+def test_resumed_evaluation_matches_evaluate(evaluation_dir):
+    # An evaluation interrupted part way through resumes from its journal,
+    # only scoring the results files that weren't completed
+    d = evaluation_dir
+    expected = scores_json(evaluate(d, d['results']['ss']))
+    outputs = {'journal': str(d['tmp_path'] / 'journal.jsonl')}
+
+    def interrupt(event):
+        return event['type'] == 'map_scored' and event['filename'] == d[
+            'results']['ss'][1]
+
+    with pytest.raises(EvaluationCancelled):
+        evaluate(d, d['results']['ss'], outputs=outputs, progress=interrupt)
+    with open(outputs['journal'], 'a') as f:
+        f.write('{"key": "partially written')
+
+    events = []
+    assert scores_json(
+        evaluate(d,
+                 d['results']['ss'],
+                 outputs=outputs,
+                 progress=events.append)) == expected
+    assert [e['source'] for e in events if e['type'] == 'map_scored'
+           ] == ['journalled'] * 2 + ['scored'] * 4
+
+
+def test_progress_events_and_cancellation(evaluation_dir, capsys):
+    d = evaluation_dir
+    results = d['results']['ss']
+    events = []
+    evaluate(d, results, progress=events.append)
+    assert capsys.readouterr().out == ''
+    assert events[0] == dict(type='started',
+                             elapsed=events[0]['elapsed'],
+                             results_files=len(results))
+    assert events[-1]['type'] == 'finished'
+    assert events[-1]['results'] == len(results)
+    elapsed = [e['elapsed'] for e in events]
+    assert elapsed == sorted(elapsed)
+    for t in ['results_loaded', 'map_scored']:
+        assert sorted(e['filename'] for e in events
+                      if e['type'] == t) == sorted(results)
+    assert all(e['source'] == 'scored' for e in events
+               if e['type'] == 'map_scored')
+
+    # Returning True from the callback stops the evaluation before any
+    # scores are saved
+    filename = 'cancelled.json'
+    with pytest.raises(EvaluationCancelled):
+        evaluate(d,
+                 results,
+                 filename=filename,
+                 progress=lambda e: e['type'] == 'results_loaded')
+    assert not os.path.exists(str(d['tmp_path'] / filename))
@@ -0,0 +1,440 @@
+import concurrent.futures
+import json
+
+import numpy as np
+
+import pytest
+from scipy import sparse
+
+from benchbot_eval import omq as omq_module
+from benchbot_eval.cache import MapStates
+from benchbot_eval.iou_tools import IoU
+from benchbot_eval.omq import OMQ, ObjectArrays, OMQPartial
+
+from helpers import random_map
+
+# Every score component, including the opt-in per-class breakdown
+ALL_COMPONENTS = [
+    'OMQ', 'avg_pairwise', 'avg_label', 'avg_spatial', 'avg_fp_quality',
+    'avg_state_quality', 'per_class', 'per_region'
+]
+
+def test_per_class_scores_fit_every_sparse_class():
+    # Classes of false positives beyond those of the ground truth (& of the
+    # first proposal) still get their own totals, & classes without any
+    # objects score nothing
+    gts = [{'class_id': 0, 'centroid': [0, 0, 0], 'extent': [1, 1, 1]}]
+    props = [{
+        'centroid': [0, 0, 0],
+        'extent': [1, 1, 1],
+        'label_probs': {
+            0: 0.9
+        }
+    }, {
+        'centroid': [5, 5, 5],
+        'extent': [1, 1, 1],
+        'label_probs': {
+            5: 0.9
+        }
+    }]
+    omq = OMQ(components=ALL_COMPONENTS)
+    omq.score([(gts, props)])
+    pcs = omq.get_per_class_scores()
+    assert all(len(v) == 6 for v in pcs.values())
+    assert pcs['TP'].tolist() == [1, 0, 0, 0, 0, 0]
+    assert pcs['FP'].tolist() == [0, 0, 0, 0, 0, 1]
+    assert np.all(pcs['OMQ'][1:5] == 0)
+
+
+def test_sparse_label_probs_match_dense(rng):
+    maps = [random_map(rng, 20, 25) for _ in range(3)]
+    sparse_maps = [(gts, [
+        dict(p,
+             label_probs={
+                 i: x for i, x in enumerate(p['label_probs'][:-1]) if x > 0
+             }) for p in props
+    ]) for gts, props in maps]
+    dense, sparse = (OMQ(components=ALL_COMPONENTS),
+                     OMQ(components=ALL_COMPONENTS))
+    dense.score(maps)
+    sparse.score(sparse_maps)
+    assert dense.get_current_score() == sparse.get_current_score()
+    pcs_dense, pcs_sparse = (dense.get_per_class_scores(),
+                             sparse.get_per_class_scores())
+    for k, v in pcs_sparse.items():
+        assert np.array_equal(v, pcs_dense[k][:len(v)])
+
+
+def test_object_arrays_match_object_dicts(rng):
+    # Object proposals held as arrays (with dense or sparse label
+    # probabilities) score exactly the same as the dicts they hold
+    for scd_mode in [False, True]:
+        maps = [random_map(rng, 20, 25, scd_mode=scd_mode) for _ in range(3)]
+        sparse_maps = [(gts, [
+            dict(p,
+                 label_probs={
+                     i: x for i, x in enumerate(p['label_probs'][:-1]) if x > 0
+                 }) for p in props
+        ]) for gts, props in maps]
+        array_maps = [(gts,
+                       ObjectArrays(
+                           np.array([p['centroid'] for p in props]),
+                           np.array([p['extent'] for p in props]),
+                           np.array([p['label_probs'] for p in props]),
+                           state_probs=(np.array(
+                               [p['state_probs'] for p in props])
+                                        if scd_mode else None)))
+                      for gts, props in maps]
+        sparse_array_maps = [
+            (gts,
+             ObjectArrays(props.centroids, props.extents,
+                          sparse.csr_matrix(
+                              props.label_probs[:, :-1]), props.state_probs))
+            for gts, props in array_maps
+        ]
+        for options in [{}, {
+                'batched': True
+        }, {
+                'tiling': {
+                    'max_bytes': 5000
+                }
+        }, {
+                'assignment': {
+                    'backend': 'sparse'
+                }
+        }, {
+                'verify': {
+                    'fraction': 1
+                }
+        }]:
+            for dicts, arrays in [(maps, array_maps),
+                                  (sparse_maps, sparse_array_maps)]:
+                expected, omq = [
+                    OMQ(scd_mode=scd_mode, components=ALL_COMPONENTS,
+                        **options) for _ in range(2)
+                ]
+                expected.score(dicts)
+                omq.score(arrays)
+                assert omq.get_partial().to_dict() == expected.get_partial(
+                ).to_dict()
+
+        # Indexing the arrays gives the dict of each object proposal
+        props, arrays = sparse_maps[0][1], sparse_array_maps[0][1]
+        assert len(arrays) == len(props)
+        for p, o in zip(props, arrays):
+            assert o['label_probs'] == p['label_probs']
+            assert o['centroid'].tolist() == p['centroid']
+
+
+def test_option_groups_fill_defaults_and_reject_unknown_options():
+    omq = OMQ(assignment={'backend': 'sparse'}, plan={'auto': True})
+    assert omq.assignment == {'backend': 'sparse', 'time_budget': None}
+    assert omq.tiling == omq_module.OPTION_DEFAULTS['tiling']
+    assert omq.plan['max_map_bytes'] is None
+    for kwargs in [{
+            'assignment': {
+                'backend': 'greedy'
+            }
+    }, {
+            'tiling': {
+                'max_tile_bytes': 1
+            }
+    }, {
+            'verify': 0.5
+    }, {
+            'plan': {
+                'seconds': {
+                    'hungrian': 1e-9
+                }
+            }
+    }]:
+        with pytest.raises(ValueError):
+            OMQ(**kwargs)
+
+
+def test_calibrated_cost_model_plans_maps(rng):
+    seconds = omq_module.calibrate_cost_model(size=50, repeats=1)
+    assert sorted(seconds) == sorted(omq_module.COST_MODEL_SECONDS)
+    assert all(v >= 0 for v in seconds.values())
+
+    # Plans only choose between optimal assignments, so scores are unchanged
+    maps = [random_map(rng, 30, 35) for _ in range(2)]
+    plain, planned = OMQ(), OMQ(plan={'auto': True, 'seconds': seconds})
+    assert planned.score(maps) == pytest.approx(plain.score(maps))
+    assert len(planned.get_plans()) == 2
+
+    # Work estimates scale with the cost model's seconds
+    slow = OMQ(plan={
+        'auto': True,
+        'seconds': {k: 10 * v for k, v in seconds.items()}
+    })
+    slow.score(maps)
+    for p, q in zip(planned.get_plans(), slow.get_plans()):
+        assert q['seconds'] == pytest.approx(10 * p['seconds'])
+    with pytest.raises(ValueError):
+        OMQ(plan={
+            'max_map_seconds': 1e-12,
+            'seconds': seconds
+        }).score(maps)
+
+
+def test_per_class_scores_partition_the_totals(rng):
+    # Every TP, FP, & FN belongs to exactly one class, so per-class counts &
+    # quality totals add up to the overall ones
+    for scd_mode in [False, True]:
+        maps = [random_map(rng, 30, 35, scd_mode=scd_mode) for _ in range(3)]
+        omq = OMQ(scd_mode=scd_mode, components=ALL_COMPONENTS)
+        omq.score(maps)
+        pcs = omq.get_per_class_scores()
+        assert (pcs['TP'].sum(), pcs['FP'].sum(),
+                pcs['FN'].sum()) == omq.get_assignment_counts()
+        for k in ['overall', 'spatial', 'label', 'fp_cost']:
+            assert omq._partial.class_totals(k).sum() == pytest.approx(
+                omq._partial.total(k))
+
+    # With a single class, that class's scores are the overall scores
+    gts, props = random_map(rng, 20, 25, num_classes=2)
+    omq = OMQ(components=ALL_COMPONENTS)
+    omq.score([(gts, props)])
+    pcs = omq.get_per_class_scores()
+    assert pcs['OMQ'][0] == pytest.approx(omq.get_current_score())
+    assert pcs['avg_spatial'][0] == pytest.approx(omq.get_avg_spatial_score())
+
+
+def test_per_class_scores_are_only_kept_when_requested(rng):
+    # The default selection leaves out the per-class breakdown, without
+    # changing any other score
+    maps = [random_map(rng, 20, 25, scd_mode=True) for _ in range(3)]
+    default = OMQ(scd_mode=True)
+    per_class = OMQ(scd_mode=True, components=ALL_COMPONENTS)
+    assert default.score(maps) == per_class.score(maps)
+    assert default.get_avg_state_score() == per_class.get_avg_state_score()
+    assert not default.has_component('per_class')
+    with pytest.raises(ValueError):
+        default.get_per_class_scores()
+    assert default.get_partial().to_dict()['class_sums'] == {}
+
+
+def test_merged_partials_match_a_single_evaluation(rng):
+    # Partials merge exactly, so any grouping of maps (even through JSON)
+    # gives exactly the scores of evaluating every map together
+    maps = [random_map(rng, 15, 20, scd_mode=True) for _ in range(6)]
+    whole = OMQ(scd_mode=True, components=ALL_COMPONENTS)
+    whole.score(maps)
+
+    def partial(group):
+        omq = OMQ(scd_mode=True, components=ALL_COMPONENTS)
+        omq.score(group)
+        return OMQPartial.from_dict(
+            json.loads(json.dumps(omq.get_partial().to_dict())))
+
+    for groups in [[maps[:1], maps[1:]], [maps[3:], maps[:2], maps[2:3]]]:
+        merged = OMQ(scd_mode=True, components=ALL_COMPONENTS)
+        for p in [partial(g) for g in groups][::-1]:
+            merged.add_partial(p)
+        assert merged.get_current_score() == whole.get_current_score()
+        assert merged.get_assignment_counts() == whole.get_assignment_counts()
+        assert merged.get_avg_state_score() == whole.get_avg_state_score()
+        for k, v in merged.get_per_class_scores().items():
+            assert v == pytest.approx(whole.get_per_class_scores()[k])
+
+
+def test_concurrent_scores_match_serial(rng, monkeypatch):
+    # Small chunks, so maps are spread over every worker
+    monkeypatch.setattr(omq_module, '_CHUNK_MIN_PAIRS', 200)
+    maps = [random_map(rng, 10, 12) for _ in range(8)]
+    serial = OMQ()
+    expected = serial.score(maps)
+    with concurrent.futures.ThreadPoolExecutor(3) as executor:
+        threaded = OMQ()
+        assert threaded.score(maps, executor=executor) == expected
+        assert threaded.get_partial().to_dict(
+        ) == serial.get_partial().to_dict()
+    assert OMQ().score(maps, workers=2) == expected
+
+
+def test_batched_iou_matches_shapely(rng):
+    # Axis-aligned cuboids give the same 3D IoU as the polygon intersection
+    n = 200
+    centroids = rng.uniform(0, 3, (2, n, 3))
+    centroids[1] = centroids[0] + rng.normal(0, 0.5, (n, 3))
+    extents = rng.uniform(0.1, 2, (2, n, 3))
+    aligned = omq_module.calc_spatial_qual_aligned(centroids[0], extents[0],
+                                                   centroids[1], extents[1])
+    reference = [
+        IoU().dict_iou({
+            'centroid': c0,
+            'extent': e0
+        }, {
+            'centroid': c1,
+            'extent': e1
+        })[1] for c0, e0, c1, e1 in zip(centroids[0], extents[0], centroids[1],
+                                        extents[1])
+    ]
+    assert np.count_nonzero(aligned) > n // 4
+    assert aligned == pytest.approx(reference, abs=1e-9)
+
+
+def test_batched_scores_match_unbatched(rng):
+    for scd_mode in [False, True]:
+        maps = [
+            random_map(rng, int(rng.integers(0, 8)), int(rng.integers(0, 10)),
+                       scd_mode=scd_mode) for _ in range(40)
+        ]
+        plain, batched = OMQ(scd_mode=scd_mode), OMQ(scd_mode=scd_mode,
+                                                     batched=True)
+        assert batched.score(maps) == pytest.approx(plain.score(maps))
+        assert batched.get_assignment_counts(
+        ) == plain.get_assignment_counts()
+        assert batched.get_avg_spatial_score() == pytest.approx(
+            plain.get_avg_spatial_score())
+
+
+def test_threshold_sweep_matches_filtered_evaluations(rng):
+    for scd_mode in [False, True]:
+        gts, props = random_map(rng, 25, 30, scd_mode=scd_mode)
+        thresholds = [0.0, 0.3, 0.45, 0.6, 0.9]
+        sweep = OMQ(scd_mode=scd_mode).sweep_thresholds(gts, props, thresholds)
+        for i, t in enumerate(thresholds):
+            omq = OMQ(scd_mode=scd_mode, assignment={'backend': 'sparse'})
+            omq.score([(gts,
+                        [p for p in props if max(p['label_probs'][:-1]) >= t])])
+            assert sweep['OMQ'][i] == pytest.approx(omq.get_current_score())
+            assert (sweep['TP'][i], sweep['FP'][i],
+                    sweep['FN'][i]) == omq.get_assignment_counts()
+
+
+def test_tiled_scores_match_untiled(rng):
+    for scd_mode in [False, True]:
+        maps = [random_map(rng, 30, 35, scd_mode=scd_mode) for _ in range(2)]
+        for batched in [False, True]:
+            plain = OMQ(scd_mode=scd_mode, batched=batched)
+            expected = plain.score(maps)
+            for workers in [1, 4]:
+                tiled = OMQ(scd_mode=scd_mode,
+                            batched=batched,
+                            tiling={
+                                'max_bytes': 5000,
+                                'workers': workers
+                            })
+                assert tiled.score(maps) == expected
+                assert tiled.get_partial().to_dict(
+                ) == plain.get_partial().to_dict()
+
+
+def test_skipped_ious_match_the_reference(rng):
+    # Proposals without probability for most classes skip the IoU of every
+    # pair with a ground-truth object of those classes, without changing any
+    # quality or score
+    gts, props = random_map(rng, 30, 35, num_classes=6)
+    for p in props:
+        probs = np.array(p['label_probs'])
+        probs[np.argsort(probs)[:-2]] = 0
+        p['label_probs'] = (probs / probs.sum()).tolist()
+    omq = OMQ(verify={'fraction': 1.0, 'tolerance': 0.0})
+    omq.score([(gts, props)])
+    labels = np.array([g['class_id'] for g in gts])
+    zero = np.array([[p['label_probs'][l] == 0 for p in props] for l in labels])
+    assert omq.get_pair_counts() == (zero.size, np.count_nonzero(zero))
+    assert omq.get_verification()['maps'] == 1
+
+
+@pytest.mark.filterwarnings('error::DeprecationWarning')
+def test_reference_qualities_avoid_removed_numpy_aliases(rng):
+    # np.float & np.int were removed in numpy 1.24 (& deprecated before)
+    gts, props = random_map(rng, 5, 6)
+    spatial = omq_module._calc_spatial_qual(
+        omq_module._vectorize_map_gts(gts, False)[0],
+        omq_module._vectorize_map_props(props, False)[0])
+    assert spatial.dtype == np.float64
+    assert OMQ().score([(gts, props)]) > 0
+
+
+def test_verification_catches_a_broken_fast_path(rng, monkeypatch):
+    maps = [random_map(rng, 10, 12) for _ in range(5)]
+    omq = OMQ(batched=True, verify={'fraction': 1.0, 'seed': 0})
+    omq.score(maps)
+    verification = omq.get_verification()
+    assert verification['maps'] == 5
+    assert max(verification['tables'].values()) <= 1e-6
+
+    aligned = omq_module.calc_spatial_qual_aligned
+    monkeypatch.setattr(omq_module, 'calc_spatial_qual_aligned',
+                        lambda *args: 0.9 * aligned(*args))
+    with pytest.raises(ValueError):
+        OMQ(batched=True, verify={'fraction': 1.0}).score(maps)
+
+
+def test_headline_components_match_full_scores(rng):
+    for scd_mode in [False, True]:
+        maps = [random_map(rng, 20, 25, scd_mode=scd_mode) for _ in range(3)]
+        full = OMQ(scd_mode=scd_mode)
+        full.score(maps)
+        for batched in [False, True]:
+            headline = OMQ(scd_mode=scd_mode,
+                           batched=batched,
+                           components=['OMQ'])
+            assert headline.score(maps) == pytest.approx(
+                full.get_current_score())
+            assert headline.get_avg_fp_score() == pytest.approx(
+                full.get_avg_fp_score())
+            for getter in [
+                    headline.get_avg_label_score,
+                    headline.get_avg_spatial_score,
+                    headline.get_per_class_scores
+            ]:
+                with pytest.raises(ValueError):
+                    getter()
+        label = OMQ(scd_mode=scd_mode, components=['OMQ', 'avg_label'])
+        label.score(maps)
+        assert label.get_avg_label_score() == pytest.approx(
+            full.get_avg_label_score())
+
+
+def _resubmit(rng, props, scd_mode):
+    # A resubmission that moves, removes, duplicates & adds a few proposals,
+    # & lists them in a different order
+    props = [dict(p) for p in props]
+    for p in props[:3]:
+        p['centroid'] = (np.array(p['centroid']) + 0.2).tolist()
+    del props[5]
+    props.append(dict(props[10]))
+    props.extend(random_map(rng, 0, 2, scd_mode=scd_mode)[1])
+    return [props[i] for i in rng.permutation(len(props))]
+
+
+def test_resubmissions_match_evaluating_from_scratch(rng, tmp_path,
+                                                     monkeypatch):
+    # Re-evaluating from the first evaluation's states only calculates
+    # qualities for the proposals that changed, with identical scores
+    merged = []
+    merge_map_state = omq_module._merge_map_state
+
+    def count_new_props(gts, props, scd_mode, delta, *args, **kwargs):
+        merged.append(int(np.sum(delta['new_props'])))
+        return merge_map_state(gts, props, scd_mode, delta, *args, **kwargs)
+
+    monkeypatch.setattr(omq_module, '_merge_map_state', count_new_props)
+    for scd_mode in [False, True]:
+        maps = [random_map(rng, 20, 25, scd_mode=scd_mode) for _ in range(2)]
+        resubmitted = [(gts, _resubmit(rng, props, scd_mode))
+                       for gts, props in maps]
+        for backend in ['hungarian', 'sparse']:
+            options = dict(scd_mode=scd_mode, assignment={'backend': backend})
+            first = str(tmp_path / ('first_%s_%s.npz' % (scd_mode, backend)))
+            with MapStates(first) as states:
+                OMQ(states=states, **options).score(maps)
+
+            del merged[:]
+            with MapStates(previous_state_filename=first) as states:
+                delta = OMQ(states=states, **options)
+                score = delta.score(resubmitted)
+            # Moved, duplicated (twice), & added proposals are new
+            assert merged == [3 + 2 + 2] * len(maps)
+
+            scratch = OMQ(**options)
+            assert score == scratch.score(resubmitted)
+            assert delta.get_assignment_counts(
+            ) == scratch.get_assignment_counts()
+            for k in ['overall', 'spatial', 'label', 'fp_cost']:
+                assert delta._partial.total(k) == scratch._partial.total(k)
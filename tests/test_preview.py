@@ -0,0 +1,56 @@
+import numpy as np
+
+from benchbot_eval.omq import OMQ
+from benchbot_eval.preview import (_hilbert_index, confidence_intervals,
+                                   evaluate_sample, sample_map)
+
+from helpers import random_map
+
+
+def test_hilbert_order_steps_between_neighbours():
+    for n in [2, 4, 16]:
+        cells = np.array([(x, y) for x in range(n) for y in range(n)])
+        ordered = cells[np.argsort(_hilbert_index(cells))]
+        assert np.all(np.abs(np.diff(ordered, axis=0)).sum(axis=1) == 1)
+
+
+def test_strata_are_spatially_compact(rng):
+    # Every run of 4 regions along the curve fits within a small block, no
+    # matter how large the map is
+    cells = np.array([(x, y) for x in range(32) for y in range(32)])
+    ordered = cells[np.argsort(_hilbert_index(cells))]
+    for i in range(0, len(ordered), 4):
+        run = ordered[i:i + 4]
+        assert np.all(np.ptp(run, axis=0) <= 3)
+
+
+def test_full_sample_partitions_the_map(rng):
+    gts, props = random_map(rng, 60, 70, size=20)
+    samples, num_regions = sample_map(gts, props, 1.0, rng=rng)
+    assert len(samples) == num_regions
+    assert sorted(id(o) for s, _ in samples for o in s) == sorted(
+        id(o) for o in gts)
+    assert sorted(id(o) for _, s in samples for o in s) == sorted(
+        id(o) for o in props)
+
+
+def test_sample_is_reproducible_and_sized(rng):
+    gts, props = random_map(rng, 200, 220, size=40)
+    a, num_regions = sample_map(gts, props, 0.25,
+                                rng=np.random.default_rng(1))
+    b, _ = sample_map(gts, props, 0.25, rng=np.random.default_rng(1))
+    assert [[id(o) for o in g + p] for g, p in a
+           ] == [[id(o) for o in g + p] for g, p in b]
+    assert len(a) == -(-num_regions // 4)
+
+
+def test_intervals_cover_the_estimate(rng):
+    maps = [random_map(rng, 150, 160, size=30)]
+    evaluator = OMQ()
+    partials, _ = evaluate_sample(evaluator, maps, 0.5,
+                                  rng=np.random.default_rng(0))
+    intervals = confidence_intervals(partials,
+                                     rng=np.random.default_rng(0))
+    lower, upper = intervals['OMQ']
+    assert lower <= evaluator.get_current_score() <= upper
+    assert 0 <= lower < upper <= 1
@@ -0,0 +1,182 @@
+import csv
+
+import numpy as np
+import pytest
+from shapely.geometry import Point, Polygon
+
+from benchbot_eval import omq
+from benchbot_eval.omq import OMQ
+from benchbot_eval.report import (ATTRIBUTION_COLUMNS, CandidateReport,
+                                  MatchReport, REPORT_COLUMNS)
+
+from helpers import random_map
+
+
+def read_report(filename):
+    with open(filename, 'r', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def test_report_rows_add_up_to_the_scores(rng, tmp_path):
+    for scd_mode in [False, True]:
+        filename = str(tmp_path / ('report_%s.csv' % scd_mode))
+        maps = [random_map(rng, 20, 25, scd_mode=scd_mode) for _ in range(3)]
+        with MatchReport(filename) as report:
+            report.source = 'test'
+            evaluator = OMQ(scd_mode=scd_mode, report=report)
+            evaluator.score(maps)
+        rows = read_report(filename)
+        assert list(rows[0]) == REPORT_COLUMNS
+        assert sorted(set(int(r['map']) for r in rows)) == [0, 1, 2]
+
+        counted = [r for r in rows if r['isgroup_exempt'] == '0']
+        assert tuple(
+            sum(r['type'] == t for r in counted)
+            for t in ['TP', 'FP', 'FN']) == evaluator.get_assignment_counts()
+        for column, key in [('overall', 'overall'), ('spatial', 'spatial'),
+                            ('fp_cost', 'fp_cost')]:
+            assert sum(float(r[column]) for r in counted) == pytest.approx(
+                evaluator._partial.total(key))
+
+
+def test_candidates_are_the_best_counterparts(rng, tmp_path):
+    # Candidates hold the k highest overall qualities of every row & column
+    # of a map's quality table, found without sorting the table
+    filename = str(tmp_path / 'candidates.npz')
+    k = 4
+    maps = [random_map(rng, 12, 15), random_map(rng, 3, 2)]
+    with CandidateReport(filename, k) as candidates:
+        OMQ(candidates=candidates).score(maps)
+    with np.load(filename) as report:
+        assert int(report['k']) == k
+        for i, (gts, props) in enumerate(maps):
+            quality = 1 - omq._gen_cost_tables(
+                gts, props, False,
+                gated=False)['overall'][:len(gts), :len(props)]
+            for prefix, q in [('gt', quality), ('prop', quality.T)]:
+                idxs = report['%d/%s_candidates' % (i, prefix)]
+                overall = report['%d/%s_overall' % (i, prefix)]
+                assert idxs.shape == overall.shape == (len(q), k)
+                best = -np.sort(-np.where(q > 0, q, 0), axis=1)[:, :k]
+                best = np.pad(best, [(0, 0), (0, k - best.shape[1])])
+                assert overall == pytest.approx(best)
+                for r in range(len(q)):
+                    valid = idxs[r] >= 0
+                    assert np.all(overall[r][~valid] == 0)
+                    assert q[r, idxs[r][valid]] == pytest.approx(
+                        overall[r][valid])
+
+
+def _map_totals(scd_mode, gts, props):
+    evaluator = OMQ(scd_mode=scd_mode)
+    score = evaluator.score([(gts, props)])
+    return {
+        'overall': evaluator._partial.total('overall'),
+        'fp_cost': evaluator._partial.total('fp_cost'),
+        'omq': score
+    }
+
+
+def test_attribution_matches_leave_one_out(rng, tmp_path):
+    # Every attribution column matches re-scoring the map from scratch
+    # without that object (up to the float32 precision of the quality tables)
+    for scd_mode in [False, True]:
+        filename = str(tmp_path / ('attribution_%s.csv' % scd_mode))
+        gts, props = random_map(rng, 15, 18, scd_mode=scd_mode, size=3.0)
+        for g in gts[:2]:
+            g['isgroup'] = True
+            g['extent'] = [2.0, 2.0, 1.0]
+        # Proposals of parts of an isgroup object, exempt from being FPs
+        for offset in [-0.4, 0.0, 0.4]:
+            props.append(dict(props[0],
+                              centroid=(np.array(gts[0]['centroid']) +
+                                        offset).tolist(),
+                              extent=[0.4, 0.4, 0.4]))
+        with MatchReport(filename, attribution=True) as report:
+            OMQ(scd_mode=scd_mode, report=report).score([(gts, props)])
+        rows = read_report(filename)
+        assert list(rows[0]) == REPORT_COLUMNS + ATTRIBUTION_COLUMNS
+        assert any(r['isgroup_exempt'] == '1' for r in rows)
+
+        base = _map_totals(scd_mode, gts, props)
+        for prefix, objs in [('gt', gts), ('prop', props)]:
+            deltas = {
+                int(r[prefix + '_idx']): r
+                for r in rows
+                if int(r[prefix + '_idx']) >= 0
+            }
+            assert sorted(deltas) == list(range(len(objs)))
+            for i in range(len(objs)):
+                others = objs[:i] + objs[i + 1:]
+                removed = (_map_totals(scd_mode, others, props)
+                           if prefix == 'gt' else _map_totals(
+                               scd_mode, gts, others))
+                for k in ['overall', 'fp_cost', 'omq']:
+                    assert float(deltas[i]['%s_delta_%s' % (
+                        prefix, k)]) == pytest.approx(removed[k] - base[k],
+                                                      abs=1e-6)
+
+
+def test_region_scores_match_filtered_report_rows(rng, tmp_path):
+    # Per-region totals match the report's rows filtered to each region (by
+    # ground-truth centroid, or proposal centroid for FPs), found with shapely
+    regions = [{
+        'name': 'west',
+        'centroid': [2.5, 5, 1],
+        'extent': [5, 10, 2]
+    }, {
+        'name': 'north_east',
+        'polygon': [[4, 5], [10, 5], [10, 10], [7, 10], [7, 8], [4, 8]],
+        'height_range': [0, 1.5]
+    }, {
+        'name': 'everywhere',
+        'polygon': [[-1, -1], [11, -1], [11, 11], [-1, 11]]
+    }]
+    filename = str(tmp_path / 'regions.csv')
+    maps = [random_map(rng, 40, 45) for _ in range(2)]
+    with MatchReport(filename) as report:
+        evaluator = OMQ(regions=regions, report=report)
+        score = evaluator.score(maps)
+    per_region = evaluator.get_per_region_scores()
+    assert per_region['region'].tolist() == [r['name'] for r in regions]
+    assert per_region['OMQ'][2] == pytest.approx(score)
+
+    def inside(region, centroid):
+        if 'polygon' not in region:
+            return np.all(
+                np.abs(np.subtract(centroid, region['centroid'])) <=
+                np.divide(region['extent'], 2))
+        low, high = region.get('height_range', [-np.inf, np.inf])
+        return (Polygon(region['polygon']).contains(Point(centroid[:2])) and
+                low <= centroid[2] <= high)
+
+    rows = [r for r in read_report(filename) if r['isgroup_exempt'] == '0']
+    for i, region in enumerate(regions):
+        counted = []
+        for r in rows:
+            gts, props = maps[int(r['map'])]
+            centroid = (props[int(r['prop_idx'])]['centroid']
+                        if r['type'] == 'FP' else gts[int(
+                            r['gt_idx'])]['centroid'])
+            if inside(region, centroid):
+                counted.append(r)
+        for t in ['TP', 'FP', 'FN']:
+            assert per_region[t][i] == sum(r['type'] == t for r in counted)
+        overall, fp_cost = (sum(float(r[k]) for r in counted)
+                            for k in ['overall', 'fp_cost'])
+        assert 0 < len(counted) < len(rows) or i == 2
+        assert per_region['OMQ'][i] == pytest.approx(
+            overall / (per_region['TP'][i] + per_region['FN'][i] + fp_cost))
+
+
+def test_candidate_ties_are_kept_in_column_order(rng):
+    # Values tied at the k-th highest are kept by column, exactly as a stable
+    # sort of every row would keep them
+    quality = rng.integers(0, 4, (200, 60)) / 4
+    quality[0] = 0.5
+    quality[1, 7] = 0.75
+    for k in [1, 3, 10]:
+        order = np.argsort(-quality, axis=1, kind='stable')[:, :k]
+        expected = np.where(
+            np.take_along_axis(quality, order, axis=1) > 0, order, -1)
+        assert np.array_equal(omq._top_k(quality, k), expected)